@@ -1,6 +1,65 @@
-from .behav import *
-from .general import *
-from .neural import *
-from .task import *
-from .utils_a import *
-from .preprocessing import *
+"""the analysis functions, e.g. `from analysis import compute_stats`
+- the submodules are imported on first use, s.t. importing a light function
+(e.g. `entropy` for exp_tz.py) doesn't import sklearn, pandas, etc.
+- a new public function must be listed below to be importable from here
+"""
+import importlib
+
+# the public names of each submodule
+_SUBMODULE_NAMES = {
+    'behav': [
+        'compute_acc', 'compute_mistake', 'compute_dk', 'average_by_part',
+        'get_tps_for_ith_part', 'compute_behav_metrics', 'get_baseline',
+    ],
+    'general': ['compute_stats', 'entropy', 'cosine_similarity'],
+    'neural': [
+        'compute_trsm', 'compute_cell_memory_similarity',
+        'batch_compute_similarities', 'create_sim_dict',
+        'compute_cell_memory_similarity_stats', 'compute_roc', 'compute_auc',
+        'compute_auc_mann_whitney', 'to_histogram', 'to_histograms',
+        'get_hist_info', 'get_hist_info_', 'compute_auc_over_time',
+        'build_yob', 'build_cv_ids',
+    ],
+    'task': [
+        'get_oq_keys', 'compute_true_dk', 'batch_compute_true_dk',
+        'compute_event_similarity_matrix', 'iter_event_similarity_matrix',
+        'compute_event_similarity',
+    ],
+    'utils_a': [
+        'one_hot_to_int', 'one_hot_to_int_batch', 'prop_true', 'make_df',
+    ],
+    'preprocessing': [
+        'remove_none', 'trim_data', 'compute_n_trials_to_skip',
+        'get_trial_cond_ids', 'process_cache', 'CacheRecorder',
+        'test_data_to_columns', 'stack_sequences', 'load_test_data',
+        'get_qsource', 'sep_by_qsource',
+    ],
+    'decoding': ['decode_features', 'decode_datasets'],
+    'isc': [
+        'get_subj_pairs', 'zscore', 'compute_pairwise_sisc',
+        'compute_pairwise_tisc', 'compute_pairwise_sw_tisc', 'pearsonr_rows',
+    ],
+}
+_NAME_TO_SUBMODULE = {
+    name: submodule
+    for submodule, names in _SUBMODULE_NAMES.items() for name in names
+}
+__all__ = list(_NAME_TO_SUBMODULE)
+
+
+def __getattr__(name):
+    if name in _NAME_TO_SUBMODULE:
+        submodule = importlib.import_module(
+            f'{__name__}.{_NAME_TO_SUBMODULE[name]}')
+        value = getattr(submodule, name)
+    elif name in _SUBMODULE_NAMES:
+        value = importlib.import_module(f'{__name__}.{name}')
+    else:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    # cache it, s.t. __getattr__ is only called once per name
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__ + list(_SUBMODULE_NAMES))
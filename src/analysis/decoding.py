@@ -0,0 +1,242 @@
+"""cross-validated decoding of task features from neural activity
+notes:
+- jobs are (dataset, fold, feature) triples, e.g. the datasets are subjects,
+all jobs of all datasets run on one pool, s.t. the workers are busy until
+the last dataset is done
+- the standardized data of a fold is shared by all features, each process
+keeps the fold of its last job, since jobs are ordered by (dataset, fold)
+- workers are forked processes that inherit the data, so only the job ids
+and the predictions are sent between processes
+"""
+import time
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from threadpoolctl import threadpool_limits
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+from analysis.neural import build_cv_ids
+
+# the data of the current decode_datasets call, inherited by the workers
+_shared = {}
+
+
+def decode_features(
+        X, Y, n_folds=5, Cs=np.logspace(-2, 10, num=6),
+        n_workers=1, warm_start=True, max_iter=1000, verbose=False
+):
+    """decode each feature from the neural activity w/ nested CV, i.e. the
+    l2 strength of a logistic regression is chosen by an inner CV on the
+    training folds; folds are formed by trials, all time points of a trial
+    are in the same fold
+
+    Parameters
+    ----------
+    X : 3d array, (n_trials, T, n_units)
+        neural activity, e.g. CM
+    Y : 3d array, (n_trials, T, n_features)
+        the labels of each feature, e.g. the output of build_yob
+    n_folds : int
+        the number of outer folds, the inner CV uses n_folds - 1 folds
+    Cs : 1d array
+        the inverse l2 strengths to search over
+    n_workers : int
+        the number of worker processes, 0 or 1 -> run in this process
+    warm_start : bool
+        whether to initialize the fit for each C from the solution for the
+        previous (smaller) C
+    max_iter : int
+        the max #iterations of the solver
+
+    Returns
+    -------
+    3d array, 2d array, dict
+        the predictions (n_trials, T, n_features), the chosen C for each
+        (fold, feature), and the wall time of the fit
+
+    """
+    results = decode_datasets(
+        {0: (X, Y)}, n_folds=n_folds, Cs=Cs, n_workers=n_workers,
+        warm_start=warm_start, max_iter=max_iter, verbose=verbose
+    )
+    return results[0]
+
+
+def decode_datasets(
+        datasets, n_folds=5, Cs=np.logspace(-2, 10, num=6),
+        n_workers=1, warm_start=True, max_iter=1000, callback=None,
+        verbose=False
+):
+    """`decode_features` for several datasets (e.g. subjects) on one pool
+
+    Parameters
+    ----------
+    datasets : dict
+        key -> (X, Y), see `decode_features`
+    callback : callable
+        if not None, callback(key, Yhat, best_C, runtime) is called in this
+        process once all jobs of a dataset are done, e.g. to save its results
+    others : see `decode_features`
+
+    Returns
+    -------
+    dict
+        key -> (Yhat, best_C, runtime), see `decode_features`; the fit time
+        of a dataset is the wall time until its last job was done
+
+    """
+    _shared.update(
+        n_folds=n_folds, Cs=np.sort(Cs), warm_start=warm_start,
+        max_iter=max_iter, fold_key=None, fold_data=None,
+        data={
+            key: {
+                'X': np.asarray(X), 'Y': np.asarray(Y),
+                'cvids': build_cv_ids(len(X), n_folds),
+            }
+            for key, (X, Y) in datasets.items()
+        },
+    )
+    jobs = [
+        (key, i, f) for key, data in _shared['data'].items()
+        for i in range(n_folds) for f in range(np.shape(data['Y'])[-1])
+    ]
+    # the results of each dataset, collected as its jobs are done
+    job_results = {key: [] for key in datasets}
+    n_jobs_left = {key: 0 for key in datasets}
+    for key, _, _ in jobs:
+        n_jobs_left[key] += 1
+    results = {}
+    time0 = time.time()
+
+    def collect(job, result):
+        key = job[0]
+        job_results[key].append((job, result))
+        n_jobs_left[key] -= 1
+        if n_jobs_left[key] == 0:
+            runtime = {'fit': time.time() - time0}
+            Yhat, best_C = _collect(key, job_results.pop(key))
+            results[key] = Yhat, best_C, runtime
+            if callback is not None:
+                callback(key, Yhat, best_C, runtime)
+
+    if n_workers > 1:
+        # fork, s.t. the workers inherit _shared
+        with ProcessPoolExecutor(
+                max_workers=n_workers, mp_context=mp.get_context('fork'),
+                initializer=_init_worker
+        ) as executor:
+            futures = {executor.submit(_decode_one, job): job for job in jobs}
+            for future in as_completed(futures):
+                collect(futures[future], future.result())
+    else:
+        for job in jobs:
+            collect(job, _decode_one(job))
+    _shared.clear()
+    if verbose:
+        print('decoding: %d datasets, %d jobs, %d workers | fit: %.2fs' % (
+            len(datasets), len(jobs), n_workers, time.time() - time0))
+    return results
+
+
+def _collect(key, job_results):
+    """the predictions and the chosen Cs of a dataset, from its job results"""
+    Y, cvids = _shared['data'][key]['Y'], _shared['data'][key]['cvids']
+    Yhat = np.zeros(np.shape(Y))
+    best_C = np.zeros((_shared['n_folds'], np.shape(Y)[-1]))
+    for (_, i, f), (Y_hat_te, best_C_if) in job_results:
+        Yhat[cvids == i, :, f] = Y_hat_te
+        best_C[i, f] = best_C_if
+    return Yhat, best_C
+
+
+def _init_worker():
+    # one blas thread per worker, to avoid oversubscription
+    threadpool_limits(1)
+
+
+def _get_fold_data(key, i):
+    """the standardized train/test data of the i-th fold of a dataset, reused
+    by all features; only the last fold is kept
+    """
+    if _shared['fold_key'] != (key, i):
+        X, cvids = _shared['data'][key]['X'], _shared['data'][key]['cvids']
+        X_tr = np.reshape(X[cvids != i], (-1, np.shape(X)[-1]))
+        X_te = np.reshape(X[cvids == i], (-1, np.shape(X)[-1]))
+        # normalize, the test set is standardized by its own statistics
+        X_tr = StandardScaler().fit_transform(X_tr)
+        X_te = StandardScaler().fit_transform(X_te)
+        # inner cv, by trials, all time points of a trial in the same fold
+        n_tr = np.sum(cvids != i)
+        icvids = np.repeat(
+            build_cv_ids(n_tr, _shared['n_folds'] - 1), np.shape(X)[1])
+        _shared['fold_key'] = (key, i)
+        _shared['fold_data'] = X_tr, X_te, icvids
+    return _shared['fold_data']
+
+
+def _decode_one(job):
+    key, i, f = job
+    X_tr, X_te, icvids = _get_fold_data(key, i)
+    cvids, Y = _shared['data'][key]['cvids'], _shared['data'][key]['Y']
+    Y_tr = np.reshape(Y[cvids != i, :, f], (-1))
+    Y_te_shape = np.shape(Y[cvids == i, :, f])
+    # choose C by the inner cv
+    Cs = _shared['Cs']
+    scores = np.zeros((len(np.unique(icvids)), len(Cs)))
+    for j, ij in enumerate(np.unique(icvids)):
+        scores[j] = _fit_score_path(
+            X_tr[icvids != ij], Y_tr[icvids != ij],
+            X_tr[icvids == ij], Y_tr[icvids == ij]
+        )
+    # the 1st best C, as in GridSearchCV
+    best_C = Cs[np.argmax(np.mean(scores, axis=0))]
+    # refit on all training data, predict on the test set
+    model = _fit(X_tr, Y_tr, best_C)
+    return np.reshape(model.predict(X_te), Y_te_shape), best_C
+
+
+def _fit_score_path(X_tr, Y_tr, X_va, Y_va):
+    """the validation accuracy for each C, if warm start, the fit for each C
+    starts from the solution for the previous C
+    """
+    Cs = _shared['Cs']
+    model = None
+    scores = np.zeros(len(Cs))
+    for k, C in enumerate(Cs):
+        if model is None or not _shared['warm_start']:
+            model = _fit(X_tr, Y_tr, C)
+        else:
+            model.set_params(C=C)
+            model.fit(X_tr, Y_tr)
+        scores[k] = model.score(X_va, Y_va)
+    return scores
+
+
+def _fit(X, Y, C):
+    # a single class can't be fit, predict that class
+    if len(np.unique(Y)) == 1:
+        return _ConstantClassifier(Y[0])
+    # l2 regularized, the default penalty
+    model = LogisticRegression(
+        C=C, solver='lbfgs', max_iter=_shared['max_iter'],
+        warm_start=_shared['warm_start'],
+    )
+    return model.fit(X, Y)
+
+
+class _ConstantClassifier():
+
+    def __init__(self, y):
+        self.y = y
+
+    def set_params(self, **kwargs):
+        return self
+
+    def fit(self, X, Y):
+        return self
+
+    def predict(self, X):
+        return np.full(len(X), self.y)
+
+    def score(self, X, Y):
+        return np.mean(Y == self.y)
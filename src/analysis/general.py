@@ -1,6 +1,5 @@
 import torch
 import numpy as np
-from scipy.stats import sem
 
 
 def compute_stats(matrix, axis=0, n_se=2, omitnan=False):
@@ -21,6 +20,8 @@ def compute_stats(matrix, axis=0, n_se=2, omitnan=False):
         Description of returned object.
 
     """
+    # import scipy on first use, it is slow to import
+    from scipy.stats import sem
     if omitnan:
         mu_ = np.nanmean(matrix, axis=axis)
         er_ = sem(matrix, nan_policy='omit', axis=axis) * n_se
@@ -0,0 +1,162 @@
+"""inter-subject correlation (ISC) for all pairs of subjects at once
+notes:
+- the data of each subject is z-scored once, then a correlation is an inner
+product, s.t. all pairs are a single einsum
+- data is (..., n_subjs, n_dim, T), e.g. (n_trials, n_subjs, n_dim, T), the
+leading dims are processed in parallel
+"""
+import numpy as np
+from scipy.stats import t as t_distribution
+
+
+def get_subj_pairs(n_subjs):
+    """the (i, j) subject pairs, i < j, in the order of
+    itertools.combinations(range(n_subjs), 2)
+
+    Returns
+    -------
+    1d array, 1d array
+        the i and j of each pair
+
+    """
+    return np.triu_indices(n_subjs, k=1)
+
+
+def zscore(data, axis):
+    """center and scale data along axis s.t. the inner product of two
+    z-scored vectors is their pearson correlation
+
+    Parameters
+    ----------
+    data : nd array
+        the data
+    axis : int
+        the axis to correlate over
+
+    Returns
+    -------
+    nd array
+        the z-scored data, nan if constant along axis
+
+    """
+    data = data - np.mean(data, axis=axis, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return data / np.linalg.norm(data, axis=axis, keepdims=True)
+
+
+def compute_pairwise_sisc(data_a, data_b):
+    """spatial isc, for each time point, the correlation between the pattern
+    of subject i in data_a and the pattern of subject j in data_b
+
+    Parameters
+    ----------
+    data_a, data_b : nd array, (..., n_subjs, n_dim, T)
+        the data from two conditions (or the same data twice)
+
+    Returns
+    -------
+    nd array, (..., n_pairs, T)
+        the isc of each subject pair, the pairs are `get_subj_pairs`
+
+    """
+    za, zb = zscore(data_a, axis=-2), zscore(data_b, axis=-2)
+    isc = np.einsum('...idt,...jdt->...ijt', za, zb)
+    return _select_pairs(isc, np.shape(data_a)[-3])
+
+
+def compute_pairwise_tisc(data_a, data_b):
+    """temporal isc, for each dimension, the correlation between the time
+    course of subject i in data_a and the time course of subject j in data_b
+
+    Parameters
+    ----------
+    data_a, data_b : nd array, (..., n_subjs, n_dim, T)
+        the data from two conditions (or the same data twice)
+
+    Returns
+    -------
+    nd array, (..., n_pairs, n_dim)
+        the isc of each subject pair, the pairs are `get_subj_pairs`
+
+    """
+    za, zb = zscore(data_a, axis=-1), zscore(data_b, axis=-1)
+    isc = np.einsum('...idt,...jdt->...ijd', za, zb)
+    return _select_pairs(isc, np.shape(data_a)[-3])
+
+
+def compute_pairwise_sw_tisc(
+        data_a, data_b, win_size, t_start=0, t_stop=None, return_mean=True
+):
+    """sliding window temporal isc, the temporal isc within the windows
+    [t, t + win_size), for t in [t_start, t_stop - win_size); the window
+    sums are differences of cumulative sums, so each window is O(1)
+
+    Parameters
+    ----------
+    data_a, data_b : nd array, (..., n_subjs, n_dim, T)
+        the data from two conditions (or the same data twice)
+    win_size : int
+        the window size
+    t_start, t_stop : int
+        the time range of the windows
+    return_mean : bool
+        whether to average over the dimensions
+
+    Returns
+    -------
+    nd array, (..., n_pairs, n_windows) or (..., n_pairs, n_dim, n_windows)
+        the isc of each subject pair, for each window
+
+    """
+    n_subjs, _, T = np.shape(data_a)[-3:]
+    t_stop = T if t_stop is None else t_stop
+    ii, jj = get_subj_pairs(n_subjs)
+    x = data_a[..., ii, :, t_start:t_stop]
+    y = data_b[..., jj, :, t_start:t_stop]
+
+    def window_sums(z):
+        # the sums of z over the windows [t, t + win_size)
+        cumsum = np.cumsum(z, axis=-1)
+        cumsum = np.concatenate([np.zeros_like(cumsum[..., :1]), cumsum], -1)
+        n_windows = np.shape(z)[-1] - win_size
+        return cumsum[..., win_size:win_size + n_windows] - \
+            cumsum[..., :n_windows]
+
+    s_x, s_y = window_sums(x), window_sums(y)
+    cov = window_sums(x * y) - s_x * s_y / win_size
+    var_x = window_sums(x * x) - s_x ** 2 / win_size
+    var_y = window_sums(y * y) - s_y ** 2 / win_size
+    with np.errstate(invalid='ignore', divide='ignore'):
+        isc = cov / np.sqrt(var_x * var_y)
+    if return_mean:
+        return np.mean(isc, axis=-2)
+    return isc
+
+
+def pearsonr_rows(x, y):
+    """scipy.stats.pearsonr for each pair of rows of x and y
+
+    Parameters
+    ----------
+    x, y : nd array, (..., n)
+        the data
+
+    Returns
+    -------
+    (n-1)d array, (n-1)d array
+        the pearson r and the two-sided p value of each row
+
+    """
+    n = np.shape(x)[-1]
+    r = np.sum(zscore(x, axis=-1) * zscore(y, axis=-1), axis=-1)
+    r = np.clip(r, -1, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_val = r * np.sqrt((n - 2) / (1 - r ** 2))
+    p = 2 * t_distribution.sf(np.abs(t_val), n - 2)
+    return r, p
+
+
+def _select_pairs(isc_matrix, n_subjs):
+    """(..., n_subjs, n_subjs, _) -> (..., n_pairs, _)"""
+    ii, jj = get_subj_pairs(n_subjs)
+    return isc_matrix[..., ii, jj, :]
@@ -1,10 +1,8 @@
 import numpy as np
-import pandas as pd
-import torch.nn as nn
+import torch
 
-from sklearn import metrics
-from itertools import product
-from utils.utils_u import to_sqnp, to_np, to_sqpth, to_pth, chunk
+from scipy.stats import rankdata
+from utils.utils_u import to_np, to_pth, chunk
 from analysis import compute_stats
 from models.EM import compute_similarities, transform_similarities
 
@@ -34,26 +32,78 @@ def compute_cell_memory_similarity(
         C, V, inpt, leak, comp,
         kernel='cosine', recall_func='LCA'
 ):
+    """compute the similarity between the cell state and the memories, for
+    all examples and time points at once
 
+    Parameters
+    ----------
+    C : 3d array, (n_examples, n_timepoints, n_dim)
+        cell states
+    V : list or 3d array, (n_examples, n_memories, n_dim)
+        the memories, for each example, a list of tensors, or an array
+    inpt, leak, comp : 2d array, (n_examples, n_timepoints)
+        the LCA params
+    kernel : str
+        the similarity metric
+    recall_func : str
+        see `transform_similarities`
+
+    Returns
+    -------
+    3d array, 3d array, (n_examples, n_timepoints, n_memories)
+        the raw similarities, and the transformed (e.g. by LCA) similarities
+
+    """
     n_examples, n_timepoints, n_dim = np.shape(C)
-    n_memories = len(V[0])
-    # prealloc
-    sim_raw = np.zeros((n_examples, n_timepoints, n_memories))
-    sim_lca = np.zeros((n_examples, n_timepoints, n_memories))
-    for i in range(n_examples):
-        # compute similarity
-        for t in range(n_timepoints):
-            # compute raw similarity
-            sim_raw[i, t, :] = to_np(compute_similarities(
-                to_pth(C[i, t]), V[i], kernel))
-            # compute LCA similarity
-            sim_lca[i, t, :] = transform_similarities(
-                to_pth(sim_raw[i, t, :]), recall_func,
-                leak=to_pth(leak[i, t]),
-                comp=to_pth(comp[i, t]),
-                w_input=to_pth(inpt[i, t])
-            )
-    return sim_raw, sim_lca
+    C = to_pth(np.asarray(C))
+    if isinstance(V, list):
+        V = torch.stack([torch.stack(list(V_i)).view(-1, n_dim) for V_i in V])
+    else:
+        V = to_pth(np.asarray(V))
+    # compute raw similarity, n_examples x n_timepoints x n_memories
+    sim_raw = batch_compute_similarities(C, V, kernel)
+    # compute LCA similarity, each row has its own LCA params
+    sim_lca = transform_similarities(
+        sim_raw, recall_func,
+        leak=to_pth(np.asarray(leak)).unsqueeze(-1),
+        comp=to_pth(np.asarray(comp)).unsqueeze(-1),
+        w_input=to_pth(np.asarray(inpt)).unsqueeze(-1)
+    )
+    return to_np(sim_raw).astype(float), to_np(sim_lca).astype(float)
+
+
+def batch_compute_similarities(C, V, kernel='cosine'):
+    """compute the similarity between each row of C[i] and each row of V[i],
+    for all i; cosine similarity is a normalized matmul, see
+    `models.EM.compute_similarities` for the other metrics
+
+    Parameters
+    ----------
+    C : torch.tensor, (n, n_queries, n_dim)
+        queries
+    V : torch.tensor, (n, n_memories, n_dim)
+        memories
+
+    Returns
+    -------
+    torch.tensor, (n, n_queries, n_memories)
+        similarities
+
+    """
+    if kernel == 'cosine':
+        # same as F.cosine_similarity, the norms are clamped at eps
+        eps = 1e-8
+        C_hat = C / C.norm(dim=-1, keepdim=True).clamp(min=eps)
+        V_hat = V / V.norm(dim=-1, keepdim=True).clamp(min=eps)
+        return torch.bmm(C_hat, V_hat.transpose(1, 2))
+    # otherwise, compare all queries of an example with its memories
+    n, n_queries, n_dim = C.size()
+    V_rep = V.unsqueeze(1).expand(-1, n_queries, -1, -1)
+    sims = compute_similarities(
+        C.reshape(n * n_queries, n_dim),
+        V_rep.reshape(n * n_queries, -1, n_dim), kernel
+    )
+    return sims.view(n, n_queries, -1)
 
 
 def create_sim_dict(sim, cond_ids, n_targ=1):
@@ -119,31 +169,76 @@ def compute_roc(distrib_noise, distrib_signal):
 
     Parameters
     ----------
-    distrib_noise : 1d array
+    distrib_noise : 1d array, or (..., n_bins) array
         the noise distribution
-    distrib_signal : 1d array
+    distrib_signal : 1d array, or (..., n_bins) array
         the noise+signal distribution
 
     Returns
     -------
-    1d array, 1d array
+    1d array, 1d array, or (..., n_bins) arrays
         the roc curve: true positive rate, and false positive rate
 
     """
-    # assert len(distrib_noise) == len(distrib_signal)
-    # assert np.sum(distrib_noise) == np.sum(distrib_signal)
-    n_pts = len(distrib_noise)
-    tpr, fpr = np.zeros(n_pts), np.zeros(n_pts)
-    # slide the decision boundary from left to right
-    for b in range(n_pts):
-        fn, tp = np.sum(distrib_signal[:b]), np.sum(distrib_signal[b:])
-        tn, fp = np.sum(distrib_noise[:b]), np.sum(distrib_noise[b:])
-        # calculate TP rate and FP rate
-        tpr[b] = tp / (tp + fn)
-        fpr[b] = fp / (tn + fp)
+    distrib_noise = np.asarray(distrib_noise)
+    distrib_signal = np.asarray(distrib_signal)
+    # slide the decision boundary from left to right, the counts to the left
+    # of the b-th boundary are the cumsum up to bin b-1
+    fn = np.cumsum(distrib_signal, axis=-1) - distrib_signal
+    tn = np.cumsum(distrib_noise, axis=-1) - distrib_noise
+    n_signal = np.sum(distrib_signal, axis=-1, keepdims=True)
+    n_noise = np.sum(distrib_noise, axis=-1, keepdims=True)
+    # calculate TP rate and FP rate
+    tpr = (n_signal - fn) / n_signal
+    fpr = (n_noise - tn) / n_noise
     return tpr, fpr
 
 
+def compute_auc(tpr, fpr):
+    """compute the area under the roc curve(s) by the trapezoid rule, the
+    same as sklearn.metrics.auc(fpr, tpr) for a curve from `compute_roc`
+
+    Parameters
+    ----------
+    tpr, fpr : 1d array, or (..., n_bins) arrays
+        the roc curve(s), fpr is non-increasing
+
+    Returns
+    -------
+    float, or (...) array
+        the auc of each curve
+
+    """
+    tpr, fpr = np.asarray(tpr), np.asarray(fpr)
+    dx = fpr[..., :-1] - fpr[..., 1:]
+    return np.sum(dx * (tpr[..., :-1] + tpr[..., 1:]) / 2, axis=-1)
+
+
+def compute_auc_mann_whitney(acts_l, acts_r):
+    """compute the exact auc by the Mann-Whitney U statistic, w/o histogram
+    - auc = P(r > l) + P(r == l) / 2, for r ~ acts_r, l ~ acts_l
+    - nans are not supported
+
+    Parameters
+    ----------
+    acts_l : 1d array, (n_l,) or 2d array, (T x n_l)
+        the left distribution
+    acts_r : 1d array, (n_r,) or 2d array, (T x n_r)
+        the right distribution
+
+    Returns
+    -------
+    float, or 1d array (T,)
+        auc, over time
+
+    """
+    acts_l, acts_r = np.asarray(acts_l), np.asarray(acts_r)
+    n_l, n_r = np.shape(acts_l)[-1], np.shape(acts_r)[-1]
+    ranks = rankdata(np.concatenate([acts_l, acts_r], axis=-1), axis=-1)
+    u_r = np.sum(ranks[..., n_l:], axis=-1) - n_r * (n_r + 1) / 2
+    return u_r / (n_l * n_r)
+
+
 def to_histogram(
     array_1d,
     n_bins=100, histrange=(0, 1)
@@ -152,6 +247,35 @@ def to_histogram(
     return dist
 
 
+def to_histograms(array_2d, n_bins=100, histrange=(0, 1)):
+    """the histogram of each row, same as `to_histogram`, for all rows
+
+    Parameters
+    ----------
+    array_2d : 2d array, (n_rows, n)
+        the values, values outside histrange (or nan) are not counted
+
+    Returns
+    -------
+    2d array, (n_rows, n_bins)
+        the bin counts of each row
+
+    """
+    array_2d = np.asarray(array_2d, dtype=float)
+    n_rows = np.shape(array_2d)[0]
+    edges = np.linspace(histrange[0], histrange[1], n_bins + 1)
+    # the right edge belongs to the last bin, as in np.histogram
+    bin_ids = np.minimum(
+        np.searchsorted(edges, array_2d, side='right') - 1, n_bins - 1)
+    row_ids = np.broadcast_to(np.arange(n_rows)[:, None], np.shape(array_2d))
+    in_range = (array_2d >= edges[0]) & (array_2d <= edges[-1])
+    counts = np.bincount(
+        row_ids[in_range] * n_bins + bin_ids[in_range],
+        minlength=n_rows * n_bins
+    )
+    return counts.reshape(n_rows, n_bins)
+
+
 def get_hist_info(array_l, array_r, bins=50, hist_range=(0, 1)):
     dist_l, hist_info_l = get_hist_info_(array_l)
     dist_r, hist_info_r = get_hist_info_(array_r)
@@ -168,7 +292,7 @@ def get_hist_info_(array_1d, bins=50, hist_range=(0, 1)):
 
 def compute_auc_over_time(
         acts_l, acts_r,
-        n_bins=100, histrange=(0, 1)
+        n_bins=100, histrange=(0, 1), method='histogram'
 ):
     """compute roc, auc, over time
     - given the activity for the two conditions
@@ -185,6 +309,9 @@ def compute_auc_over_time(
         histogram bin
     histrange : 2-tuple
         histogram range
+    method : str
+        'histogram', the auc of the roc from the binned activity, or
+        'mann-whitney', the exact auc, then the roc is not computed (None)
 
     Returns
     -------
@@ -192,17 +319,17 @@ def compute_auc_over_time(
         roc, auc, over time
 
     """
-    event_len, n_examples = np.shape(acts_l)
-    # compute fpr, tpr
-    tprs = np.zeros((event_len, n_bins))
-    fprs = np.zeros((event_len, n_bins))
-    for t in range(event_len):
-        # compute the bin counts for each condition
-        dist_l = to_histogram(acts_l[t, :])
-        dist_r = to_histogram(acts_r[t, :])
-        tprs[t], fprs[t] = compute_roc(dist_l, dist_r)
+    if method == 'mann-whitney':
+        return None, None, compute_auc_mann_whitney(acts_l, acts_r)
+    elif method != 'histogram':
+        raise ValueError(f'Unrecognizable method: {method}')
+    # compute the bin counts for each condition, for all time points
+    dist_l = to_histograms(acts_l, n_bins=n_bins, histrange=histrange)
+    dist_r = to_histograms(acts_r, n_bins=n_bins, histrange=histrange)
+    # compute fpr, tpr, T x n_bins
+    tprs, fprs = compute_roc(dist_l, dist_r)
     # compute area under roc curves
-    auc = [metrics.auc(fprs[t], tprs[t]) for t in range(event_len)]
+    auc = compute_auc(tprs, fprs)
     return tprs, fprs, auc
 
 
@@ -1,6 +1,10 @@
 import numpy as np
-from utils.utils_u import to_sqnp
+import os
+import torch
+from copy import copy
+from utils.utils_u import to_np, to_sqnp
 from utils.constants import TZ_COND_DICT
+from utils.io import pickle_load_dict, get_columnar_path, load_columnar
 from analysis import compute_stats
 
 
@@ -38,35 +42,48 @@ def get_trial_cond_ids(log_cond):
 
 
 def process_cache(log_cache, T_total, p):
-    # prealloc
-    n_examples = len(log_cache)
-    inpt = np.full((n_examples, T_total), np.nan)
-    leak = np.full((n_examples, T_total), np.nan)
-    comp = np.full((n_examples, T_total), np.nan)
-    C = np.full((n_examples, T_total, p.net.n_hidden), np.nan)
-    H = np.full((n_examples, T_total, p.net.n_hidden), np.nan)
-    M = np.full((n_examples, T_total, p.net.n_hidden), np.nan)
-    CM = np.full((n_examples, T_total, p.net.n_hidden), np.nan)
-    DA = np.full((n_examples, T_total, p.net.n_hidden_dec), np.nan)
-    V = [None] * n_examples
-
-    for i in range(n_examples):
-        for t in range(T_total):
-            # unpack data for i,t
-            [vector_signal, scalar_signal, misc] = log_cache[i][t]
-            # [inpt_it] = scalar_signal
-            # [inpt_it, _, _] = scalar_signal
-            [inpt_it, leak_it, comp_it] = scalar_signal
-            [h_t, m_t, cm_t, des_act_t, V_i] = misc
-            # cache data to np array
-            # leak[i, t] = leak_it
-            # comp[i, t] = to_sqnp(comp_it)
-            inpt[i, t] = to_sqnp(inpt_it)
-            H[i, t, :] = to_sqnp(h_t)
-            M[i, t, :] = to_sqnp(m_t)
-            CM[i, t, :] = to_sqnp(cm_t)
-            DA[i, t, :] = to_sqnp(des_act_t)
-            V[i] = V_i
+    """turn the cache of run_tz into arrays, n_examples x T_total (x dim)
+
+    Parameters
+    ----------
+    log_cache : CacheRecorder or list
+        a structured cache, whose arrays are returned as is; or the nested
+        list cache, log_cache[i][t] is the cache of example i, time t
+    T_total : int
+        the number of time steps
+    p : P
+        the params
+
+    Returns
+    -------
+    list, list
+        [C, H, M, CM, DA, V], [inpt]
+
+    """
+    if isinstance(log_cache, CacheRecorder):
+        H, M, CM, DA, inpt = [
+            getattr(log_cache, name)[:, :T_total]
+            for name in ['H', 'M', 'CM', 'DA', 'inpt']
+        ]
+        V = log_cache.V
+    else:
+        n_examples = len(log_cache)
+        # the cache for all i,t, in the order of i,t
+        cells = [log_cache[i][t] for i in range(n_examples)
+                 for t in range(T_total)]
+
+        @torch.no_grad()
+        def stack_signal(signal):
+            # stack signal_it for all i,t, as a n_examples x T_total x dim array
+            signal = to_np(torch.stack(signal))
+            return signal.reshape(n_examples, T_total, -1).astype(float)
+        # cell = [vector_signal, scalar_signal, misc], where
+        # scalar_signal = [inpt, leak, comp], misc = [h, m, cm, dec_act, V]
+        inpt = stack_signal([cell[1][0] for cell in cells])[:, :, 0]
+        H, M, CM, DA = [
+            stack_signal([cell[2][k] for cell in cells]) for k in range(4)
+        ]
+        V = [log_cache[i][T_total - 1][2][4] for i in range(n_examples)]
     # compute cell state
     C = CM - M
     # pack data
@@ -76,6 +93,176 @@ def process_cache(log_cache, T_total, p):
     return activity, ctrl_param
 
 
+class CacheRecorder():
+    """a structured alternative to the nested list cache of run_tz, the
+    signals of all examples and time points are written to preallocated
+    arrays, n_examples x T_total (x dim), so `process_cache` returns them
+    w/o copying; time points beyond the length of an example are nan
+
+    Parameters
+    ----------
+    n_examples : int
+        the number of examples
+    T_total : int
+        the max number of time steps
+    n_hidden : int
+        the dim of H, M, CM
+    n_hidden_dec : int
+        the dim of DA
+
+    """
+
+    def __init__(self, n_examples, T_total, n_hidden, n_hidden_dec):
+        self.T_total = T_total
+        self.inpt = np.full((n_examples, T_total), np.nan, dtype=np.float32)
+        self.H, self.M, self.CM = [
+            np.full((n_examples, T_total, n_hidden), np.nan, dtype=np.float32)
+            for _ in range(3)
+        ]
+        self.DA = np.full(
+            (n_examples, T_total, n_hidden_dec), np.nan, dtype=np.float32)
+        # the memories at the last time point, for each example
+        self.V = [None] * n_examples
+
+    def __len__(self):
+        return len(self.V)
+
+    def __getitem__(self, ids):
+        """select a range of examples (e.g. trim_data), the arrays are views"""
+        assert isinstance(ids, slice), 'only slicing is supported'
+        record = copy(self)
+        for name in ['inpt', 'H', 'M', 'CM', 'DA', 'V']:
+            setattr(record, name, getattr(self, name)[ids])
+        return record
+
+    def record(self, ids, t, cache_t):
+        """record the cache of time t, as returned by agent.forward
+
+        Parameters
+        ----------
+        ids : int or list
+            the example id; or a batched cache, one example id for each row
+        t : int
+            the time point
+        cache_t : list
+            the cache
+
+        """
+        batched = not isinstance(ids, (int, np.integer))
+        shape = (len(ids),) if batched else ()
+        [_, scalar_signal, misc] = cache_t
+        self.inpt[ids, t] = to_np(scalar_signal[0]).reshape(shape)
+        if misc is None:
+            return
+        [h_t, m_t, cm_t, dec_act_t, em_vals] = misc
+        self.H[ids, t] = to_np(h_t).reshape(shape + (-1,))
+        self.M[ids, t] = to_np(m_t).reshape(shape + (-1,))
+        self.CM[ids, t] = to_np(cm_t).reshape(shape + (-1,))
+        self.DA[ids, t] = to_np(dec_act_t).reshape(shape + (-1,))
+        if em_vals is None:
+            return
+        # em_vals is one list of memories for each row, if batched
+        if batched:
+            for j, i in enumerate(ids):
+                self.V[i] = em_vals[j]
+        else:
+            self.V[ids] = em_vals
+
+
+def test_data_to_columns(test_data_dict, p):
+    """flatten the output of run_tz (w/ get_data=True) to dense arrays, one
+    for each signal, see `load_test_data`
+
+    Parameters
+    ----------
+    test_data_dict : dict
+        {'results': results, 'metrics': metrics, 'XY': XY}
+    p : P
+        the params
+
+    Returns
+    -------
+    dict, dict
+        signal name -> array; the metadata, i.e. the metrics
+
+    """
+    [dist_a, targ_a, log_cache, log_cond] = test_data_dict['results']
+    columns = {
+        'dist_a': np.asarray(dist_a), 'targ_a': np.asarray(targ_a),
+        'cond': np.asarray(log_cond),
+    }
+    if 'XY' in test_data_dict:
+        [X, Y] = test_data_dict['XY']
+        columns['X'], columns['Y'] = stack_sequences(X), stack_sequences(Y)
+        columns['T_total'] = np.array([len(X_i) for X_i in X])
+    # the model activity, if it was cached
+    if isinstance(log_cache, CacheRecorder) or log_cache[0] is not None:
+        T_total = len(log_cache[0]) if isinstance(log_cache, list) \
+            else log_cache.T_total
+        [C, H, M, CM, DA, V], [inpt] = process_cache(log_cache, T_total, p)
+        activity = {'C': C, 'H': H, 'M': M, 'CM': CM, 'DA': DA, 'inpt': inpt}
+        for name, signal in activity.items():
+            columns[name] = signal.astype(np.float32, copy=False)
+        # the memories, n_examples x n_memories x n_hidden, nan padded
+        columns['V_len'] = np.array([len(V_i) for V_i in V])
+        columns['V'] = np.full(
+            (len(V), max(columns['V_len']), p.net.n_hidden), np.nan,
+            dtype=np.float32)
+        for i, V_i in enumerate(V):
+            for j, v in enumerate(V_i):
+                columns['V'][i, j] = to_sqnp(v)
+    # some metrics are tensors, e.g. the supervised loss
+    meta = {'metrics': [
+        float(to_np(m)) if hasattr(m, 'detach') else float(m)
+        for m in test_data_dict['metrics']
+    ]}
+    return columns, meta
+
+
+def stack_sequences(sequences):
+    """stack a list of sequences (T_i x dim) to an array, n x max(T_i) x dim,
+    sequences shorter than max(T_i) are padded with nan at the end"""
+    T_max = max([len(seq) for seq in sequences])
+    stacked = np.full(
+        (len(sequences), T_max) + np.shape(sequences[0])[1:], np.nan)
+    for i, seq in enumerate(sequences):
+        stacked[i, :len(seq)] = seq
+    return stacked
+
+
+def load_test_data(fpath, p, signals=None):
+    """load the test data saved at fpath, only the signals requested
+    - the columnar format (a dir of .npy files, see utils.io.save_columnar)
+    is used if it exists, the arrays are memory-mapped
+    - otherwise, load the pickle file and convert it
+
+    Parameters
+    ----------
+    fpath : str
+        the path of the (pickle) test data file, see get_test_data_fname
+    p : P
+        the params
+    signals : list
+        a subset of 'dist_a', 'targ_a', 'cond', 'X', 'Y', 'T_total', 'C',
+        'H', 'M', 'CM', 'DA', 'inpt', 'V', 'V_len'; if None, load all signals
+
+    Returns
+    -------
+    dict
+        signal name -> array; and 'metrics' -> list
+
+    """
+    dirpath = get_columnar_path(fpath)
+    if os.path.exists(dirpath):
+        data, meta = load_columnar(dirpath, signals)
+    else:
+        data, meta = test_data_to_columns(pickle_load_dict(fpath), p)
+        if signals is not None:
+            data = {name: data[name] for name in signals}
+    data['metrics'] = meta['metrics']
+    return data
+
+
 '''data separator'''
 
 
@@ -1,6 +1,5 @@
 import numpy as np
-from itertools import product
-from analysis.utils_a import one_hot_to_int
+from analysis.utils_a import one_hot_to_int_batch
 
 
 def get_oq_keys(X_i, task, to_int=True):
@@ -8,8 +7,8 @@ def get_oq_keys(X_i, task, to_int=True):
 
     Parameters
     ----------
-    X_i : np array
-        a sample from SequenceLearning task
+    X_i : np array, (T, x_dim), or (n_samples, T, x_dim)
+        a sample (or samples of the same length) from SequenceLearning task
     task : object
         the SequenceLearning task that generated X_i
     to_int : bool
@@ -17,87 +16,48 @@ def get_oq_keys(X_i, task, to_int=True):
 
     Returns
     -------
-    list, list, list
+    array, array, array
         observation keys, query keys, observation values
 
     """
     # get the observation / query keys
-    o_key = X_i[:, :task.k_dim]
-    q_key = X_i[:, -task.k_dim:]
-    o_val = X_i[:, task.k_dim:task.k_dim + task.v_dim]
-    # convert to integer representation
+    o_key = X_i[..., :task.k_dim]
+    q_key = X_i[..., -task.k_dim:]
+    o_val = X_i[..., task.k_dim:task.k_dim + task.v_dim]
+    # convert to integer representation, np.nan if zero-hot
     if to_int:
-        o_key = [one_hot_to_int(o_key[t]) for t in range(len(o_key))]
-        q_key = [one_hot_to_int(q_key[t]) for t in range(len(q_key))]
-        o_val = [one_hot_to_int(o_val[t]) for t in range(len(o_val))]
+        o_key = one_hot_to_int_batch(o_key)
+        q_key = one_hot_to_int_batch(q_key)
+        o_val = one_hot_to_int_batch(o_val)
     return o_key, q_key, o_val
 
 
-def set_nanadd(input_set, new_element):
-    """set.add a new element, don't add np.nan
+def _compute_true_dk(o_key, q_key, o_val):
+    """compute ground truth uncertainty for a batch of trials
 
     Parameters
     ----------
-    input_set : set
-        a set of int
-    new_element : int
-        a new element to be added to the set
+    o_key : 3d array, (n_samples, T, k_dim)
+        the observed keys, one hot
+    q_key : 3d array, (n_samples, T, k_dim)
+        the queried keys, one hot
+    o_val : 3d array, (n_samples, T, v_dim)
+        the observed values, zero-hot if the value was removed
 
     Returns
     -------
-    set
-        the set updated by the new element
+    2d array, (n_samples, T)
+        whether the queried key at time t is unknown
 
     """
-    if not np.isnan(new_element):
-        input_set.add(new_element)
-    return input_set
-
-
-def _compute_true_dk(o_key, q_key, o_val, task):
-    """compute ground truth uncertainty for a trial
-
-    Parameters
-    ----------
-    o_key : list of int
-        Description of parameter `o_key`.
-    q_key : list of int
-        Description of parameter `q_key`.
-    o_val : list of int
-        Description of parameter `o_val`.
-    task : obj
-        the SL task
-
-    Returns
-    -------
-    type
-        Description of returned object.
-
-    """
-    assert task.n_parts == 2, 'this function only works for 2-part seq'
-    assert len(o_key) == len(q_key), 'obs seq length must match query seq'
-    T_total_ = len(o_key)
-    # T_part_ = T_total_ // task.n_parts
-    # prealloc
-    o_key_up_to_t, q_key_up_to_t = set(), set()
-    dk = np.ones(T_total_, dtype=bool)
-    # compute uncertainty info over time
-    for t in range(T_total_):
-        q_key_up_to_t = set_nanadd(q_key_up_to_t, q_key[t])
-        # if the observation is not nan (removed), consider it as an observed key
-        if not np.isnan(o_val[t]):
-            # if the key is not nan (due to delay), add it as an observed key
-            o_key_up_to_t = set_nanadd(o_key_up_to_t, o_key[t])
-        # if the query is in the observed key up to time t
-        if q_key[t] in o_key_up_to_t:
-            # shouldn't say don't know
-            dk[t] = False
-        # log info
-        # t_relative = np.mod(t, T_part_)
-        # print(f'time = {t}, {t_relative} / {T_total_} |  dk = {dk[t]}')
-        # print(o_key_up_to_t)
-        # print(q_key_up_to_t)
-    return dk
+    # if the observation is not removed, consider it as an observed key
+    # (a zero-hot key, due to delay, is not a key)
+    o_val_present = np.any(o_val != 0, axis=-1, keepdims=True)
+    observed = (o_key != 0) & o_val_present
+    # the observed keys up to time t
+    observed_up_to_t = np.logical_or.accumulate(observed, axis=1)
+    # if the query is in the observed key up to time t, shouldn't say dk
+    return ~np.any(observed_up_to_t & (q_key != 0), axis=-1)
 
 
 def compute_true_dk(X_i, task):
@@ -107,8 +67,8 @@ def compute_true_dk(X_i, task):
 
     Parameters
     ----------
-    X_i : np array
-        a sample from SequenceLearning task
+    X_i : np array, (T, x_dim), or (n_samples, T, x_dim)
+        a sample (or samples of the same length) from SequenceLearning task
     task : object
         the SequenceLearning task that generated X_i
 
@@ -119,24 +79,29 @@ def compute_true_dk(X_i, task):
 
     """
     assert task.n_parts == 2, 'this function only works for 2-part seq'
-    o_key, q_key, o_val = get_oq_keys(X_i, task, to_int=True)
-    T_total_ = len(o_key)
+    X_i = np.asarray(X_i)
+    X_b = X_i if X_i.ndim == 3 else X_i[None]
+    o_key, q_key, o_val = get_oq_keys(X_b, task, to_int=False)
+    T_total_ = np.shape(X_b)[1]
     T_part_ = T_total_ // task.n_parts
     dk = {}
-    dk['EM'] = _compute_true_dk(o_key, q_key, o_val, task)
+    dk['EM'] = _compute_true_dk(o_key, q_key, o_val)
     dk['WM'] = _compute_true_dk(
-        o_key[T_part_:], q_key[T_part_:], o_val[T_part_:], task
+        o_key[:, T_part_:], q_key[:, T_part_:], o_val[:, T_part_:]
     )
+    if X_i.ndim == 2:
+        dk = {k: dk_[0] for k, dk_ in dk.items()}
     return dk
 
 
 def batch_compute_true_dk(X, task, dtype=bool):
     """compute the uncertainty ground truth for a sample/batch of data
-    - a wrapper for `compute_true_dk()`
+    - samples are processed in groups of the same length, so X can be a list
+    of samples w/ different padding
 
     Parameters
     ----------
-    X : 3d array
+    X : 3d array, or a list of 2d arrays
         a sample from the SL task
     task : obj
         the SL task
@@ -150,21 +115,27 @@ def batch_compute_true_dk(X, task, dtype=bool):
     n_samples = len(X)
     dk_wm = np.zeros((n_samples, task.n_param), dtype=dtype)
     dk_em = np.zeros((n_samples, task.n_param * task.n_parts), dtype=dtype)
-    # dk = [compute_true_dk(X[i], task) for i in range(n_samples)]
-    # pred_time_mask = [None] * n_samples
-    for i in range(n_samples):
-        T_total_i = np.shape(X[i])[0]
-        T_part_i, pad_len_i, _, _ = task.get_time_param(T_total_i)
-        pred_time_mask_i = task.get_pred_time_mask(
-            T_total_i, T_part_i, pad_len_i)
+    # group the samples by length
+    T_totals = np.array([np.shape(X_i)[0] for X_i in X])
+    for T_total_g in np.unique(T_totals):
+        ids = np.where(T_totals == T_total_g)[0]
+        if isinstance(X, np.ndarray):
+            X_g = X[ids]
+        else:
+            X_g = np.stack([np.asarray(X[i]) for i in ids])
+        T_part_g, pad_len_g, _, _ = task.get_time_param(T_total_g)
+        pred_time_mask_g = task.get_pred_time_mask(
+            T_total_g, T_part_g, pad_len_g)
         # compute objective uncertainty, w/ or w/o EM
-        dk_i = compute_true_dk(X[i], task)
-        dk_wm[i] = dk_i['WM'][pred_time_mask_i[T_part_i:]]
-        dk_em[i] = dk_i['EM'][pred_time_mask_i]
+        dk_g = compute_true_dk(X_g, task)
+        dk_wm[ids] = dk_g['WM'][:, pred_time_mask_g[T_part_g:]]
+        dk_em[ids] = dk_g['EM'][:, pred_time_mask_g]
     return dk_wm, dk_em
 
 
-def compute_event_similarity_matrix(Y, normalize=False):
+def compute_event_similarity_matrix(
+        Y, normalize=False, max_lag=None, chunk_size=None
+):
     """compute the inter-event similarity matrix of a batch of data
 
     e.g.
@@ -178,28 +149,100 @@ def compute_event_similarity_matrix(Y, normalize=False):
         the target values
     normalize : bool
         whether to normalize by vector dim
+    max_lag : int or None
+        if not None, only compute the similarity between event i and the
+        event i - lag, for lag = 1, ..., max_lag
+    chunk_size : int or None
+        the number of rows computed at once, limits the size of the
+        intermediate arrays, see `iter_event_similarity_matrix`
 
     Returns
     -------
-    2d array (n_examples, n_examples)
-        the inter-event similarity matrix
+    2d array (n_examples, n_examples), or (n_examples, max_lag)
+        the inter-event similarity matrix, or the similarity to the previous
+        events, where [i, lag-1] is nan if i - lag < 0
 
     """
-    if len(np.shape(Y)) == 3:
-        Y_int = np.argmax(Y, axis=-1)
-    elif len(np.shape(Y)) == 2:
-        Y_int = Y
-    else:
-        raise ValueError('Invalid Y shape')
+    Y_int = _to_event_ints(Y)
+    n_samples = np.shape(Y_int)[0]
+    if max_lag is not None:
+        return _compute_event_similarity_lags(Y_int, max_lag, normalize)
     # prealloc
-    n_samples = np.shape(Y)[0]
     similarity_matrix = np.zeros((n_samples, n_samples))
-    for i, j in product(range(n_samples), range(n_samples)):
-        similarity_matrix[i, j] = compute_event_similarity(
-            Y_int[i], Y_int[j], normalize=normalize)
+    for row_start, block in iter_event_similarity_matrix(
+            Y_int, normalize=normalize, chunk_size=chunk_size):
+        similarity_matrix[row_start:row_start + len(block)] = block
     return similarity_matrix
 
 
+def iter_event_similarity_matrix(Y, normalize=False, chunk_size=None):
+    """iterate over the inter-event similarity matrix, a block of rows at a
+    time, s.t. the matrix can be summarized w/o holding it in memory, e.g.
+
+    for row_start, block in iter_event_similarity_matrix(Y, chunk_size=1000):
+        tril_sum += np.sum(np.tril(block, k=row_start - 1))
+
+    Parameters
+    ----------
+    Y : 3d array (n_examples, _, _) or 2d array (n_examples, _)
+        the target values
+    normalize : bool
+        whether to normalize by vector dim
+    chunk_size : int or None
+        the number of rows per block, all rows if None
+
+    Yields
+    -------
+    int, 2d array (chunk_size, n_examples)
+        the index of the 1st row, the block of the similarity matrix
+
+    """
+    Y_int = _to_event_ints(Y)
+    n_samples, event_len = np.shape(Y_int)
+    chunk_size = n_samples if chunk_size is None else chunk_size
+    # the #shared elements is the inner product of the one hot encodings
+    one_hot = _to_event_one_hot(Y_int)
+    for row_start in range(0, n_samples, chunk_size):
+        block = (one_hot[row_start:row_start + chunk_size] @ one_hot.T)
+        block = block.astype(float)
+        if normalize:
+            block /= event_len
+        yield row_start, block
+
+
+def _compute_event_similarity_lags(Y_int, max_lag, normalize):
+    n_samples, event_len = np.shape(Y_int)
+    similarity_lags = np.full((n_samples, max_lag), np.nan)
+    for lag in range(1, min(max_lag, n_samples - 1) + 1):
+        similarity_lags[lag:, lag - 1] = np.sum(
+            Y_int[lag:] == Y_int[:-lag], axis=1)
+    if normalize:
+        similarity_lags /= event_len
+    return similarity_lags
+
+
+def _to_event_ints(Y):
+    if len(np.shape(Y)) == 3:
+        return np.argmax(Y, axis=-1)
+    elif len(np.shape(Y)) == 2:
+        return np.asarray(Y)
+    raise ValueError('Invalid Y shape')
+
+
+def _to_event_one_hot(Y_int):
+    """one hot encode each (position, value) pair of the events, as float32,
+    which is exact for the #shared elements (< 2^24)
+    """
+    n_samples, event_len = np.shape(Y_int)
+    vals, val_ids = np.unique(Y_int, return_inverse=True)
+    val_ids = val_ids.reshape(n_samples, event_len)
+    n_vals = len(vals)
+    one_hot = np.zeros((n_samples, event_len * n_vals), dtype=np.float32)
+    cols = np.arange(event_len) * n_vals + val_ids
+    one_hot[np.arange(n_samples)[:, None], cols] = 1
+    return one_hot
+
+
 def compute_event_similarity(event_i, event_j, normalize=True):
     """compute the #shared elements for two arrays
     e.g.
@@ -1,5 +1,4 @@
 import numpy as np
-import pandas as pd
 
 
 def one_hot_to_int(one_hot_vector):
@@ -20,13 +19,36 @@ def one_hot_to_int(one_hot_vector):
     one_hot_index = np.where(one_hot_vector)[0]
     n_ones = len(one_hot_index)
     if n_ones == 1:
-        return int(one_hot_index)
+        return int(one_hot_index[0])
     elif n_ones == 0:
         return np.nan
     else:
         raise ValueError(f'Invalid one-hot vector: {one_hot_vector}')
 
 
+def one_hot_to_int_batch(one_hot_array):
+    """`one_hot_to_int` for the last axis of an array of one hot vectors
+
+    Parameters
+    ----------
+    one_hot_array : nd array, (..., dim)
+        one hot (or zero-hot) vectors
+
+    Returns
+    -------
+    (n-1)d array
+        the indices, np.nan for the zero-hot vectors
+
+    """
+    one_hot_array = np.asarray(one_hot_array)
+    n_ones = np.sum(one_hot_array != 0, axis=-1)
+    if np.any(n_ones > 1):
+        raise ValueError('Invalid one-hot vector(s)')
+    one_hot_index = np.argmax(one_hot_array != 0, axis=-1).astype(float)
+    one_hot_index[n_ones == 0] = np.nan
+    return one_hot_index
+
+
 def prop_true(bool_array, axis=0):
     """compute the proportion of truth values along a axis
 
@@ -63,6 +85,7 @@ def make_df(data_dict):
         a data frame: col1 = value; col2 = condition labels
 
     """
+    import pandas as pd
     # get sample size
     n_data = dict(zip(
         data_dict.keys(), [len(data) for data in data_dict.values()]
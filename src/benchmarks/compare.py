@@ -0,0 +1,66 @@
+"""compare two benchmark result files, saved by benchmarks.run
+e.g., from src/
+python -m benchmarks.compare base.json new.json --threshold 1.2
+- the ratio is new / base of the median runtime, > 1 is slower
+- exits w/ 1 if any benchmark is slower than threshold x base
+"""
+import sys
+import json
+import argparse
+
+
+def load_results(fpath):
+    """benchmark results, (benchmark, params) -> record"""
+    with open(fpath, 'r') as f:
+        output = json.load(f)
+    results = {
+        (r['benchmark'], json.dumps(r['params'], sort_keys=True)): r
+        for r in output['results']
+    }
+    return results, output['env']
+
+
+def compare(base, new, threshold=1.2):
+    """compare the median runtimes of the shared (benchmark, params)
+
+    Returns
+    -------
+    list
+        (benchmark, params, base median, new median, ratio) for the shared
+        records, and the keys of the regressions
+
+    """
+    rows, regressions = [], []
+    for key in base:
+        if key not in new:
+            continue
+        base_t, new_t = base[key]['median'], new[key]['median']
+        ratio = new_t / base_t if base_t > 0 else float('inf')
+        rows.append((*key, base_t, new_t, ratio))
+        if ratio > threshold:
+            regressions.append(key)
+    return rows, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base', type=str)
+    parser.add_argument('new', type=str)
+    parser.add_argument('--threshold', default=1.2, type=float,
+                        help='a ratio above this is a regression')
+    args = parser.parse_args()
+
+    base, base_env = load_results(args.base)
+    new, new_env = load_results(args.new)
+    print(f'base: {base_env["git_rev"]} ({base_env["time"]})')
+    print(f'new:  {new_env["git_rev"]} ({new_env["time"]})')
+    rows, regressions = compare(base, new, args.threshold)
+    for benchmark, params, base_t, new_t, ratio in rows:
+        flag = ' <-- slower' if ratio > args.threshold else ''
+        print('%-16s %-60s %10.3f %10.3f ms  x%.2f%s' % (
+            benchmark, params, base_t * 1e3, new_t * 1e3, ratio, flag))
+    only_in = set(base) ^ set(new)
+    if len(only_in) > 0:
+        print(f'{len(only_in)} records are not in both files')
+    print(f'{len(regressions)}/{len(rows)} slower than x{args.threshold}')
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,42 @@
+"""run the benchmarks, save the results as json
+e.g., from src/
+python -m benchmarks.run --out ../bench/base.json --quick 1
+python -m benchmarks.run --out ../bench/new.json --only run_tz analysis
+python -m benchmarks.compare ../bench/base.json ../bench/new.json
+"""
+import os
+import json
+import time
+import torch
+import argparse
+from benchmarks.suite import BENCHMARKS
+from benchmarks.timer import get_env_info
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--out', default='benchmarks.json', type=str)
+parser.add_argument(
+    '--only', default=list(BENCHMARKS), nargs='+', choices=list(BENCHMARKS),
+    help='the benchmarks to run')
+parser.add_argument('--quick', default=0, type=int,
+                    help='fewer sizes and repeats, for a quick check')
+parser.add_argument('--n_threads', default=1, type=int)
+args = parser.parse_args()
+
+if __name__ == "__main__":
+    # a fixed #threads, s.t. results are comparable across machines / runs
+    torch.set_num_threads(args.n_threads)
+    output = {'env': get_env_info(), 'args': vars(args), 'results': []}
+    for name in args.only:
+        time0 = time.time()
+        for record in BENCHMARKS[name](quick=bool(args.quick)):
+            record = {'benchmark': name, **record}
+            output['results'].append(record)
+            print('%-16s %-60s %10.3f ms' % (
+                name, json.dumps(record['params']), record['median'] * 1e3))
+        print(f'{name}: done | t: %.2fs' % (time.time() - time0))
+    out_dir = os.path.dirname(args.out)
+    if out_dir != '' and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with open(args.out, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f'saved: {args.out}')
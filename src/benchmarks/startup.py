@@ -0,0 +1,60 @@
+"""the time to import the entry points, in fresh interpreters
+e.g., from src/
+python -m benchmarks.startup --n_repeats 5
+- each statement runs in a new process, the time is the median wall time
+- also lists the heavy dependencies the statement imported
+"""
+import sys
+import argparse
+import subprocess
+import numpy as np
+
+STATEMENTS = [
+    'import torch',
+    'import exp_tz',
+    'import analysis',
+    'from analysis import compute_stats',
+    'from analysis import process_cache',
+    'from analysis import compute_auc_over_time',
+]
+HEAVY_MODULES = ['torch', 'scipy', 'sklearn', 'pandas']
+
+
+def time_statement(statement, n_repeats=5):
+    """import time of statement, median over n_repeats fresh interpreters
+
+    Returns
+    -------
+    float, list
+        the median wall time (sec), the heavy modules that were imported
+
+    """
+    # report the heavy modules that were imported, as the last output line
+    code = (
+        f'import time, sys\n'
+        f't0 = time.perf_counter()\n'
+        f'{statement}\n'
+        f'dt = time.perf_counter() - t0\n'
+        f'loaded = [m for m in {HEAVY_MODULES} if m in sys.modules]\n'
+        f'print(dt, *loaded)'
+    )
+    runtimes = []
+    for _ in range(n_repeats):
+        out = subprocess.run(
+            [sys.executable, '-c', code],
+            capture_output=True, text=True, check=True
+        ).stdout.split('\n')[-2].split()
+        runtimes.append(float(out[0]))
+    return np.median(runtimes), out[1:]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_repeats', default=5, type=int)
+    parser.add_argument('--statements', default=STATEMENTS, nargs='+')
+    args = parser.parse_args()
+
+    for statement in args.statements:
+        runtime, loaded = time_statement(statement, args.n_repeats)
+        print('%-42s %.3fs | loaded: %s' % (
+            statement, runtime, ', '.join(loaded)))
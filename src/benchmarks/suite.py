@@ -0,0 +1,230 @@
+"""the benchmarks, each one is a function that yields records, a record is
+the timing stats of one param setting, see `timer.time_it`
+- micro: LCALSTM.forward, EM.get_memory, lca_transform
+- macro: SequenceLearning.sample, run_tz, the analysis of the test data
+"""
+import torch
+import numpy as np
+from benchmarks.timer import time_it, seed_all
+from benchmarks.startup import time_statement
+from models import LCALSTM
+from models.EM import EM, LSHIndex, lca_transform
+from task import SequenceLearning
+from utils.params import P
+
+# the default sizes of the task and the model
+N_PARAM, N_BRANCH = 16, 4
+N_HIDDEN, N_HIDDEN_DEC = 194, 128
+
+
+def make_exp(
+        n_hidden=N_HIDDEN, dict_len=2, pad_len=0, seed=0,
+        similarity_max=.9, similarity_cap_lag=2
+):
+    """make the params, the task, the agent and the optimizer, as in
+    train-sl.py
+    """
+    seed_all(seed)
+    p = P(
+        exp_name='benchmark', n_param=N_PARAM, n_branch=N_BRANCH,
+        pad_len=pad_len, penalty=4, penalty_random=1, p_rm_ob_enc=.3,
+        n_hidden=n_hidden, n_hidden_dec=N_HIDDEN_DEC, dict_len=dict_len,
+    )
+    task = SequenceLearning(
+        n_param=p.env.n_param, n_branch=p.env.n_branch, pad_len=p.env.pad_len,
+        p_rm_ob_enc=p.env.p_rm_ob_enc, def_path=p.env.def_path,
+        def_prob=p.env.def_prob, def_tps=p.env.def_tps,
+        similarity_max=similarity_max, similarity_cap_lag=similarity_cap_lag,
+    )
+    agent = LCALSTM(
+        input_dim=task.x_dim, output_dim=p.a_dim, rnn_hidden_dim=n_hidden,
+        dec_hidden_dim=N_HIDDEN_DEC, dict_len=dict_len, cmpt=p.net.cmpt,
+    )
+    optimizer = torch.optim.Adam(agent.parameters(), lr=p.net.lr)
+    return p, task, agent, optimizer
+
+
+def fill_memory(em, n_memories):
+    em.encoding_off = False
+    for _ in range(n_memories):
+        em.save_memory(torch.randn(em.dim))
+    em.encoding_off = True
+
+
+def bench_lcalstm_forward(quick=False):
+    """the latency of one LCALSTM.forward step, w/ a full EM"""
+    n_hiddens = [64, N_HIDDEN] if quick else [32, 64, N_HIDDEN, 512]
+    for n_hidden in n_hiddens:
+        p, task, agent, _ = make_exp(n_hidden=n_hidden)
+        fill_memory(agent.em, agent.em.size)
+        agent.retrieval_on()
+        x_t = torch.randn(1, 1, agent.input_dim)
+        hc_0 = agent.get_init_states()
+        for grad in [True, False]:
+            def step():
+                with torch.set_grad_enabled(grad):
+                    agent.forward(x_t, hc_0)
+            yield {
+                'params': {'n_hidden': n_hidden, 'grad': grad},
+                **time_it(step, n_repeats=50 if quick else 200),
+            }
+
+
+def bench_em_get_memory(quick=False):
+    """the latency of EM.get_memory, as a function of #memories, for all
+    memories, the exact top k, and the top k of an LSHIndex
+    """
+    dict_lens = [2, 64] if quick else [2, 8, 64, 512, 4096]
+    top_k = 8
+    for dict_len in dict_lens:
+        retrievals = {'all': {}}
+        if dict_len > top_k:
+            retrievals['top_k'] = {'top_k': top_k}
+            retrievals['lsh'] = {
+                'top_k': top_k, 'index': LSHIndex(dict_len, N_HIDDEN)}
+        for retrieval, kwargs in retrievals.items():
+            seed_all(0)
+            em = EM(dict_len, N_HIDDEN, **kwargs)
+            fill_memory(em, dict_len)
+            em.retrieval_off = False
+            q = torch.randn(1, N_HIDDEN)
+            w_input = torch.tensor(.5)
+
+            def get_memory():
+                em.get_memory(q, leak=0, comp=.8, w_input=w_input)
+            # w/o the retrieval key for 'all', as in the earlier results
+            params = {'dict_len': dict_len}
+            if retrieval != 'all':
+                params['retrieval'] = retrieval
+            yield {
+                'params': params,
+                **time_it(get_memory, n_repeats=50 if quick else 200),
+            }
+
+
+def bench_lca_transform(quick=False):
+    """the latency of lca_transform, as a function of #units"""
+    n_unitss = [2, 64] if quick else [2, 8, 64, 512, 4096]
+    for n_units in n_unitss:
+        seed_all(0)
+        similarities = torch.rand(n_units)
+
+        def transform():
+            lca_transform(similarities, leak=0, comp=.8, w_input=.5)
+        yield {
+            'params': {'n_units': n_units},
+            **time_it(transform, n_repeats=50 if quick else 200),
+        }
+
+
+def bench_task_sample(quick=False):
+    """the time to sample a batch of event sequences, as a function of the
+    inter-event similarity cap (lower cap -> more rejections)
+    """
+    n_samples = 64
+    similarity_maxs = [.5, .9] if quick else [.35, .5, .75, .9]
+    lags = [2] if quick else [2, 4]
+    for similarity_max in similarity_maxs:
+        for lag in lags:
+            _, task, _, _ = make_exp(
+                similarity_max=similarity_max, similarity_cap_lag=lag)
+            seed_all(0)
+            stats = time_it(
+                lambda: task.sample(n_samples, to_torch=False),
+                n_repeats=3 if quick else 10, n_warmup=1
+            )
+            stats['throughput'] = n_samples / stats['median']
+            yield {
+                'params': {
+                    'similarity_max': similarity_max, 'lag': lag,
+                    'n_samples': n_samples
+                },
+                **stats,
+            }
+
+
+def bench_run_tz(quick=False):
+    """the time of one epoch of run_tz, for training (supervised and RL) and
+    testing
+    """
+    from exp_tz import run_tz
+    n_examples = 8 if quick else 32
+    modes = {
+        'train_sup': dict(supervised=True, learning=True, get_cache=False),
+        'train_rl': dict(supervised=False, learning=True, get_cache=False),
+        'test': dict(
+            supervised=False, learning=False, get_data=True,
+            record_cache=True),
+    }
+    for mode, kwargs in modes.items():
+        p, task, agent, optimizer = make_exp()
+
+        def run_epoch():
+            run_tz(agent, optimizer, task, p, n_examples, **kwargs)
+        stats = time_it(run_epoch, n_repeats=2 if quick else 5, n_warmup=1)
+        stats['throughput'] = n_examples / stats['median']
+        yield {'params': {'mode': mode, 'n_examples': n_examples}, **stats}
+
+
+def bench_analysis(quick=False):
+    """the analysis of the test data: process_cache,
+    compute_cell_memory_similarity, compute_auc_over_time
+    """
+    from exp_tz import run_tz
+    from analysis import process_cache, compute_cell_memory_similarity, \
+        compute_auc_over_time
+    n_examples = 16 if quick else 64
+    p, task, agent, optimizer = make_exp()
+    for record_cache in [False, True]:
+        seed_all(0)
+        results, _ = run_tz(
+            agent, optimizer, task, p, n_examples, supervised=False,
+            learning=False, record_cache=record_cache
+        )
+        log_cache = results[2]
+        T_total = np.shape(results[0])[1]
+        yield {
+            'params': {
+                'func': 'process_cache', 'record_cache': record_cache,
+                'n_examples': n_examples},
+            **time_it(lambda: process_cache(log_cache, T_total, p),
+                      n_repeats=5 if quick else 20),
+        }
+    [C, H, M, CM, DA, V], [inpt] = process_cache(log_cache, T_total, p)
+    # the EM is full after a few examples
+    C, V, inpt = C[4:], V[4:], inpt[4:]
+    leak, comp = np.zeros(np.shape(inpt)), np.full(np.shape(inpt), .8)
+    yield {
+        'params': {
+            'func': 'compute_cell_memory_similarity',
+            'n_examples': len(C)},
+        **time_it(
+            lambda: compute_cell_memory_similarity(C, V, inpt, leak, comp),
+            n_repeats=5 if quick else 20),
+    }
+    seed_all(0)
+    acts_l, acts_r = np.random.rand(2, T_total, 256)
+    for method in ['histogram', 'mann-whitney']:
+        yield {
+            'params': {'func': 'compute_auc_over_time', 'method': method},
+            **time_it(
+                lambda: compute_auc_over_time(acts_l, acts_r, method=method),
+                n_repeats=5 if quick else 20),
+        }
+
+
+def bench_startup(quick=False):
+    """the time to import exp_tz, in a fresh interpreter"""
+    median, _ = time_statement('import exp_tz', 1 if quick else 5)
+    yield {'params': {'statement': 'import exp_tz'}, 'median': median}
+
+
+BENCHMARKS = {
+    'lcalstm_forward': bench_lcalstm_forward,
+    'em_get_memory': bench_em_get_memory,
+    'lca_transform': bench_lca_transform,
+    'task_sample': bench_task_sample,
+    'run_tz': bench_run_tz,
+    'analysis': bench_analysis,
+    'startup': bench_startup,
+}
@@ -0,0 +1,66 @@
+"""timing helpers for the benchmarks"""
+import os
+import sys
+import time
+import torch
+import platform
+import subprocess
+import numpy as np
+
+
+def time_it(func, n_repeats=20, n_warmup=2):
+    """time func(), w/o args
+
+    Parameters
+    ----------
+    func : callable
+        the function to time
+    n_repeats : int
+        the number of timed calls
+    n_warmup : int
+        the number of untimed calls before timing
+
+    Returns
+    -------
+    dict
+        the median, mean, min, std of the runtimes (sec), and n_repeats
+
+    """
+    for _ in range(n_warmup):
+        func()
+    runtimes = np.zeros(n_repeats)
+    for i in range(n_repeats):
+        time0 = time.perf_counter()
+        func()
+        runtimes[i] = time.perf_counter() - time0
+    return {
+        'median': float(np.median(runtimes)), 'mean': float(np.mean(runtimes)),
+        'min': float(np.min(runtimes)), 'std': float(np.std(runtimes)),
+        'n_repeats': n_repeats,
+    }
+
+
+def seed_all(seed):
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def get_env_info():
+    """the info needed to compare benchmark results across runs"""
+    try:
+        git_rev = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except OSError:
+        git_rev = None
+    return {
+        'git_rev': git_rev,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'n_cpus': os.cpu_count(),
+        'n_threads': torch.get_num_threads(),
+    }
@@ -1,27 +1,30 @@
 import os
-import torch
-import pickle
+import time
 import warnings
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import GridSearchCV, PredefinedSplit
-from sklearn.preprocessing import StandardScaler
 
 from task import SequenceLearning
-from analysis.neural import build_yob, build_cv_ids
+from analysis.neural import build_yob
+from analysis.decoding import decode_datasets
 from analysis.task import get_oq_keys
 from utils.params import P
 from utils.constants import TZ_COND_DICT
 from utils.io import build_log_path, pickle_load_dict, get_test_data_fname, \
-    pickle_save_dict, get_test_data_dir
+    pickle_save_dict, get_test_data_dir, test_data_exists, \
+    get_columnar_path, load_columnar_meta
 from analysis import compute_stats, compute_n_trials_to_skip, trim_data, \
-    get_trial_cond_ids, process_cache
+    get_trial_cond_ids, load_test_data
 warnings.filterwarnings("ignore")
 log_root = '../log'
-fpath = 'data/decode-results.pkl'
+results_fpath = 'data/decode-results.pkl'
+# the number of worker processes for the (subject, fold, feature) jobs
+n_workers = 8
+# decoding params
+n_folds = 5
+Cs = np.logspace(-2, 10, num=6)
 sns.set(style='white', palette='colorblind', context='poster')
 
 exp_name = 'vary-test-penalty'
@@ -59,47 +62,77 @@ p = P(
 # init a dummy task
 task = SequenceLearning(n_param=p.env.n_param, n_branch=p.env.n_branch)
 
-dacc = np.zeros((n_subjs, n_param, T))
-Yob_all, Yhat_all = [], []
-o_keys_p1_all, o_keys_p2_all = [], []
-for i_s in range(n_subjs):
-    # create logging dirs
-    np.random.seed(i_s)
+
+def get_subj_fpaths(i_s):
+    """the test data of subject i_s, and its decoding results, which are
+    saved next to the test data
+    """
     log_path, log_subpath = build_log_path(i_s, p, log_root, mkdir=False)
     test_data_fname = get_test_data_fname(n_examples_test, fix_cond=fix_cond)
     test_data_dir, _ = get_test_data_dir(log_subpath, epoch_load, test_params)
     fpath = os.path.join(test_data_dir, test_data_fname)
-    if not os.path.exists(fpath):
+    results_fpath_s = os.path.join(test_data_dir, 'decode-' + test_data_fname)
+    return fpath, results_fpath_s
+
+
+def get_decode_config(i_s, fpath):
+    """the params that the decoding results of subject i_s depend on, incl.
+    the config key of its test data (fpath), if it was made by eval-group.py
+    """
+    meta = load_columnar_meta(get_columnar_path(fpath)) or {}
+    return {
+        'exp_name': exp_name, 'penalty_train': penalty_train, 'subj_id': i_s,
+        'fix_cond': fix_cond, 'epoch_load': epoch_load,
+        'n_examples_test': n_examples_test, 'test_params': test_params,
+        'n_folds': n_folds, 'Cs': [float(C) for C in Cs],
+        'test_data_key': meta.get('config_key'),
+    }
+
+
+def load_subj_results(results_fpath_s, config):
+    """the saved decoding results of a subject, None if there are none or
+    they were made w/ another config
+    """
+    if not os.path.exists(results_fpath_s):
+        return None
+    subj_results = pickle_load_dict(results_fpath_s)
+    if subj_results.get('config') != config:
+        return None
+    return subj_results
+
+
+def prepare_subject(i_s, fpath):
+    """load the test data of subject i_s from fpath, and build the labels to
+    decode, None if no test data
+    """
+    runtime = {}
+    time0 = time.time()
+    np.random.seed(i_s)
+    if not test_data_exists(fpath):
         print('DNE')
-        continue
+        return None
     # load data
-    test_data_dict = pickle_load_dict(fpath)
-    [dist_a_, Y_, log_cache_, log_cond_] = test_data_dict['results']
-    [X_raw, Y_raw] = test_data_dict['XY']
-    [C, H, M, CM, DA, V], [inpt] = process_cache(log_cache_, T, p)
+    test_signals = [
+        'dist_a', 'targ_a', 'cond', 'X', 'Y', 'C', 'CM', 'inpt', 'V']
+    test_data = load_test_data(fpath, p, signals=test_signals)
+    [dist_a_, Y_, log_cond_, X_raw, Y_raw, C, CM, inpt, V] = [
+        test_data[name] for name in test_signals]
     n_examples_skip = compute_n_trials_to_skip(log_cond_, p)
     # trim data, wait until the model has 2EMs loaded
-    [dist_a, Y, log_cond, log_cache, X_raw, Y_raw, C, V, CM, inpt] = trim_data(
+    [dist_a, Y, log_cond, X_raw, Y_raw, C, V, CM, inpt] = trim_data(
         n_examples_skip,
-        [dist_a_, Y_, log_cond_, log_cache_, X_raw, Y_raw, C, V, CM, inpt]
+        [dist_a_, Y_, log_cond_, X_raw, Y_raw, C, V, CM, inpt]
     )
+    runtime['load'] = time.time() - time0
+    time0 = time.time()
     # process the data
     n_trials, _, _ = np.shape(Y_raw)
     trial_id = np.arange(n_trials)
 
-    # 0 -> dk; 1,2,3,4 -> events
-    actions = np.argmax(dist_a_, axis=-1)
-    # 1,2,3,4 -> events (after shifting by 1)
-    targets = np.argmax(Y_, axis=-1) + 1
-
     # build Yob
-    o_keys, o_vals = np.zeros((n_trials, T)), np.zeros((n_trials, T))
-    for i in trial_id:
-        o_keys[i], _, o_vals[i] = get_oq_keys(X_raw[i], task)
+    o_keys, _, o_vals = get_oq_keys(np.asarray(X_raw), task)
     o_keys_p1, o_keys_p2 = o_keys[:, :n_param], o_keys[:, n_param:]
     o_vals_p1, o_vals_p2 = o_vals[:, :n_param], o_vals[:, n_param:]
-    o_keys_p1_all.append(o_keys_p1)
-    o_keys_p2_all.append(o_keys_p2)
     Yob_p1 = build_yob(o_keys_p1, o_vals_p1)
     Yob_p2 = build_yob(o_keys_p2, o_vals_p2)
 
@@ -112,54 +145,65 @@ for i_s in range(n_subjs):
         # before recall time, work like part 1 (observation-based labeling)
         Yob_p2_dm[i, :rt[i], :] = Yob_p2[i, :rt[i], :]
     Yob = np.hstack([Yob_p1, Yob_p2_dm])
+    runtime['preprocess'] = time.time() - time0
+    return {
+        'CM': CM, 'Yob': Yob, 'runtime': runtime,
+        'o_keys_p1': o_keys_p1, 'o_keys_p2': o_keys_p2,
+    }
 
-    '''analysis'''
-    # print(f'X: # trials x # time points x # units: {np.shape(CM)}')
-    # print(f'Y: # trials x # time points x # features: {np.shape(Yob)}')
-    n_folds = 5
-    lrc = np.logspace(-2, 10, num=6)
-    cvids = build_cv_ids(n_trials, n_folds)
-    scaler = StandardScaler()
-    ridge_reg = LogisticRegression(
-        penalty='l2', max_iter=1000, solver='lbfgs', multi_class='multinomial'
-    )
 
-    # prealloc
-    Yhat = np.zeros(np.shape(Yob))
-
-    for f in range(n_param):
-        # choose the f-th feature
-        Yf = Yob[:, :, f]
-        for i in range(n_folds):
-            # split train/test
-            X_te = CM[cvids == i]
-            X_tr = CM[cvids != i]
-            Y_te = Yf[cvids == i]
-            Y_tr = Yf[cvids != i]
-            # inner cv
-            icvids = build_cv_ids(len(Y_tr), n_folds - 1)
-            gscv = GridSearchCV(
-                ridge_reg, param_grid={'C': lrc}, cv=PredefinedSplit(icvids),
-                return_train_score=True, refit=True
-            )
-            # reshape X train, Y train
-            X_tr_rs = np.reshape(X_tr, (-1, np.shape(X_tr)[-1]))
-            Y_tr_rs = np.reshape(Y_tr, (-1))
-            X_te_rs = np.reshape(X_te, (-1, np.shape(X_te)[-1]))
-            Y_te_rs = np.reshape(Y_te, (-1))
-            # normalize
-            X_tr_rs = scaler.fit_transform(X_tr_rs)
-            X_te_rs = scaler.fit_transform(X_te_rs)
-            # fit model
-            gscv.fit(X_tr_rs, Y_tr_rs)
-            # predict on the test set
-            Y_hat_te_rs = gscv.best_estimator_.predict(X_te_rs)
-            # store in the yhat matrix
-            Yhat[cvids == i, :, f] = np.reshape(Y_hat_te_rs, np.shape(Y_te))
-        # compute the decoding accuracy of feature f over time
-        dacc[i_s, f, :] = np.mean(Yhat[:, :, f] == Yf, axis=0)
-    Yob_all.append(Yob)
-    Yhat_all.append(Yhat)
+def save_subject(i_s, Yhat, best_C, runtime_decode):
+    """save the results of subject i_s, once all its decoding jobs are done"""
+    subj_data_s = subj_data.pop(i_s)
+    runtime = subj_data_s['runtime']
+    runtime.update(runtime_decode)
+    # compute the decoding accuracy of each feature over time
+    Yob = subj_data_s['Yob']
+    dacc_s = np.mean(Yhat == Yob, axis=0).T
+    print(f'subj {i_s}: ' + ' | '.join(
+        ['%s: %.2fs' % (stage, t) for stage, t in runtime.items()]))
+    subj_results[i_s] = {
+        'dacc': dacc_s, 'Yob': Yob, 'Yhat': Yhat, 'runtime': runtime,
+        'o_keys_p1': subj_data_s['o_keys_p1'],
+        'o_keys_p2': subj_data_s['o_keys_p2'],
+        'config': subj_data_s['config'],
+    }
+    pickle_save_dict(subj_results[i_s], subj_data_s['results_fpath'])
+
+
+# reuse the saved results, load the data of the other subjects
+subj_results, subj_data = {}, {}
+for i_s in range(n_subjs):
+    fpath, results_fpath_s = get_subj_fpaths(i_s)
+    config = get_decode_config(i_s, fpath)
+    subj_results_s = load_subj_results(results_fpath_s, config)
+    if subj_results_s is not None:
+        print(f'subj {i_s}: loaded decoding results')
+        subj_results[i_s] = subj_results_s
+        continue
+    subj_data_s = prepare_subject(i_s, fpath)
+    if subj_data_s is not None:
+        subj_data_s.update(config=config, results_fpath=results_fpath_s)
+        subj_data[i_s] = subj_data_s
+
+'''analysis'''
+# the (subject, fold, feature) jobs of all subjects on one pool, the results
+# of a subject are saved as soon as its jobs are done
+decode_datasets(
+    {i_s: (d['CM'], d['Yob']) for i_s, d in subj_data.items()},
+    n_folds=n_folds, Cs=Cs, n_workers=n_workers, callback=save_subject
+)
+
+dacc = np.zeros((n_subjs, n_param, T))
+Yob_all, Yhat_all = [], []
+o_keys_p1_all, o_keys_p2_all = [], []
+for i_s in sorted(subj_results):
+    subj_results_s = subj_results[i_s]
+    dacc[i_s] = subj_results_s['dacc']
+    Yob_all.append(subj_results_s['Yob'])
+    Yhat_all.append(subj_results_s['Yhat'])
+    o_keys_p1_all.append(subj_results_s['o_keys_p1'])
+    o_keys_p2_all.append(subj_results_s['o_keys_p2'])
 
 '''data io'''
 # save data
@@ -168,10 +212,10 @@ data_dict = {
     'o_keys_p1_all': o_keys_p1_all, 'o_keys_p2_all': o_keys_p2_all,
     # 'Yhat': Yhat, 'Yob': Yob
 }
-pickle_save_dict(data_dict, fpath)
+pickle_save_dict(data_dict, results_fpath)
 
 # load data
-data_dict = pickle_load_dict(fpath)
+data_dict = pickle_load_dict(results_fpath)
 Yhat_all = np.array(data_dict['Yhat_all'])
 Yob_all = np.array(data_dict['Yob_all'])
 o_keys_p1_all = data_dict['o_keys_p1_all']
@@ -10,7 +10,8 @@ from task import SequenceLearning
 from exp_tz import run_tz
 from utils.params import P
 from utils.constants import TZ_COND_DICT
-from utils.io import build_log_path, load_ckpt, load_env_metadata, pickle_load_dict
+from utils.io import build_log_path, load_ckpt, load_env_metadata, pickle_load_dict, \
+    load_scripted_ckpt
 from analysis import compute_acc, compute_dk, compute_mistake, trim_data, \
     compute_cell_memory_similarity, create_sim_dict,  process_cache,\
     batch_compute_true_dk,  get_trial_cond_ids, compute_n_trials_to_skip,\
@@ -71,6 +72,8 @@ similarity_min_test = 0
 fix_cond = None
 n_examples_test = 256
 subj_id = 0
+# run the TorchScript export of the ckpt, see models.scripted
+use_scripted = True
 
 p = P(
     exp_name=exp_name, sup_epoch=supervised_epoch,
@@ -106,6 +109,8 @@ agent = Agent(
     dict_len=p.net.dict_len
 )
 agent, optimizer = load_ckpt(epoch_load, log_subpath['ckpts'], agent)
+if use_scripted:
+    agent = load_scripted_ckpt(epoch_load, log_subpath['ckpts'], agent)
 
 # test the model
 np.random.seed(seed)
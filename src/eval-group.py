@@ -1,16 +1,23 @@
 import os
+import time
 import torch
 import numpy as np
+import multiprocessing as mp
 
 from itertools import product
+from concurrent.futures import ProcessPoolExecutor
 from models import LCALSTM as Agent
 # from models import LCALSTM_after as Agent
 # from models import LCALSTM_after as Agent
 from task import SequenceLearning
 from exp_tz import run_tz
+from analysis import test_data_to_columns
 from utils.params import P
-from utils.io import build_log_path, load_ckpt, pickle_save_dict, \
-    get_test_data_dir, get_test_data_fname, load_env_metadata
+from utils.constants import CKPT_TEMPLATE
+from utils.io import build_log_path, load_ckpt, save_columnar, \
+    get_test_data_dir, get_test_data_fname, load_env_metadata, \
+    get_columnar_path, get_test_config_key, test_data_cached, \
+    load_scripted_ckpt
 log_root = '../log/'
 
 # exp_name = 'vary-test-penalty'
@@ -77,83 +84,173 @@ all_conds = ['RM', 'DM', 'NM']
 scramble_options = [True, False]
 # scramble_options = [False]
 
+# run the TorchScript export of the ckpts (LCALSTM only), see models.scripted
+use_scripted = True
+# the number of worker processes, and the number of threads of each worker
+n_workers = 4
+n_threads = 1
+
+
+def get_params(subj_id, penalty_train):
+    p = P(
+        exp_name=exp_name, sup_epoch=supervised_epoch,
+        n_param=n_param, n_branch=n_branch, pad_len=pad_len_load,
+        def_prob=def_prob, n_def_tps=n_def_tps, enc_size=enc_size,
+        penalty=penalty_train, penalty_random=penalty_random,
+        attach_cond=attach_cond,
+        p_rm_ob_enc=p_rm_ob_enc_load, p_rm_ob_rcl=p_rm_ob_rcl_load,
+    )
+    # create logging dirs
+    log_path, log_subpath = build_log_path(
+        subj_id, p, log_root=log_root, mkdir=False, verbose=False
+    )
+    return p, log_subpath
+
+
+def get_test_data_fpath(log_subpath, fix_cond, fix_penalty,
+                        slience_recall_time, scramble):
+    test_params = [fix_penalty, pad_len_test, slience_recall_time]
+    test_data_dir, _ = get_test_data_dir(
+        log_subpath, epoch_load, test_params)
+    test_data_fname = get_test_data_fname(
+        n_examples_test, fix_cond, scramble)
+    if enc_size_test != enc_size:
+        test_data_dir = os.path.join(
+            test_data_dir, f'enc_size_test-{enc_size_test}'
+        )
+        if not os.path.exists(test_data_dir):
+            os.makedirs(test_data_dir)
+    return os.path.join(test_data_dir, test_data_fname)
+
+
+def get_test_config(job):
+    """all params that affect the test data, besides the weights"""
+    test_config = dict(job)
+    test_config.update(
+        agent=Agent.__name__, seed=seed, n_examples_test=n_examples_test,
+        pad_len_test=pad_len_test, enc_size_test=enc_size_test,
+        dict_len_test=dict_len_test, rm_mid_targ=rm_mid_targ,
+        p_rm_ob_enc_test=p_rm_ob_enc_test, p_rm_ob_rcl_test=p_rm_ob_rcl_test,
+        similarity_max_test=similarity_max_test,
+        similarity_min_test=similarity_min_test,
+        permute_observations=permute_observations, attach_cond=attach_cond,
+        use_scripted=use_scripted,
+    )
+    return test_config
+
+
+def run_test(job, fpath, config_key):
+    subj_id, penalty_train = job['subj_id'], job['penalty_train']
+    fix_cond, fix_penalty = job['fix_cond'], job['fix_penalty']
+    print(
+        f'\nsubj : {subj_id}, penalty : {penalty_train}, cond : {fix_cond}')
+    print(f'slience_recall_time : {job["slience_recall_time"]}')
+    print(f'penalty_test : {fix_penalty}')
+    p, log_subpath = get_params(subj_id, penalty_train)
+    # init env
+    env_data = load_env_metadata(log_subpath)
+    def_path = env_data['def_path']
+    p.env.def_path = def_path
+    p.update_enc_size(enc_size_test)
+
+    task = SequenceLearning(
+        n_param=p.env.n_param, n_branch=p.env.n_branch, pad_len=pad_len_test,
+        p_rm_ob_enc=p_rm_ob_enc_test, p_rm_ob_rcl=p_rm_ob_rcl_test,
+        similarity_max=similarity_max_test, similarity_min=similarity_min_test,
+        similarity_cap_lag=p.n_event_remember, permute_observations=permute_observations
+    )
+    # load the agent back
+    x_dim = task.x_dim
+    if attach_cond != 0:
+        x_dim += 1
+    agent = Agent(
+        input_dim=x_dim, output_dim=p.a_dim, rnn_hidden_dim=p.net.n_hidden,
+        dec_hidden_dim=p.net.n_hidden_dec, dict_len=dict_len_test
+    )
+
+    agent, optimizer = load_ckpt(
+        epoch_load, log_subpath['ckpts'], agent)
+    if use_scripted:
+        agent = load_scripted_ckpt(epoch_load, log_subpath['ckpts'], agent)
+
+    # training objective
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    [results, metrics, XY] = run_tz(
+        agent, optimizer, task, p, n_examples_test,
+        supervised=False, learning=False, get_data=True,
+        record_cache=True,
+        fix_cond=fix_cond, fix_penalty=fix_penalty,
+        slience_recall_time=job['slience_recall_time'],
+        scramble=job['scramble'], rm_mid_targ=rm_mid_targ
+    )
+
+    # save the data, w/ the key of the test config
+    test_data_dict = {
+        'results': results, 'metrics': metrics, 'XY': XY
+    }
+    columns, meta = test_data_to_columns(test_data_dict, p)
+    meta['config_key'] = config_key
+    save_columnar(get_columnar_path(fpath), columns, meta)
+    return fpath
+
+
+def run_test_(args):
+    return run_test(*args)
+
+
+def init_worker():
+    torch.set_num_threads(n_threads)
+
+
+'''find the conditions w/o up-to-date test data'''
+time0 = time.time()
+jobs_todo = []
+n_cached = 0
 for scramble in scramble_options:
     for slience_recall_time in slience_recall_times:
         for subj_id, penalty_train, fix_cond in product(subj_ids, penaltys_train, all_conds):
-            print(
-                f'\nsubj : {subj_id}, penalty : {penalty_train}, cond : {fix_cond}')
-            print(f'slience_recall_time : {slience_recall_time}')
-
             penaltys_test_ = penaltys_test[penaltys_test <= penalty_train]
             for fix_penalty in penaltys_test_:
-                print(f'penalty_test : {fix_penalty}')
-
-                p = P(
-                    exp_name=exp_name, sup_epoch=supervised_epoch,
-                    n_param=n_param, n_branch=n_branch, pad_len=pad_len_load,
-                    def_prob=def_prob, n_def_tps=n_def_tps, enc_size=enc_size,
-                    penalty=penalty_train, penalty_random=penalty_random,
-                    attach_cond=attach_cond,
-                    p_rm_ob_enc=p_rm_ob_enc_load, p_rm_ob_rcl=p_rm_ob_rcl_load,
-                )
-                # create logging dirs
-                log_path, log_subpath = build_log_path(
-                    subj_id, p, log_root=log_root, mkdir=False, verbose=False
+                job = dict(
+                    subj_id=int(subj_id), penalty_train=penalty_train,
+                    fix_cond=fix_cond, fix_penalty=int(fix_penalty),
+                    slience_recall_time=slience_recall_time,
+                    scramble=scramble,
                 )
-                # init env
-                env_data = load_env_metadata(log_subpath)
-                def_path = env_data['def_path']
-                p.env.def_path = def_path
-                p.update_enc_size(enc_size_test)
-
-                task = SequenceLearning(
-                    n_param=p.env.n_param, n_branch=p.env.n_branch, pad_len=pad_len_test,
-                    p_rm_ob_enc=p_rm_ob_enc_test, p_rm_ob_rcl=p_rm_ob_rcl_test,
-                    similarity_max=similarity_max_test, similarity_min=similarity_min_test,
-                    similarity_cap_lag=p.n_event_remember, permute_observations=permute_observations
-                )
-                # load the agent back
-                x_dim = task.x_dim
-                if attach_cond != 0:
-                    x_dim += 1
-                agent = Agent(
-                    input_dim=x_dim, output_dim=p.a_dim, rnn_hidden_dim=p.net.n_hidden,
-                    dec_hidden_dim=p.net.n_hidden_dec, dict_len=dict_len_test
-                )
-
-                agent, optimizer = load_ckpt(
-                    epoch_load, log_subpath['ckpts'], agent)
-
+                _, log_subpath = get_params(subj_id, penalty_train)
+                ckpt_fpath = os.path.join(
+                    log_subpath['ckpts'], CKPT_TEMPLATE % epoch_load)
                 # if data dir does not exsits ... skip
-                if agent is None:
-                    print('Agent DNE')
+                if not os.path.exists(ckpt_fpath):
+                    print(f'Agent DNE: {job}')
                     continue
-
-                # training objective
-                np.random.seed(seed)
-                torch.manual_seed(seed)
-                [results, metrics, XY] = run_tz(
-                    agent, optimizer, task, p, n_examples_test,
-                    supervised=False, learning=False, get_data=True,
-                    fix_cond=fix_cond, fix_penalty=fix_penalty,
-                    slience_recall_time=slience_recall_time, scramble=scramble,
-                    rm_mid_targ=rm_mid_targ
+                fpath = get_test_data_fpath(
+                    log_subpath, fix_cond, fix_penalty,
+                    slience_recall_time, scramble
                 )
+                # skip if the data was generated by the same weights, with
+                # the same test config
+                config_key = get_test_config_key(
+                    ckpt_fpath, get_test_config(job))
+                if test_data_cached(fpath, config_key):
+                    n_cached += 1
+                    continue
+                jobs_todo.append((job, fpath, config_key))
+print(f'{n_cached} cached, {len(jobs_todo)} to run | t: %.2fs' % (
+    time.time() - time0))
 
-                # save the data
-                test_params = [fix_penalty, pad_len_test, slience_recall_time]
-                test_data_dir, _ = get_test_data_dir(
-                    log_subpath, epoch_load, test_params)
-                test_data_fname = get_test_data_fname(
-                    n_examples_test, fix_cond, scramble)
-                test_data_dict = {
-                    'results': results, 'metrics': metrics, 'XY': XY
-                }
-                if enc_size_test != enc_size:
-                    test_data_dir = os.path.join(
-                        test_data_dir, f'enc_size_test-{enc_size_test}'
-                    )
-                    if not os.path.exists(test_data_dir):
-                        os.makedirs(test_data_dir)
-                fpath = os.path.join(test_data_dir, test_data_fname)
-                pickle_save_dict(test_data_dict, fpath)
+'''run the tests'''
+time0 = time.time()
+if n_workers > 1 and len(jobs_todo) > 1:
+    # fork, the script is not guarded by __main__
+    with ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=mp.get_context('fork'),
+            initializer=init_worker
+    ) as executor:
+        for fpath in executor.map(run_test_, jobs_todo):
+            print(f'saved: {fpath}')
+else:
+    for job_todo in jobs_todo:
+        print(f'saved: {run_test_(job_todo)}')
+print(f'{len(jobs_todo)} tests done | t: %.2fs' % (time.time() - time0))
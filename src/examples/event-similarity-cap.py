@@ -112,6 +112,7 @@ n_branch = 4
 n_samples = 256
 
 sim_mu = np.zeros((len(similarity_maxs), n_iter))
+acc_rates = np.zeros((len(similarity_maxs), n_iter))
 for i, similarity_max in enumerate(similarity_maxs):
     print(similarity_max)
     for j in range(n_iter):
@@ -123,12 +124,14 @@ for i, similarity_max in enumerate(similarity_maxs):
         X, Y, Misc = task.sample(n_samples, to_torch=False, return_misc=True)
         # record run time
         times[i, j] = time.time() - t0
+        acc_rates[i, j] = task.sampling_stats['acceptance_rate']
 
         # compute inter-event similarity
         similarity_matrix = compute_event_similarity_matrix(Y, normalize=True)
         similarity_matrix_tril = similarity_matrix[np.tril_indices(
             n_samples, k=-1)]
         sim_mu[i, j] = np.mean(similarity_matrix_tril)
+    print(f'acceptance rate = {np.mean(acc_rates[i]):.3f}')
 
 mu_t, er_t = compute_stats(times.T)
 mu_sim_mu, er_sim_mu = compute_stats(sim_mu.T)
@@ -172,6 +175,7 @@ for i, similarity_min in enumerate(similarity_mins):
         X, Y, Misc = task.sample(n_samples, to_torch=False, return_misc=True)
         # record run time
         times[i, j] = time.time() - t0
+        acc_rates[i, j] = task.sampling_stats['acceptance_rate']
 
         # compute inter-event similarity
         similarity_matrix = compute_event_similarity_matrix(Y, normalize=True)
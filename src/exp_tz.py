@@ -2,29 +2,56 @@ import torch
 import numpy as np
 import torch.nn.functional as F
 import pdb
-from copy import deepcopy
-from analysis import entropy
-from utils.utils_u import to_sqnp
+from analysis import entropy, CacheRecorder
+from utils.utils_u import to_np, to_sqnp
 from utils.constants import TZ_COND_DICT, P_TZ_CONDS
 from task.utils_t import scramble_array, scramble_array_list
 from models import get_reward, compute_returns, compute_a2c_loss
+from models.EM import EMBatch
+from utils.profiler import NULL_PROFILER
 
 
 def run_tz(
         agent, optimizer, task, p, n_examples, supervised,
         fix_cond=None, fix_penalty=None, slience_recall_time=None,
         scramble=False, learning=True, get_cache=True, get_data=False,
-        rm_mid_targ=False, noRL=False,
+        rm_mid_targ=False, noRL=False, data=None, record_cache=False,
+        profiler=None,
 ):
+    """run the twilight zone experiment on n_examples event sequences
+    - `get_cache` is True/False or an agent cache level, see `get_cache_level`
+    - `data` is the pre-sampled (X, Y), e.g. from a `Prefetcher`, if None,
+    then sample n_examples event sequences from the task
+    - if `record_cache`, the returned cache is a `CacheRecorder`, instead of
+    a nested list, see `analysis.process_cache`
+    - `profiler` is a `utils.profiler.Profiler`, to time and count the phases
+    of the run, off by default
+    - if not `learning`, the run is delegated to `run_tz_eval`
+    """
+    if not learning:
+        return run_tz_eval(
+            agent, task, p, n_examples, supervised, fix_cond=fix_cond,
+            fix_penalty=fix_penalty, slience_recall_time=slience_recall_time,
+            scramble=scramble, get_cache=get_cache, get_data=get_data,
+            rm_mid_targ=rm_mid_targ, data=data, record_cache=record_cache,
+            profiler=profiler,
+        )
+    profiler = NULL_PROFILER if profiler is None else profiler
+    # only cache what will be returned
+    agent.set_cache_level(get_cache_level(get_cache))
+    get_cache = agent.cache_level != 'off'
+    record_cache = record_cache and get_cache
     # sample data
-    X, Y = task.sample(n_examples, to_torch=True)
+    with profiler.phase('sample'):
+        X, Y = sample_data(task, n_examples, data)
     # logger
     log_return, log_pi_ent = 0, 0
     log_loss_sup, log_loss_actor, log_loss_critic = 0, 0, 0
     log_cond = np.zeros(n_examples,)
     log_dist_a = [[] for _ in range(n_examples)]
     log_targ_a = [[] for _ in range(n_examples)]
-    log_cache = [None] * n_examples
+    log_cache = make_log_cache(agent, X, record_cache)
+    watch_em = profiler.watch_em(agent.em)
 
     for i in range(n_examples):
         # pick a condition
@@ -48,7 +75,7 @@ def run_tz(
 
         # prealloc
         loss_sup = 0
-        probs, rewards, values, ents = [], [], [], []
+        probs, actions, penalties, values, ents = [], [], [], [], []
         log_cache_i = [None] * T_total
 
         # init model wm and em
@@ -69,7 +96,7 @@ def run_tz(
                 penalty_val, penalty_rep = penalty_val_p2, penalty_rep_p2
                 if rm_mid_targ and t_relative == 0:
                     # save memories and the start of p2 and pop midway target
-                    em_copy = deepcopy(agent.em.vals)
+                    em_copy = agent.em.get_vals()
                     mem_rmd = agent.em.remove_memory(-2)
 
             # testing condition
@@ -82,64 +109,81 @@ def run_tz(
 
             # forward
             x_it = append_info(X_i[t], [penalty_rep])
-            pi_a_t, v_t, hc_t, cache_t = agent.forward(
-                x_it.view(1, 1, -1), hc_t)
+            with profiler.phase('forward'), watch_em:
+                pi_a_t, v_t, hc_t, cache_t = agent.forward(
+                    x_it.view(1, 1, -1), hc_t)
             # after delay period, compute loss
-            a_t, p_a_t = agent.pick_action(pi_a_t)
-            # get reward
-            r_t = get_reward(a_t, Y_i[t], penalty_val)
-
-            # cache the results for later RL loss computation
-            rewards.append(r_t)
-            values.append(v_t)
-            probs.append(p_a_t)
-            ents.append(entropy(pi_a_t))
-            # compute supervised loss
-            yhat_t = torch.squeeze(pi_a_t)[:-1]
-            loss_sup += F.mse_loss(yhat_t, Y_i[t])
+            with profiler.phase('action'):
+                a_t, p_a_t = agent.pick_action(pi_a_t)
+
+            with profiler.phase('loss'):
+                # cache the results for later RL loss computation
+                actions.append(a_t)
+                penalties.append(penalty_val)
+                values.append(v_t)
+                probs.append(p_a_t)
+                ents.append(entropy(pi_a_t))
+                # compute supervised loss
+                yhat_t = torch.squeeze(pi_a_t)[:-1]
+                loss_sup += F.mse_loss(yhat_t, Y_i[t])
 
             if not supervised:
                 # update WM/EM bsaed on the condition
                 hc_t = cond_manipulation(cond_i, t, event_ends[0], hc_t, agent)
 
-            # cache results for later analysis
-            if get_cache:
-                log_cache_i[t] = cache_t
-            # for behavioral stuff, only record prediction time steps
-            if t % T_part >= pad_len:
-                log_dist_a[i].append(to_sqnp(pi_a_t))
-                log_targ_a[i].append(to_sqnp(Y_i[t]))
+            with profiler.phase('logging'):
+                # cache results for later analysis
+                if record_cache:
+                    log_cache.record(i, t, cache_t)
+                elif get_cache:
+                    log_cache_i[t] = cache_t
+                # for behavioral stuff, only record prediction time steps
+                if t % T_part >= pad_len:
+                    log_dist_a[i].append(to_sqnp(pi_a_t))
+                    log_targ_a[i].append(to_sqnp(Y_i[t]))
             # at the end, recover the removed midway memory
             if t == T_total - 1 and rm_mid_targ:
                 agent.em.vals = em_copy
 
-        # compute RL loss
-        returns = compute_returns(rewards, normalize=p.env.normalize_return)
-        loss_actor, loss_critic = compute_a2c_loss(probs, values, returns)
-        pi_ent = torch.stack(ents).sum()
-        # if learning and not supervised
-        if learning:
-            if noRL:
+        with profiler.phase('loss'):
+            # get rewards, for all time points at once
+            rewards = get_reward(
+                torch.stack(actions).view(-1), Y_i, torch.stack(penalties))
+            # compute RL loss
+            returns = compute_returns(
+                rewards, normalize=p.env.normalize_return)
+            loss_actor, loss_critic = compute_a2c_loss(probs, values, returns)
+            pi_ent = torch.stack(ents).sum()
+        # learn, the runs w/o learning go to run_tz_eval
+        if noRL:
+            loss = loss_sup
+        else:
+            if supervised:
                 loss = loss_sup
             else:
-                if supervised:
-                    loss = loss_sup
-                else:
-                    loss = loss_actor + loss_critic - pi_ent * p.net.eta
+                loss = loss_actor + loss_critic - pi_ent * p.net.eta
+        with profiler.phase('backward'):
             optimizer.zero_grad()
             loss.backward()
             torch.nn.utils.clip_grad_norm_(agent.parameters(), 1)
+        with profiler.phase('step'):
             optimizer.step()
 
         # after every event sequence, log stuff
-        log_loss_sup += loss_sup / n_examples
-        log_pi_ent += pi_ent.item() / n_examples
-        log_return += torch.stack(rewards).sum().item() / n_examples
-        log_loss_actor += loss_actor.item() / n_examples
-        log_loss_critic += loss_critic.item() / n_examples
-        log_cond[i] = TZ_COND_DICT.inverse[cond_i]
-        if get_cache:
-            log_cache[i] = log_cache_i
+        with profiler.phase('logging'):
+            log_loss_sup += loss_sup / n_examples
+            log_pi_ent += pi_ent.item() / n_examples
+            log_return += rewards.sum().item() / n_examples
+            log_loss_actor += loss_actor.item() / n_examples
+            log_loss_critic += loss_critic.item() / n_examples
+            log_cond[i] = TZ_COND_DICT.inverse[cond_i]
+            if get_cache and not record_cache:
+                log_cache[i] = log_cache_i
+        profiler.count('n_examples')
+        profiler.count('n_steps', T_total)
+
+    if get_cache:
+        profiler.count_cache(log_cache)
 
     # return cache
     log_dist_a = np.array(log_dist_a)
@@ -156,6 +200,478 @@ def run_tz(
     return out
 
 
+def run_tz_eval(
+        agent, task, p, n_examples, supervised=False,
+        fix_cond=None, fix_penalty=None, slience_recall_time=None,
+        scramble=False, get_cache=True, get_data=False,
+        rm_mid_targ=False, data=None, record_cache=False, profiler=None,
+):
+    """`run_tz` w/o learning, same inputs (minus the learning args) and
+    outputs, the agent and the sampled actions are the same as in `run_tz`
+    - the run is in inference mode, so no autograd graph is built
+    - the outputs of each time step are written to preallocated buffers, the
+    metrics are computed from the buffers once per event sequence, instead of
+    building the losses step by step
+    """
+    with torch.inference_mode():
+        out = _run_tz_eval(
+            agent, task, p, n_examples, supervised, fix_cond, fix_penalty,
+            slience_recall_time, scramble, get_cache, get_data, rm_mid_targ,
+            data, record_cache,
+            NULL_PROFILER if profiler is None else profiler,
+        )
+    # s.t. the memories can be used w/ autograd, e.g. for further training
+    agent.em.exit_inference_mode()
+    return out
+
+
+def _run_tz_eval(
+        agent, task, p, n_examples, supervised, fix_cond, fix_penalty,
+        slience_recall_time, scramble, get_cache, get_data, rm_mid_targ,
+        data, record_cache, profiler,
+):
+    # only cache what will be returned
+    agent.set_cache_level(get_cache_level(get_cache))
+    get_cache = agent.cache_level != 'off'
+    record_cache = record_cache and get_cache
+    # sample data
+    with profiler.phase('sample'):
+        X, Y = sample_data(task, n_examples, data)
+    # logger, each event sequence has n_parts x n_param prediction time steps
+    n_pred = task.n_parts * task.n_param
+    a_dim = agent.actor.out_features
+    log_return, log_pi_ent = 0, 0
+    log_loss_sup, log_loss_actor, log_loss_critic = 0, 0, 0
+    log_cond = np.zeros(n_examples,)
+    log_dist_a = np.zeros((n_examples, n_pred, a_dim), dtype=np.float32)
+    log_targ_a = np.zeros((n_examples, n_pred, a_dim - 1), dtype=np.float32)
+    log_cache = make_log_cache(agent, X, record_cache)
+    watch_em = profiler.watch_em(agent.em)
+
+    for i in range(n_examples):
+        # pick a condition
+        cond_i = pick_condition(p, rm_only=supervised, fix_cond=fix_cond)
+        # get the example for this trial
+        X_i, Y_i = X[i], Y[i]
+        if scramble:
+            X_i, Y_i = time_scramble(X_i, Y_i, task)
+        # get time info
+        T_total = np.shape(X_i)[0]
+        T_part, pad_len, event_ends, event_bonds = task.get_time_param(T_total)
+        enc_times = get_enc_times(p.net.enc_size, task.n_param, pad_len)
+
+        # attach cond flag
+        cond_flag = torch.zeros(T_total, 1)
+        cond_indicator = -1 if cond_i == 'NM' else 1
+        # if attach_cond == 1 then normal, if -1 then reversed
+        cond_flag[-T_part:] = cond_indicator * p.env.attach_cond
+        if p.env.attach_cond != 0:
+            X_i = torch.cat((X_i, cond_flag), 1)
+
+        # prealloc the outputs of each time step
+        dist_a_i = torch.zeros(T_total, a_dim)
+        values_i, log_probs_i = torch.zeros(T_total), torch.zeros(T_total)
+        actions_i = torch.zeros(T_total, dtype=torch.long)
+        log_cache_i = [None] * T_total
+
+        # init model wm and em
+        penalty_val_p1, penalty_rep_p1 = sample_penalty(p, fix_penalty, True)
+        penalty_val_p2, penalty_rep_p2 = sample_penalty(p, fix_penalty)
+
+        hc_t = agent.get_init_states()
+        agent.retrieval_off()
+        agent.encoding_off()
+
+        for t in range(T_total):
+            t_relative = t % T_part
+            in_2nd_part = t >= T_part
+
+            if not in_2nd_part:
+                penalty_rep = penalty_rep_p1
+            else:
+                penalty_rep = penalty_rep_p2
+                if rm_mid_targ and t_relative == 0:
+                    # save memories and the start of p2 and pop midway target
+                    em_copy = agent.em.get_vals()
+                    agent.em.remove_memory(-2)
+
+            # testing condition
+            if slience_recall_time is not None:
+                slience_recall(t_relative, in_2nd_part,
+                               slience_recall_time, agent)
+            # whether to encode
+            if not supervised:
+                set_encoding_flag(t, enc_times, cond_i, agent)
+
+            # forward
+            x_it = append_info(X_i[t], [penalty_rep])
+            with profiler.phase('forward'), watch_em:
+                pi_a_t, v_t, hc_t, cache_t = agent.forward(
+                    x_it.view(1, 1, -1), hc_t)
+            with profiler.phase('action'):
+                a_t, p_a_t = agent.pick_action(pi_a_t)
+
+            if not supervised:
+                # update WM/EM bsaed on the condition
+                hc_t = cond_manipulation(cond_i, t, event_ends[0], hc_t, agent)
+
+            with profiler.phase('logging'):
+                dist_a_i[t], values_i[t] = pi_a_t.view(-1), v_t.view(-1)
+                actions_i[t], log_probs_i[t] = a_t.view(-1), p_a_t.view(-1)
+                # cache results for later analysis
+                if record_cache:
+                    log_cache.record(i, t, cache_t)
+                elif get_cache:
+                    log_cache_i[t] = cache_t
+            # at the end, recover the removed midway memory
+            if t == T_total - 1 and rm_mid_targ:
+                agent.em.vals = em_copy
+
+        with profiler.phase('loss'):
+            # get rewards, for all time points at once
+            penalties = torch.where(
+                torch.arange(T_total) < T_part, penalty_val_p1, penalty_val_p2)
+            rewards = get_reward(actions_i, Y_i, penalties)
+            # the metrics of run_tz, w/o the graph
+            returns = compute_returns(
+                rewards, normalize=p.env.normalize_return)
+            loss_actor, loss_critic = compute_a2c_loss(
+                log_probs_i, values_i, returns)
+            loss_sup = F.mse_loss(
+                dist_a_i[:, :-1], Y_i, reduction='none').mean(dim=-1).sum()
+            pi_ent = - torch.sum(dist_a_i * torch.log2(dist_a_i))
+
+        # after every event sequence, log stuff
+        with profiler.phase('logging'):
+            # for behavioral stuff, only record prediction time steps
+            pred_t = torch.arange(T_total) % T_part >= pad_len
+            log_dist_a[i] = to_np(dist_a_i[pred_t])
+            log_targ_a[i] = to_np(Y_i[pred_t])
+            log_loss_sup += loss_sup.item() / n_examples
+            log_pi_ent += pi_ent.item() / n_examples
+            log_return += rewards.sum().item() / n_examples
+            log_loss_actor += loss_actor.item() / n_examples
+            log_loss_critic += loss_critic.item() / n_examples
+            log_cond[i] = TZ_COND_DICT.inverse[cond_i]
+            if get_cache and not record_cache:
+                log_cache[i] = log_cache_i
+        profiler.count('n_examples')
+        profiler.count('n_steps', T_total)
+    if get_cache:
+        profiler.count_cache(log_cache)
+
+    # return cache
+    results = [log_dist_a, log_targ_a, log_cache, log_cond]
+    metrics = [log_loss_sup, log_loss_actor, log_loss_critic,
+               log_return, log_pi_ent]
+    out = [results, metrics]
+    if get_data:
+        X_array_list = [to_sqnp(X[i]) for i in range(n_examples)]
+        Y_array_list = [to_sqnp(Y[i]) for i in range(n_examples)]
+        training_data = [X_array_list, Y_array_list]
+        out.append(training_data)
+    return out
+
+
+def run_tz_batched(
+        agent, optimizer, task, p, n_examples, supervised, batch_size=32,
+        fix_cond=None, fix_penalty=None, slience_recall_time=None,
+        scramble=False, get_cache=True, get_data=False,
+        rm_mid_targ=False, noRL=False, data=None, record_cache=False,
+        profiler=None,
+):
+    """the batched version of `run_tz`, same inputs (minus `learning`) and
+    outputs; it is for training, see `run_tz_eval` for runs w/o learning
+    - event sequences with the same length are stacked and processed in
+    lockstep, `batch_size` of them at a time
+    - each lane (row of the batch) has its own episodic memory, which persists
+    across the event sequences processed by that lane
+    - the weights are updated once per batch, w.r.t. the loss averaged across
+    the event sequences in the batch
+    - the rng draws (conditions, scrambling, penalties) are made batch by
+    batch, each kind for all lanes at once, so batch_size = 1 reproduces
+    run_tz, but larger batches draw in a different order
+    """
+    profiler = NULL_PROFILER if profiler is None else profiler
+    # only cache what will be returned
+    agent.set_cache_level(get_cache_level(get_cache))
+    get_cache = agent.cache_level != 'off'
+    record_cache = record_cache and get_cache
+    # sample data
+    with profiler.phase('sample'):
+        X, Y = sample_data(task, n_examples, data)
+    # logger
+    log_return, log_pi_ent = 0, 0
+    log_loss_sup, log_loss_actor, log_loss_critic = 0, 0, 0
+    log_cond = np.zeros(n_examples,)
+    log_dist_a = [[] for _ in range(n_examples)]
+    log_targ_a = [[] for _ in range(n_examples)]
+    log_cache = make_log_cache(agent, X, record_cache)
+    # swap in one episodic memory for each lane, init by the current memories
+    em = agent.em
+    agent.em = EMBatch(
+        batch_size, em.size, em.dim, em.kernel, em.top_k, em.index)
+    for em_b in agent.em.lanes:
+        em_b.inject_memories(em.vals)
+    watch_em = profiler.watch_em(agent.em)
+
+    for ids in get_batch_ids([np.shape(X_i)[0] for X_i in X], batch_size):
+        n = len(ids)
+        lanes = agent.em.lanes[:n]
+        # pick the conditions, at the start of the batch, s.t. the rng is
+        # used in the order of run_tz if batch_size = 1
+        conds_b = [
+            pick_condition(p, rm_only=supervised, fix_cond=fix_cond)
+            for _ in ids
+        ]
+        # get the examples for this batch
+        X_b, Y_b = [X[i] for i in ids], [Y[i] for i in ids]
+        if scramble:
+            for j in range(n):
+                X_b[j], Y_b[j] = time_scramble(X_b[j], Y_b[j], task)
+        X_b, Y_b = torch.stack(X_b), torch.stack(Y_b)
+        # get time info
+        T_total = X_b.size(1)
+        T_part, pad_len, event_ends, event_bonds = task.get_time_param(T_total)
+        enc_times = get_enc_times(p.net.enc_size, task.n_param, pad_len)
+
+        # attach cond flag
+        if p.env.attach_cond != 0:
+            cond_flag = torch.zeros(n, T_total, 1)
+            for j, cond_j in enumerate(conds_b):
+                cond_indicator = -1 if cond_j == 'NM' else 1
+                cond_flag[j, -T_part:] = cond_indicator * p.env.attach_cond
+            X_b = torch.cat((X_b, cond_flag), 2)
+
+        # prealloc
+        loss_sup = 0
+        probs, actions, penalties, values, ents = [], [], [], [], []
+        log_cache_b = [[None] * T_total for _ in range(n)]
+
+        # init model wm and em
+        penalty_val_p1, penalty_rep_p1 = batch_sample_penalty(
+            p, fix_penalty, n, True)
+        penalty_val_p2, penalty_rep_p2 = batch_sample_penalty(
+            p, fix_penalty, n)
+
+        hc_t = agent.get_init_states(batch_size=n)
+        agent.retrieval_off()
+        agent.encoding_off()
+
+        for t in range(T_total):
+            t_relative = t % T_part
+            in_2nd_part = t >= T_part
+
+            if not in_2nd_part:
+                penalty_val, penalty_rep = penalty_val_p1, penalty_rep_p1
+            else:
+                penalty_val, penalty_rep = penalty_val_p2, penalty_rep_p2
+                if rm_mid_targ and t_relative == 0:
+                    # save memories and the start of p2 and pop midway target
+                    em_copy = [em_j.get_vals() for em_j in lanes]
+                    for em_j in lanes:
+                        em_j.remove_memory(-2)
+
+            # testing condition
+            if slience_recall_time is not None:
+                slience_recall(t_relative, in_2nd_part,
+                               slience_recall_time, agent)
+            # whether to encode
+            if not supervised:
+                for em_j, cond_j in zip(lanes, conds_b):
+                    em_j.encoding_off = t not in enc_times or cond_j == 'NM'
+
+            # forward
+            x_t = torch.cat([X_b[:, t], penalty_rep], 1)
+            with profiler.phase('forward'), watch_em:
+                pi_a_t, v_t, hc_t, cache_t = agent.forward(
+                    x_t.view(1, n, -1), hc_t)
+            pi_a_t, v_t = pi_a_t.view(n, -1), v_t.view(n)
+            with profiler.phase('action'):
+                a_t, p_a_t = agent.pick_action(pi_a_t)
+
+            with profiler.phase('loss'):
+                # cache the results for later RL loss computation
+                actions.append(a_t)
+                penalties.append(penalty_val)
+                values.append(v_t)
+                probs.append(p_a_t)
+                ents.append(- torch.sum(pi_a_t * torch.log2(pi_a_t), dim=-1))
+                # compute supervised loss
+                loss_sup += F.mse_loss(
+                    pi_a_t[:, :-1], Y_b[:, t], reduction='none').mean(dim=-1)
+
+            if not supervised:
+                # update WM/EM bsaed on the condition
+                hc_t = batch_cond_manipulation(
+                    conds_b, t, event_ends[0], hc_t, agent)
+
+            with profiler.phase('logging'):
+                # cache results for later analysis
+                if record_cache:
+                    log_cache.record(ids, t, cache_t)
+                elif get_cache:
+                    for j in range(n):
+                        log_cache_b[j][t] = get_lane_cache(cache_t, j)
+                # for behavioral stuff, only record prediction time steps
+                if t % T_part >= pad_len:
+                    dist_a_t, targ_a_t = to_np(pi_a_t), to_np(Y_b[:, t])
+                    for j, i in enumerate(ids):
+                        log_dist_a[i].append(dist_a_t[j])
+                        log_targ_a[i].append(targ_a_t[j])
+            # at the end, recover the removed midway memory
+            if t == T_total - 1 and rm_mid_targ:
+                for em_j, em_copy_j in zip(lanes, em_copy):
+                    em_j.vals = em_copy_j
+
+        with profiler.phase('loss'):
+            # get rewards, for all lanes and time points at once, n x T
+            actions, penalties, values, probs = [
+                torch.stack(x, dim=1)
+                for x in [actions, penalties, values, probs]
+            ]
+            rewards = get_reward(actions, Y_b, penalties)
+            # compute RL loss, for each lane
+            returns = compute_returns(
+                rewards, normalize=p.env.normalize_return)
+            loss_actor, loss_critic = compute_a2c_loss(probs, values, returns)
+            pi_ent = torch.stack(ents).sum(dim=0)
+        # learn
+        if noRL or supervised:
+            loss = loss_sup
+        else:
+            loss = loss_actor + loss_critic - pi_ent * p.net.eta
+        with profiler.phase('backward'):
+            optimizer.zero_grad()
+            loss.mean().backward()
+            torch.nn.utils.clip_grad_norm_(agent.parameters(), 1)
+        with profiler.phase('step'):
+            optimizer.step()
+
+        # after every batch, log stuff
+        with profiler.phase('logging'):
+            log_loss_sup += loss_sup.sum().item() / n_examples
+            log_pi_ent += pi_ent.sum().item() / n_examples
+            log_return += rewards.sum().item() / n_examples
+            log_loss_actor += loss_actor.sum().item() / n_examples
+            log_loss_critic += loss_critic.sum().item() / n_examples
+            for j, i in enumerate(ids):
+                log_cond[i] = TZ_COND_DICT.inverse[conds_b[j]]
+                if get_cache and not record_cache:
+                    log_cache[i] = log_cache_b[j]
+                # keep the memories of the lane that ran the last example
+                if i == n_examples - 1:
+                    em.flush()
+                    em.inject_memories(lanes[j].vals)
+        profiler.count('n_examples', n)
+        profiler.count('n_steps', n * T_total)
+    # put back the original episodic memory
+    agent.em = em
+    if get_cache:
+        profiler.count_cache(log_cache)
+
+    # return cache
+    log_dist_a = np.array(log_dist_a)
+    log_targ_a = np.array(log_targ_a)
+    results = [log_dist_a, log_targ_a, log_cache, log_cond]
+    metrics = [log_loss_sup, log_loss_actor, log_loss_critic,
+               log_return, log_pi_ent]
+    out = [results, metrics]
+    if get_data:
+        X_array_list = [to_sqnp(X[i]) for i in range(n_examples)]
+        Y_array_list = [to_sqnp(Y[i]) for i in range(n_examples)]
+        training_data = [X_array_list, Y_array_list]
+        out.append(training_data)
+    return out
+
+
+def sample_data(task, n_examples, data=None):
+    """sample n_examples event sequences, unless they are given"""
+    if data is None:
+        return task.sample(n_examples, to_torch=True)
+    X, Y = data
+    assert len(X) == n_examples, 'the data must have n_examples sequences'
+    return X, Y
+
+
+def get_batch_ids(T_totals, batch_size):
+    """group example ids into batches of examples with the same length
+    - ids are kept in order within each batch
+    - batches are ordered by their first example id
+
+    Parameters
+    ----------
+    T_totals : list of int
+        the length of each example
+    batch_size : int
+        the maximal batch size
+
+    Returns
+    -------
+    list of list
+        example ids for each batch
+
+    """
+    ids_by_len = {}
+    for i, T_total in enumerate(T_totals):
+        ids_by_len.setdefault(T_total, []).append(i)
+    batch_ids = [
+        ids[k:k + batch_size]
+        for ids in ids_by_len.values()
+        for k in range(0, len(ids), batch_size)
+    ]
+    return sorted(batch_ids, key=lambda ids: ids[0])
+
+
+def make_log_cache(agent, X, record_cache=False):
+    """prealloc the cache of run_tz, for the event sequences in X"""
+    if not record_cache:
+        return [None] * len(X)
+    T_max = max([len(X_i) for X_i in X])
+    return CacheRecorder(
+        len(X), T_max, agent.rnn_hidden_dim, agent.ih.out_features)
+
+
+def get_cache_level(get_cache):
+    """translate the `get_cache` arg of `run_tz` to an agent cache level
+
+    Parameters
+    ----------
+    get_cache : bool or str
+        True -> cache everything, False -> cache nothing, or a cache level,
+        see models.LCALSTM.CACHE_LEVELS
+
+    Returns
+    -------
+    str
+        the cache level
+
+    """
+    if isinstance(get_cache, str):
+        return get_cache
+    return 'memory' if get_cache else 'off'
+
+
+def get_lane_cache(cache_t, j):
+    """get the cache of the j-th lane from a batched cache, in the same format
+    as the cache of a single event sequence
+    """
+    [vector_signal, scalar_signal, misc] = cache_t
+    scalar_signal_j = [
+        sig[j:j + 1] if torch.is_tensor(sig) else sig for sig in scalar_signal
+    ]
+    vector_signal_j, misc_j = None, None
+    if vector_signal is not None:
+        vector_signal_j = [sig[j:j + 1] for sig in vector_signal]
+    if misc is not None:
+        [h_t, m_t, cm_t, dec_act_t, em_vals] = misc
+        misc_j = [
+            h_t[:, j:j + 1], m_t[j:j + 1], cm_t[:, j:j + 1],
+            dec_act_t[j:j + 1], None if em_vals is None else em_vals[j]
+        ]
+    return [vector_signal_j, scalar_signal_j, misc_j]
+
+
 def append_info(x_it_, scalar_list):
     for s in scalar_list:
         x_it_ = torch.cat(
@@ -220,6 +736,22 @@ def cond_manipulation(tz_cond, t, event_bond, hc_t, agent):
     return hc_t
 
 
+def batch_cond_manipulation(tz_conds, t, event_bond, hc_t, agent):
+    '''`cond_manipulation` for a batch, tz_conds[j] is the cond of lane j
+    '''
+    if t == event_bond:
+        agent.retrieval_on()
+        # flush WM unless RM
+        flush = torch.tensor([tz_cond != 'RM' for tz_cond in tz_conds])
+        if torch.any(flush):
+            hc_0 = agent.get_init_states(batch_size=len(tz_conds))
+            flush = flush.view(1, -1, 1)
+            hc_t = tuple(
+                torch.where(flush, s_0, s_t) for s_0, s_t in zip(hc_0, hc_t)
+            )
+    return hc_t
+
+
 def sample_penalty(p, fix_penalty, get_mean=False):
     if get_mean:
         penalty_val = p.env.penalty / 2
@@ -245,6 +777,16 @@ def sample_penalty(p, fix_penalty, get_mean=False):
     return torch.tensor(penalty_val), torch.tensor(penalty_rep)
 
 
+def batch_sample_penalty(p, fix_penalty, n, get_mean=False):
+    '''`sample_penalty` for n event sequences
+    returns penalty values (n,) and penalty representations (n x rep_dim)
+    '''
+    penalties = [sample_penalty(p, fix_penalty, get_mean) for _ in range(n)]
+    penalty_val = torch.stack([val for val, _ in penalties])
+    penalty_rep = torch.stack([rep for _, rep in penalties])
+    return penalty_val, penalty_rep.type(torch.FloatTensor).view(n, -1)
+
+
 def one_hot_penalty(penalty_int, p):
     assert penalty_int in p.env.penalty_range, \
         print(f'invalid penalty_int = {penalty_int}')
@@ -2,11 +2,15 @@
 notes:
 - there is no key - val distinction here
 - memory is a row vector
+- for a large storage, the LCA competition can be restricted to the top k
+memories, which are pre-selected by an `LSHIndex` (approximate, sublinear in
+size) or by a scan of all memories (exact), see `EM`
 """
+import math
 import torch
+from copy import copy
 import torch.nn.functional as F
-from copy import deepcopy
-from models.LCA_pytorch import LCA
+from models.LCA_pytorch import fused_lca
 
 # constants
 ALL_KERNELS = ['cosine', 'l1', 'l2', 'rbf']
@@ -23,14 +27,31 @@ class EM():
         the dim or len of an episodic memory i
     kernel : str
         the metric for memory-cell_state similarity evaluation
+    top_k : int
+        if not None, only the top k most similar memories compete in the LCA
+    index : LSHIndex
+        if not None, the top k are selected from the candidates of the index,
+        instead of all memories; requires top_k and the cosine kernel
 
     """
 
-    def __init__(self, size, dim, kernel='cosine'):
+    def __init__(self, size, dim, kernel='cosine', top_k=None, index=None):
         self.size = size
         self.dim = dim
         self.kernel = kernel
-        self.vals = []
+        self.top_k = top_k
+        self.index = index
+        # if verify_index, the recall of the index is measured at every
+        # retrieval, see `get_index_recall`
+        self.verify_index = False
+        self._n_verified, self._sum_recall = 0, 0.
+        # the memory storage, a ring buffer of `size` rows
+        self._memory = torch.zeros(size, dim)
+        # whether the storage is referenced outside, see `_writable_memory`
+        self._shared = False
+        # incremented whenever the stored memories change
+        self.version = 0
+        self._snapshot, self._snapshot_version = None, -1
         self.reset_memory()
         self._check_config()
 
@@ -42,19 +63,81 @@ class EM():
     def _check_config(self):
         assert self.size > 0
         assert self.kernel in ALL_KERNELS
+        assert self.top_k is None or self.top_k > 0
+        if self.index is not None:
+            assert self.top_k is not None, 'the index requires top_k'
+            assert self.kernel == 'cosine', 'the index is for cosine only'
 
     def flush(self):
-        self.vals = []
+        # the row to write next, and the number of valid rows
+        self._head = 0
+        self._n_stored = 0
+        self.version += 1
+        if self.index is not None:
+            self.index.clear()
+
+    def __len__(self):
+        return self._n_stored
+
+    @property
+    def vals(self):
+        """the stored memories, from the oldest to the newest, the rows may
+        be views of the storage, see `get_vals` for a copy
+        """
+        return list(self._get_stored(ordered=True))
+
+    @vals.setter
+    def vals(self, vals):
+        self.flush()
+        self.inject_memories(vals)
+
+    def _get_stored(self, ordered=False):
+        """get the valid rows of the storage, a n_stored x dim view
+        - if not ordered, rows are in storage order, which is a rotation of
+        the chronological order once the buffer is full; all similarity based
+        computation is invariant to this rotation
+        """
+        if self._n_stored < self.size:
+            return self._memory[:self._n_stored]
+        if ordered and self._head != 0:
+            return torch.roll(self._memory, -self._head, dims=0)
+        return self._memory
+
+    def _get_retrievable(self):
+        """`_get_stored` for a retrieval; under grad, the view can be saved
+        for the backward pass, so the storage is marked as shared
+        """
+        if torch.is_grad_enabled():
+            self._shared = True
+        return self._get_stored()
+
+    def _writable_memory(self):
+        """copy on write: views handed out by `_get_retrievable` can be part
+        of a computational graph, so writing to the storage in place after
+        such a read would break the backward pass; otherwise (e.g. reads
+        under no_grad) the storage is written in place
+        """
+        if self._shared:
+            self._memory = self._memory.clone()
+            self._shared = False
+        return self._memory
 
     def _save_memory(self, val):
-        self.vals.append(torch.squeeze(val.data))
-        # remove the oldest memory, if overflow
-        if len(self.vals) > self.size:
-            self.vals.pop(0)
+        memory = self._writable_memory()
+        memory[self._head] = torch.squeeze(val.data)
+        if self.index is not None:
+            self.index.add(self._head, memory[self._head])
+        # overwrite the oldest memory, if overflow
+        self._head = (self._head + 1) % self.size
+        self._n_stored = min(self._n_stored + 1, self.size)
+        self.version += 1
 
     def remove_memory(self, id):
-        assert id <= len(self.vals) - 1, 'index out of bound'
-        return self.vals.pop(id)
+        assert id <= len(self) - 1, 'index out of bound'
+        vals = self.get_vals()
+        memory_rmd = vals.pop(id)
+        self.vals = vals
+        return memory_rmd
 
     def save_memory(self, val):
         """Save an episodic memory
@@ -96,7 +179,7 @@ class EM():
             a memory
         """
         # if no memory, return the zero vector
-        if len(self.vals) == 0 or self.retrieval_off:
+        if len(self) == 0 or self.retrieval_off:
             return dummy_memory(self.dim)
         return self._get_memory(
             input_pattern, leak=leak, comp=comp, w_input=w_input
@@ -119,19 +202,302 @@ class EM():
         torch.tensor
             a memory
         """
+        # get the memory matrix
+        M = self._get_candidates(input_pattern)
         # compute similarity(query, memory_i ), for all i
-        w_raw = compute_similarities(
-            input_pattern, self.vals, self.kernel
-        )
+        w_raw = compute_similarities(input_pattern, M, self.kernel)
+        # only the top k compete
+        if self.top_k is not None and self.top_k < len(M):
+            w_raw, top_ids = torch.topk(w_raw, self.top_k)
+            M = M[top_ids]
         w = lca_transform(
             w_raw, leak=leak, comp=comp, w_input=w_input
         ).view(1, -1)
-        # compute the memory matrix
-        M = torch.stack(self.vals)
         return w @ M
 
+    def _get_candidates(self, input_pattern):
+        """the memories that can be retrieved by input_pattern, i.e. all of
+        them, or if there is an index, the ones in the buckets of the query
+        - if the buckets are empty, fall back to all memories
+        """
+        if self.index is None or len(self) <= self.top_k:
+            return self._get_retrievable()
+        slots = self.index.query(input_pattern.data)
+        if self.verify_index:
+            self._verify_index(input_pattern, slots)
+        if len(slots) == 0:
+            return self._get_retrievable()
+        # the slots are the storage rows, and indexing makes a copy
+        return self._memory[slots]
+
+    @torch.no_grad()
+    def _verify_index(self, input_pattern, slots):
+        """record the fraction of the exact top k memories that are among the
+        candidates of the index
+        """
+        w_raw = compute_similarities(
+            input_pattern, self._get_stored(), self.kernel)
+        k = min(self.top_k, len(w_raw))
+        top_ids = torch.topk(w_raw, k).indices.tolist()
+        self._sum_recall += len(set(top_ids) & set(slots)) / k
+        self._n_verified += 1
+
+    def get_index_recall(self, reset=True):
+        """the mean recall of the index, since the last reset, see
+        `verify_index`; nan if no retrieval was verified
+        """
+        recall = self._sum_recall / self._n_verified if self._n_verified \
+            else float('nan')
+        if reset:
+            self._n_verified, self._sum_recall = 0, 0.
+        return recall
+
     def get_vals(self):
-        return deepcopy(self.vals)
+        return [val.clone() for val in self.vals]
+
+    def exit_inference_mode(self):
+        """copy the storage if it was made in inference mode, since such a
+        tensor can't be written or used by autograd outside inference mode
+        """
+        if self._memory.is_inference():
+            self._memory = self._memory.clone()
+            self._shared = False
+            self.version += 1
+
+    def get_snapshot(self):
+        """get a copy of the stored memories, the copy is only made when the
+        memories changed since the last snapshot, otherwise the last snapshot
+        is returned (so the snapshot must not be modified)
+
+        Returns
+        -------
+        list
+            a list of memories
+        """
+        if self._snapshot_version != self.version:
+            self._snapshot = self.get_vals()
+            self._snapshot_version = self.version
+        return self._snapshot
+
+
+class EMBatch():
+    """A set of independent episodic memories, one per lane, s.t. several
+    event sequences can be processed in lockstep (lane b <-> row b of a batch)
+
+    the encoding / retrieval flags can be set for all lanes at once (the agent
+    api, e.g. agent.retrieval_on()), or for each lane via `self.lanes[b]`
+
+    Parameters
+    ----------
+    n_lanes : int
+        the number of event sequences processed in parallel
+    size : int
+        the storage capacity of each lane
+    dim : int
+        the dim or len of an episodic memory i
+    kernel : str
+        the metric for memory-cell_state similarity evaluation
+    top_k, index : int, LSHIndex
+        see `EM`, each lane gets an empty copy of the index
+
+    """
+
+    def __init__(self, n_lanes, size, dim, kernel='cosine', top_k=None,
+                 index=None):
+        self.n_lanes = n_lanes
+        self.size = size
+        self.dim = dim
+        self.kernel = kernel
+        self.top_k = top_k
+        self.index = index
+        self.lanes = [
+            EM(size, dim, kernel, top_k,
+               None if index is None else index.empty_like())
+            for _ in range(n_lanes)
+        ]
+
+    @property
+    def encoding_off(self):
+        return all([em.encoding_off for em in self.lanes])
+
+    @encoding_off.setter
+    def encoding_off(self, flag):
+        for em in self.lanes:
+            em.encoding_off = flag
+
+    @property
+    def retrieval_off(self):
+        return all([em.retrieval_off for em in self.lanes])
+
+    @retrieval_off.setter
+    def retrieval_off(self, flag):
+        for em in self.lanes:
+            em.retrieval_off = flag
+
+    def reset_memory(self):
+        for em in self.lanes:
+            em.reset_memory()
+
+    def flush(self):
+        for em in self.lanes:
+            em.flush()
+
+    def save_memory(self, vals):
+        """Save the b-th row of vals to the b-th lane, for all b
+
+        Parameters
+        ----------
+        vals : torch.tensor, n x dim, n <= n_lanes
+            one memory for each lane
+        """
+        for em, val in zip(self.lanes, vals):
+            em.save_memory(val)
+
+    def get_memory(
+            self, input_patterns,
+            leak=None, comp=None, w_input=None
+    ):
+        """for each lane b, retrieve with the b-th row of input_patterns
+
+        Parameters
+        ----------
+        input_patterns : torch.tensor, n x dim, n <= n_lanes
+            cortical patterns, one for each lane
+        w_input : torch.tensor (n x 1) or float
+            LCA input strength, for each lane
+
+        Returns
+        -------
+        torch.tensor, n x dim
+            memories, one for each lane
+
+        """
+        lanes = self.lanes[:len(input_patterns)]
+        # if all lanes retrieve from the same number of memories, retrieve
+        # for all lanes at once (the top k selection is per lane)
+        n_stored = set([len(em) for em in lanes])
+        retrieval_on = not any([em.retrieval_off for em in lanes])
+        if retrieval_on and len(n_stored) == 1 and 0 not in n_stored and \
+                self.top_k is None:
+            # n x #memories x dim
+            M = torch.stack([em._get_stored() for em in lanes])
+            w_raw = compute_similarities(input_patterns, M, self.kernel)
+            w = lca_transform(w_raw, leak=leak, comp=comp, w_input=w_input)
+            return torch.bmm(w.unsqueeze(1), M).squeeze(1)
+        # otherwise, retrieve for each lane
+        memories = []
+        for b, (em, q) in enumerate(zip(lanes, input_patterns)):
+            w_input_b = w_input[b] if torch.is_tensor(w_input) else w_input
+            memories.append(
+                em.get_memory(q, leak=leak, comp=comp, w_input=w_input_b)
+            )
+        return torch.cat(memories)
+
+    def get_vals(self):
+        return [em.get_vals() for em in self.lanes]
+
+    def get_snapshot(self):
+        return [em.get_snapshot() for em in self.lanes]
+
+
+class LSHIndex():
+    """A random projection LSH index of the rows of an EM storage, for the
+    cosine kernel
+    - each of the n_tables hash tables puts a memory in the bucket given by
+    the signs of its projections on n_bits random directions, so memories at
+    a small angle tend to share a bucket
+    - a query is only compared to the memories in its buckets (and, if
+    multiprobe, the buckets one bit away), instead of all memories
+    - the random directions come from their own generator, so the global rng
+    is not affected
+
+    Parameters
+    ----------
+    size : int
+        the storage capacity of the EM
+    dim : int
+        the dim of a memory
+    n_bits : int
+        the number of bits per table, more bits -> fewer candidates; by
+        default log2(size / 8), so a bucket has ~8 memories and the cost of a
+        query grows w/ log(size)
+    n_tables : int
+        the number of tables, more tables -> higher recall
+    multiprobe : bool
+        whether to also probe the buckets one bit away from the query's
+    seed : int
+        the seed of the random directions
+
+    """
+
+    def __init__(
+            self, size, dim, n_bits=None, n_tables=4, multiprobe=True, seed=0
+    ):
+        if n_bits is None:
+            n_bits = max(int(round(math.log2(size / 8))), 1)
+        self.dim = dim
+        self.n_bits = n_bits
+        self.n_tables = n_tables
+        self.multiprobe = multiprobe
+        generator = torch.Generator().manual_seed(seed)
+        self.projections = torch.randn(
+            dim, n_tables * n_bits, generator=generator)
+        self._powers = 2 ** torch.arange(n_bits)
+        self.clear()
+
+    def clear(self):
+        # for each table, code -> slots; and slot -> its codes
+        self._buckets = [{} for _ in range(self.n_tables)]
+        self._codes = {}
+
+    def empty_like(self):
+        """an empty index w/ the same random directions"""
+        index = copy(self)
+        index.clear()
+        return index
+
+    def __len__(self):
+        return len(self._codes)
+
+    def _hash(self, val):
+        """the code of val in each table"""
+        bits = (val.view(1, -1) @ self.projections > 0).long()
+        return (bits.view(self.n_tables, self.n_bits) * self._powers).sum(
+            dim=-1).tolist()
+
+    def add(self, slot, val):
+        """index val as the memory in slot, replacing the previous one"""
+        self.remove(slot)
+        codes = self._hash(val)
+        for buckets, code in zip(self._buckets, codes):
+            buckets.setdefault(code, set()).add(slot)
+        self._codes[slot] = codes
+
+    def remove(self, slot):
+        codes = self._codes.pop(slot, None)
+        if codes is None:
+            return
+        for buckets, code in zip(self._buckets, codes):
+            buckets[code].discard(slot)
+            if len(buckets[code]) == 0:
+                del buckets[code]
+
+    def query(self, val):
+        """the slots of the memories that share a bucket w/ val
+
+        Returns
+        -------
+        list
+            the slots, sorted
+
+        """
+        candidates = set()
+        for buckets, code in zip(self._buckets, self._hash(val)):
+            candidates.update(buckets.get(code, ()))
+            if self.multiprobe:
+                for b in range(self.n_bits):
+                    candidates.update(buckets.get(code ^ (1 << b), ()))
+        return sorted(candidates)
 
 
 """helpers"""
@@ -141,10 +507,10 @@ def transform_similarities(
         raw_similarities, weighting_function,
         leak=None, comp=None, w_input=None
 ):
-    n_memories = len(raw_similarities)
+    n_memories = raw_similarities.size(-1)
     if weighting_function == '1NN':
-        # one hot vector weighting for 1NN
-        best_memory_id = torch.argmax(raw_similarities)
+        # one hot vector weighting for 1NN, for each row
+        best_memory_id = torch.argmax(raw_similarities, dim=-1)
         similarities = torch.eye(n_memories)[best_memory_id]
     elif weighting_function == 'LCA':
         # transform the similarity by a LCA process
@@ -167,23 +533,25 @@ def compute_similarities(
     ----------
     input_pattern : a row vector
         Description of parameter `input_pattern`.
-    vals : list
+    vals : list, 2d torch.tensor (#keys x key_dim), or 3d torch.tensor
+        (n x #keys x key_dim) for a batch of n queries
         Description of parameter `vals`.
     metric : str
         Description of parameter `metric`.
 
     Returns
     -------
-    a row vector w/ len #memories
+    a row vector w/ len #memories, or n x #memories for a batch
         the similarity between query vs. key_i, for all i
     """
-    # reshape query to 1 x key_dim
-    q = input_pattern.view(1, -1)
     # reshape memory keys to #keys x key_dim
-    M = torch.stack(vals)
+    M = vals if torch.is_tensor(vals) else torch.stack(vals)
+    # reshape query to 1 x key_dim, or n x 1 x key_dim for a batch of queries
+    # and memories (n x #keys x key_dim)
+    q = input_pattern.view(*M.size()[:-2], 1, -1)
     # compute similarities
     if metric == 'cosine':
-        similarities = F.cosine_similarity(q, M)
+        similarities = F.cosine_similarity(q, M, dim=-1)
     elif metric == 'l1':
         similarities = - F.pairwise_distance(q, M, p=1)
     elif metric == 'l2':
@@ -202,18 +570,14 @@ def lca_transform(
         similarities,
         leak=None, comp=None, w_input=None, n_cycles=10
 ):
-    # construct input sequence
-    stimuli = similarities.repeat(n_cycles, 1)
-    # init LCA
-    lca = LCA(
-        n_units=len(similarities),
-        leak=leak, ltrl_inhib=comp, w_input=w_input,
+    """transform the similarities by a LCA process, take the final values
+    - similarities can be a batch, (..., n_memories), in which case leak,
+    comp and w_input can be one value for each row, (..., 1)
+    """
+    return fused_lca(
+        similarities, leak=leak, ltrl_inhib=comp, w_input=w_input,
+        n_cycles=n_cycles
     )
-    # run LCA
-    lca_outputs = lca.run(stimuli)
-    # take the final valuse
-    lca_similarities = lca_outputs[-1, :]
-    return lca_similarities
 
 
 if __name__ == "__main__":
@@ -236,7 +600,7 @@ if __name__ == "__main__":
 
     '''how to delete a specific memory'''
     # make a copy 1st
-    em_vals = deepcopy(em.vals)
+    em_vals = em.get_vals()
     # remove the 2nd to last memory
     mem_rmd = em.remove_memory(-2)
     print('before removal:')
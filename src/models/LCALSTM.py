@@ -14,6 +14,12 @@ N_SSIG = 1
 # the ordering in the cache
 scalar_signal_names = ['input strength']
 vector_signal_names = ['f', 'i', 'o']
+# what to cache at every time step, each level includes the previous levels
+# - off: nothing, the cache is None
+# - scalar: the scalar signals
+# - activation: the vector signals (lstm gates) and the activity
+# - memory: the episodic memory snapshot
+CACHE_LEVELS = ['off', 'scalar', 'activation', 'memory']
 sigmoid = nn.Sigmoid()
 
 
@@ -22,7 +28,7 @@ class LCALSTM(nn.Module):
     def __init__(
             self, input_dim, output_dim, rnn_hidden_dim, dec_hidden_dim,
             kernel='cosine', dict_len=2, weight_init_scheme='ortho', cmpt=.8,
-            add_penalty_dim=True
+            add_penalty_dim=True, em_top_k=None, em_index=None
     ):
         super(LCALSTM, self).__init__()
         self.cmpt = cmpt
@@ -35,13 +41,17 @@ class LCALSTM(nn.Module):
         # rnn module
         self.i2h = nn.Linear(self.input_dim, self.n_hidden_total)
         self.h2h = nn.Linear(rnn_hidden_dim, self.n_hidden_total)
+        # [i2h, h2h] as one layer, see `fused_linear_weights`
+        self._fused_rnn = FusedWeightCache()
         # deicion module
         self.ih = nn.Linear(rnn_hidden_dim, dec_hidden_dim)
         self.actor = nn.Linear(dec_hidden_dim, output_dim)
         self.critic = nn.Linear(dec_hidden_dim, 1)
         # memory
         self.hpc = nn.Linear(rnn_hidden_dim + dec_hidden_dim, N_SSIG)
-        self.em = EM(dict_len, rnn_hidden_dim, kernel)
+        # see EM for the top k retrieval, for a large dict_len
+        self.em = EM(dict_len, rnn_hidden_dim, kernel, em_top_k, em_index)
+        self.set_cache_level('memory')
         # the RL mechanism
         self.weight_init_scheme = weight_init_scheme
         self.init_model()
@@ -56,9 +66,9 @@ class LCALSTM(nn.Module):
         initialize_weights(self, self.weight_init_scheme)
 
 
-    def get_init_states(self, scale=.1, device='cpu'):
-        h_0_ = sample_random_vector(self.rnn_hidden_dim, scale)
-        c_0_ = sample_random_vector(self.rnn_hidden_dim, scale)
+    def get_init_states(self, scale=.1, device='cpu', batch_size=1):
+        h_0_ = sample_random_vector(self.rnn_hidden_dim, scale, batch_size)
+        c_0_ = sample_random_vector(self.rnn_hidden_dim, scale, batch_size)
         return (h_0_, c_0_)
 
     def forward(self, x_t, hc_prev, beta=1):
@@ -67,8 +77,10 @@ class LCALSTM(nn.Module):
         h_prev = h_prev.view(h_prev.size(1), -1)
         c_prev = c_prev.view(c_prev.size(1), -1)
         x_t = x_t.view(x_t.size(1), -1)
-        # transform the input info
-        preact = self.i2h(x_t) + self.h2h(h_prev)
+        # transform the input info, i.e. i2h(x_t) + h2h(h_prev), in one gemm
+        w_rnn, b_rnn = fused_linear_weights(
+            [self.i2h, self.h2h], self._fused_rnn)
+        preact = F.linear(torch.cat([x_t, h_prev], dim=1), w_rnn, b_rnn)
         # get all gate values
         gates = preact[:, : N_VSIG * self.rnn_hidden_dim].sigmoid()
         c_t_new = preact[:, N_VSIG * self.rnn_hidden_dim + N_SSIG:].tanh()
@@ -78,14 +90,18 @@ class LCALSTM(nn.Module):
         i_t = gates[:, -self.rnn_hidden_dim:]
         # new cell state = gated(prev_c) + gated(new_stuff)
         c_t = torch.mul(c_prev, f_t) + torch.mul(i_t, c_t_new)
-        # make 1st decision attempt
-        h_t = torch.mul(o_t, c_t.tanh())
-        dec_act_t = F.relu(self.ih(h_t))
-        # recall / encode
-        hpc_input_t = torch.cat([c_t, dec_act_t], dim=1)
-        inps_t = sigmoid(self.hpc(hpc_input_t))
-        # [inps_t, comp_t] = torch.squeeze(phi_t)
-        m_t = self.recall(c_t, inps_t)
+        # the 1st decision attempt only matters for recall (and the cache)
+        if self.em.retrieval_off and self.cache_level == 'off':
+            m_t = torch.zeros_like(c_t)
+        else:
+            # make 1st decision attempt
+            h_t = torch.mul(o_t, c_t.tanh())
+            dec_act_t = F.relu(self.ih(h_t))
+            # recall / encode
+            hpc_input_t = torch.cat([c_t, dec_act_t], dim=1)
+            inps_t = sigmoid(self.hpc(hpc_input_t))
+            # [inps_t, comp_t] = torch.squeeze(phi_t)
+            m_t = self.recall(c_t, inps_t)
         cm_t = c_t + m_t
         self.encode(cm_t)
         # make final dec
@@ -97,10 +113,12 @@ class LCALSTM(nn.Module):
         h_t = h_t.view(1, h_t.size(0), -1)
         cm_t = cm_t.view(1, cm_t.size(0), -1)
         # scache results
-        scalar_signal = [inps_t, 0, 0]
-        vector_signal = [f_t, i_t, o_t]
-        misc = [h_t, m_t, cm_t, dec_act_t, self.em.get_vals()]
-        cache = [vector_signal, scalar_signal, misc]
+        if self.cache_level == 'off':
+            return pi_a_t, value_t, (h_t, cm_t), None
+        cache = make_cache(
+            self.cache_level, self.em,
+            [f_t, i_t, o_t], [inps_t, 0, 0], [h_t, m_t, cm_t, dec_act_t]
+        )
         return pi_a_t, value_t, (h_t, cm_t), cache
 
     def recall(self, c_t, inps_t, comp_t=None):
@@ -156,6 +174,11 @@ class LCALSTM(nn.Module):
         log_prob_a_t = m.log_prob(a_t)
         return a_t, log_prob_a_t
 
+    def set_cache_level(self, cache_level):
+        assert cache_level in CACHE_LEVELS, \
+            f'Invalid cache level = {cache_level}'
+        self.cache_level = cache_level
+
     def init_em_config(self):
         self.flush_episodic_memory()
         self.encoding_off()
@@ -177,8 +200,80 @@ class LCALSTM(nn.Module):
         self.em.retrieval_off = False
 
 
-def sample_random_vector(n_dim, scale=.1):
-    return torch.randn(1, 1, n_dim) * scale
+def make_cache(cache_level, em, vector_signal, scalar_signal, activity):
+    """form the cache of a time step, according to the cache level
+
+    Parameters
+    ----------
+    cache_level : str
+        one of CACHE_LEVELS
+    em : EM
+        the episodic memory, only used if cache_level is 'memory'
+    vector_signal : list
+        the vector signals, i.e. the lstm gates
+    scalar_signal : list
+        the scalar signals
+    activity : list
+        h_t, m_t, cm_t, dec_act_t
+
+    Returns
+    -------
+    list
+        [vector_signal, scalar_signal, misc], the signals above the cache
+        level are None; or None, if cache_level is 'off'
+
+    """
+    if cache_level == 'off':
+        return None
+    if cache_level == 'scalar':
+        return [None, scalar_signal, None]
+    em_vals = em.get_snapshot() if cache_level == 'memory' else None
+    return [vector_signal, scalar_signal, activity + [em_vals]]
+
+
+class FusedWeightCache(dict):
+    """the cache of `fused_linear_weights`, it is dropped when the model is
+    copied or pickled, since it can hold non-leaf tensors"""
+
+    def __deepcopy__(self, memo):
+        return FusedWeightCache()
+
+    def __reduce__(self):
+        return (FusedWeightCache, ())
+
+
+def fused_linear_weights(linears, cache):
+    """the weight and bias of a linear layer equivalent to the sum of a list
+    of linear layers with different inputs, i.e.
+    sum_k linears[k](x_k) == F.linear(cat([x_k for all k]), weight, bias)
+    - the result is cached, and recomputed only when the parameters changed
+    (e.g. optimizer.step, load_state_dict) or the grad mode changed, so the
+    parameters, and thus the checkpoints, are unchanged
+
+    Parameters
+    ----------
+    linears : list
+        a list of nn.Linear with the same output dim
+    cache : FusedWeightCache
+        the cache
+
+    Returns
+    -------
+    torch.tensor, torch.tensor
+        weight, out_dim x sum(in_dims); bias, out_dim
+
+    """
+    params = [p for l in linears for p in [l.weight, l.bias]]
+    key = [(id(p), p._version) for p in params] + [torch.is_grad_enabled()]
+    if cache.get('key') != key:
+        cache['key'] = key
+        cache['weight'] = torch.cat([l.weight for l in linears], dim=1)
+        cache['bias'] = sum([l.bias for l in linears])
+    return cache['weight'], cache['bias']
+
+
+def sample_random_vector(n_dim, scale=.1, batch_size=1):
+    return torch.randn(1, batch_size, n_dim) * scale
 
 
 def _softmax(z, beta):
@@ -186,20 +281,20 @@ def _softmax(z, beta):
 
     Parameters
     ----------
-    z : torch tensor, has 1d underlying structure after torch.squeeze
+    z : torch tensor, 1d after torch.squeeze, or 2d (batch_size x n_action)
         the raw logits
     beta : float, >0
         softmax temp, big value -> more "randomness"
 
     Returns
     -------
-    1d torch tensor
-        a probability distribution | beta
+    torch tensor
+        a probability distribution | beta, for each row
 
     """
     assert beta > 0
     # softmax the input to a valid PMF
-    pi_a = F.softmax(torch.squeeze(z / beta), dim=0)
+    pi_a = F.softmax(torch.squeeze(z / beta), dim=-1)
     # make sure the output is valid
     if torch.any(torch.isnan(pi_a)):
         raise ValueError(f'Softmax produced nan: {z} -> {pi_a}')
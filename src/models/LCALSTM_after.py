@@ -3,6 +3,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import pdb
 from models.EM import EM
+from models.LCALSTM import CACHE_LEVELS, make_cache, \
+    FusedWeightCache, fused_linear_weights
 from torch.distributions import Categorical
 from models.initializer import initialize_weights
 
@@ -37,6 +39,8 @@ class LCALSTM_after(nn.Module):
         # rnn module
         self.i2h = nn.Linear(self.input_dim, self.n_hidden_total)
         self.h2h = nn.Linear(rnn_hidden_dim, self.n_hidden_total)
+        # [i2h, h2h] as one layer, see `fused_linear_weights`
+        self._fused_rnn = FusedWeightCache()
         # deicion module
         self.ih = nn.Linear(rnn_hidden_dim, dec_hidden_dim)
         self.actor = nn.Linear(dec_hidden_dim, output_dim)
@@ -46,6 +50,7 @@ class LCALSTM_after(nn.Module):
             rnn_hidden_dim + rnn_hidden_dim + dec_hidden_dim, N_SSIG
         )
         self.em = EM(dict_len, rnn_hidden_dim, kernel)
+        self.set_cache_level('memory')
         # the RL mechanism
         self.weight_init_scheme = weight_init_scheme
         self.init_model()
@@ -59,9 +64,9 @@ class LCALSTM_after(nn.Module):
         # init params
         initialize_weights(self, self.weight_init_scheme)
 
-    def get_init_states(self, scale=.1, device='cpu'):
-        h_0_ = sample_random_vector(self.rnn_hidden_dim, scale)
-        c_0_ = sample_random_vector(self.rnn_hidden_dim, scale)
+    def get_init_states(self, scale=.1, device='cpu', batch_size=1):
+        h_0_ = sample_random_vector(self.rnn_hidden_dim, scale, batch_size)
+        c_0_ = sample_random_vector(self.rnn_hidden_dim, scale, batch_size)
         return (h_0_, c_0_)
 
     def forward(self, x_t, hc_prev, beta=1):
@@ -70,8 +75,10 @@ class LCALSTM_after(nn.Module):
         h_prev = h_prev.view(h_prev.size(1), -1)
         c_prev = c_prev.view(c_prev.size(1), -1)
         x_t = x_t.view(x_t.size(1), -1)
-        # transform the input info
-        preact = self.i2h(x_t) + self.h2h(h_prev)
+        # transform the input info, i.e. i2h(x_t) + h2h(h_prev), in one gemm
+        w_rnn, b_rnn = fused_linear_weights(
+            [self.i2h, self.h2h], self._fused_rnn)
+        preact = F.linear(torch.cat([x_t, h_prev], dim=1), w_rnn, b_rnn)
         # get all gate values
         gates = preact[:, : N_VSIG * self.rnn_hidden_dim].sigmoid()
         c_t_new = preact[:, N_VSIG * self.rnn_hidden_dim + N_SSIG:].tanh()
@@ -81,17 +88,23 @@ class LCALSTM_after(nn.Module):
         i_t = gates[:, -self.rnn_hidden_dim:]
         # new cell state = gated(prev_c) + gated(new_stuff)
         c_t = torch.mul(c_prev, f_t) + torch.mul(i_t, c_t_new)
-        # make 1st decision attempt
-        h_t = torch.mul(o_t, c_t.tanh())
-        dec_act_t = F.relu(self.ih(h_t))
-        # recall / encode
-        # hpc_input_t = torch.cat([c_t, dec_act_t], dim=1)
-        # inps_t = sigmoid(self.hpc(hpc_input_t))
-        # [inps_t, comp_t] = torch.squeeze(phi_t)
-        m_t = self.recall(c_t, self.em_gate)
-        hpc_input_t = torch.cat([m_t, c_t, dec_act_t], dim=1)
-        em_g_t = sigmoid(self.hpc(hpc_input_t))
-        cm_t = c_t + m_t * em_g_t
+        # the 1st decision attempt only matters for gating the recalled memory
+        # (and the cache), w/o recall the gated memory is zero
+        if self.em.retrieval_off and self.cache_level == 'off':
+            m_t = torch.zeros_like(c_t)
+            cm_t = c_t + m_t
+        else:
+            # make 1st decision attempt
+            h_t = torch.mul(o_t, c_t.tanh())
+            dec_act_t = F.relu(self.ih(h_t))
+            # recall / encode
+            # hpc_input_t = torch.cat([c_t, dec_act_t], dim=1)
+            # inps_t = sigmoid(self.hpc(hpc_input_t))
+            # [inps_t, comp_t] = torch.squeeze(phi_t)
+            m_t = self.recall(c_t, self.em_gate)
+            hpc_input_t = torch.cat([m_t, c_t, dec_act_t], dim=1)
+            em_g_t = sigmoid(self.hpc(hpc_input_t))
+            cm_t = c_t + m_t * em_g_t
         self.encode(cm_t)
         # make final dec
         h_t = torch.mul(o_t, cm_t.tanh())
@@ -102,10 +115,12 @@ class LCALSTM_after(nn.Module):
         h_t = h_t.view(1, h_t.size(0), -1)
         cm_t = cm_t.view(1, cm_t.size(0), -1)
         # scache results
-        scalar_signal = [em_g_t, 0, 0]
-        vector_signal = [f_t, i_t, o_t]
-        misc = [h_t, m_t, cm_t, dec_act_t, self.em.get_vals()]
-        cache = [vector_signal, scalar_signal, misc]
+        if self.cache_level == 'off':
+            return pi_a_t, value_t, (h_t, cm_t), None
+        cache = make_cache(
+            self.cache_level, self.em,
+            [f_t, i_t, o_t], [em_g_t, 0, 0], [h_t, m_t, cm_t, dec_act_t]
+        )
         return pi_a_t, value_t, (h_t, cm_t), cache
 
     def recall(self, c_t, inps_t, comp_t=None):
@@ -161,6 +176,11 @@ class LCALSTM_after(nn.Module):
         log_prob_a_t = m.log_prob(a_t)
         return a_t, log_prob_a_t
 
+    def set_cache_level(self, cache_level):
+        assert cache_level in CACHE_LEVELS, \
+            f'Invalid cache level = {cache_level}'
+        self.cache_level = cache_level
+
     def init_em_config(self):
         self.flush_episodic_memory()
         self.encoding_off()
@@ -182,8 +202,8 @@ class LCALSTM_after(nn.Module):
         self.em.retrieval_off = False
 
 
-def sample_random_vector(n_dim, scale=.1):
-    return torch.randn(1, 1, n_dim) * scale
+def sample_random_vector(n_dim, scale=.1, batch_size=1):
+    return torch.randn(1, batch_size, n_dim) * scale
 
 
 def _softmax(z, beta):
@@ -191,20 +211,20 @@ def _softmax(z, beta):
 
     Parameters
     ----------
-    z : torch tensor, has 1d underlying structure after torch.squeeze
+    z : torch tensor, 1d after torch.squeeze, or 2d (batch_size x n_action)
         the raw logits
     beta : float, >0
         softmax temp, big value -> more "randomness"
 
     Returns
     -------
-    1d torch tensor
-        a probability distribution | beta
+    torch tensor
+        a probability distribution | beta, for each row
 
     """
     assert beta > 0
     # softmax the input to a valid PMF
-    pi_a = F.softmax(torch.squeeze(z / beta), dim=0)
+    pi_a = F.softmax(torch.squeeze(z / beta), dim=-1)
     # make sure the output is valid
     if torch.any(torch.isnan(pi_a)):
         raise ValueError(f'Softmax produced nan: {z} -> {pi_a}')
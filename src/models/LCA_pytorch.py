@@ -16,6 +16,7 @@ recall. Psychological Review, 116(1), 129–156.
 [3] PsyNeuLink: https://github.com/PrincetonUniversity/PsyNeuLink
 """
 import torch
+from functools import lru_cache
 
 
 class LCA():
@@ -148,6 +149,61 @@ class LCA():
         """
 
 
+def fused_lca(
+    stimulus, leak, ltrl_inhib, w_input=1,
+    n_cycles=10, self_excit=0, w_cross=0, offset=0, dt_t=.6, threshold=1,
+):
+    """Run a noiseless LCA on a constant stimulus for a fixed number of cycles,
+    this is equivalent to `LCA(...).run(stimulus.repeat(n_cycles, 1))[-1]`,
+    but ...
+    - the weight matrices have the "diag-offdiag structure", so W @ v is
+    computed as a sum-and-scale: W @ v = (x - y) * v + y * sum(v)
+    - the transformed input is computed once, since the stimulus is constant
+    - it runs on a batch of stimuli, i.e. any leading dims
+
+    Parameters
+    ----------
+    stimulus : torch.tensor, (..., n_units)
+        the input to the accumulators, constant over cycles
+    leak, ltrl_inhib, w_input : float or torch.tensor, broadcastable to
+        (..., 1), e.g. one value for each stimulus
+        see `LCA.__init__`
+    n_cycles : int
+        the number of LCA cycles
+    others : float
+        see `LCA.__init__`
+
+    Returns
+    -------
+    torch.tensor, (..., n_units)
+        the LCA activity at the last cycle
+
+    """
+    # the transformed input, W_i @ s
+    inp = w_input * stimulus
+    if w_cross != 0:
+        inp = inp + w_cross * (stimulus.sum(dim=-1, keepdim=True) - stimulus)
+    # collect the terms of the update formula (see `LCA.run`), s.t.
+    # V_cur = decay * V_prev - inhib * sum(V_prev) + drift
+    decay = 1 + (self_excit + ltrl_inhib - leak) * dt_t
+    inhib = ltrl_inhib * dt_t
+    drift = offset + inp * dt_t
+    # the 1st cycle starts from zeros
+    V = torch.clamp(drift, min=0, max=threshold)
+    for _ in range(n_cycles - 1):
+        V_cur = decay * V - inhib * V.sum(dim=-1, keepdim=True) + drift
+        # output bounding
+        V = torch.clamp(V_cur, min=0, max=threshold)
+    return V
+
+
+@lru_cache(maxsize=None)
+def _get_diag_offdiag_masks(n_units):
+    diag_mask = torch.eye(n_units)
+    offdiag_mask = torch.ones((n_units, n_units)) - torch.eye(n_units)
+    return diag_mask, offdiag_mask
+
+
 def make_weights(diag_val, offdiag_val, n_units):
     """Get a connection weight matrix with "diag-offdial structure"
 
@@ -173,7 +229,6 @@ def make_weights(diag_val, offdiag_val, n_units):
         the weight matrix with "diag-offdial structure"
 
     """
-    diag_mask = torch.eye(n_units)
-    offdiag_mask = torch.ones((n_units, n_units)) - torch.eye(n_units)
+    diag_mask, offdiag_mask = _get_diag_offdiag_masks(n_units)
     weight_matrix = diag_mask * diag_val + offdiag_mask * offdiag_val
     return weight_matrix.float()
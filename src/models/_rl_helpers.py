@@ -10,40 +10,41 @@ eps = np.finfo(np.float32).eps.item()
 
 def get_reward(a_t, y_t, penalty, allow_dk=True):
     """define the reward function at time t
+    - all inputs can be batched, e.g. the actions of all time points of an
+    event sequence, (T,), w/ targets (T x y_dim); or a batch of them
 
     Parameters
     ----------
-    a_t : int
+    a_t : int or torch.tensor (...)
         action
-    a_t_targ : int
-        target action
-    penalty : int
+    y_t : torch.tensor (... x y_dim)
+        target, the target action is argmax(y_t)
+    penalty : int or torch.tensor (...)
         the penalty magnitude of making incorrect state prediction
     allow_dk : bool
         if True, then activating don't know makes r_t = 0, regardless of a_t
 
     Returns
     -------
-    torch.FloatTensor, scalar
+    torch.FloatTensor, (...)
         immediate reward at time t
 
     """
-    dk_id = y_t.size()[0]
+    dk_id = y_t.size()[-1]
+    a_t = torch.as_tensor(a_t)
+    penalty = torch.as_tensor(penalty).type(torch.FloatTensor)
     # if y_t is all zeros (delay period), then action target DNE
-    if torch.all(y_t == 0):
-        # -1 is not in the range of a_t, so r_t = penalty unless a_t == dk
-        a_t_targ = torch.tensor(-1)
-    else:
-        a_t_targ = torch.argmax(y_t)
+    # -1 is not in the range of a_t, so r_t = penalty unless a_t == dk
+    a_t_targ = torch.where(
+        torch.all(y_t == 0, dim=-1),
+        torch.full(y_t.size()[:-1], -1, dtype=torch.long),
+        torch.argmax(y_t, dim=-1)
+    )
     # compare action vs. target action
-    if a_t == dk_id and allow_dk:
-        r_t = 0
-    elif a_t_targ == a_t:
-        r_t = 1
-    else:
-        r_t = - penalty
-    return torch.from_numpy(np.array(r_t)).type(torch.FloatTensor).data
-    # return torch.tensor(r_t).type(torch.FloatTensor).clone().detach()
+    r_t = torch.where(a_t_targ == a_t, torch.ones_like(penalty), -penalty)
+    if allow_dk:
+        r_t = torch.where(a_t == dk_id, torch.zeros_like(r_t), r_t)
+    return r_t.type(torch.FloatTensor).data
 
 
 def compute_returns(rewards, gamma=0, normalize=False):
@@ -51,8 +52,8 @@ def compute_returns(rewards, gamma=0, normalize=False):
 
     Parameters
     ----------
-    rewards : list, 1d array
-        immediate reward at time t, for all t
+    rewards : list, 1d array, or 2d torch.tensor (n x T)
+        immediate reward at time t, for all t (for n trajectories)
     gamma : float, [0,1]
         temporal discount factor
     normalize : bool
@@ -61,20 +62,26 @@ def compute_returns(rewards, gamma=0, normalize=False):
 
     Returns
     -------
-    1d torch.tensor
+    1d torch.tensor, or 2d (n x T)
         the sequence of cumulative return
 
     """
-    # compute cumulative discounted reward since t, for all t
-    R = 0
-    returns = []
-    for r in rewards[::-1]:
-        R = r + gamma * R
-        returns.insert(0, R)
-    returns = torch.tensor(returns)
+    rewards = _as_tensor(rewards)
+    # compute cumulative discounted reward since t, for all t, i.e.
+    # R_t = sum_k gamma^(k-t) r_k, for k >= t, by a backward pass in time,
+    # R_t = r_t + gamma R_t+1
+    if gamma == 0:
+        returns = rewards.clone()
+    else:
+        returns = torch.empty_like(rewards)
+        R = torch.zeros(rewards.size()[:-1])
+        for t in reversed(range(rewards.size(-1))):
+            R = rewards[..., t] + gamma * R
+            returns[..., t] = R
     # normalize w.r.t to the statistics of this trajectory
     if normalize:
-        returns = (returns - returns.mean()) / (returns.std() + eps)
+        returns = (returns - returns.mean(dim=-1, keepdim=True)) / \
+            (returns.std(dim=-1, keepdim=True) + eps)
     return returns
 
 
@@ -83,31 +90,37 @@ def compute_a2c_loss(probs, values, returns, use_V=True):
 
     Parameters
     ----------
-    probs : list
+    probs : list, or torch.tensor (T,) or (n x T)
         action prob at time t
-    values : list
+    values : list, or torch.tensor (T,) or (n x T)
         state value at time t
-    returns : list
+    returns : list, or torch.tensor (T,) or (n x T)
         return at time t
 
     Returns
     -------
     torch.tensor, torch.tensor
-        Description of returned object.
+        the policy gradient and value loss, summed over time; scalars, or
+        (n,) for n trajectories
 
     """
-    policy_grads, value_losses = [], []
-    for prob_t, v_t, R_t in zip(probs, values, returns):
-        if use_V:
-            A_t = R_t - v_t.item()
-            value_losses.append(
-                smooth_l1_loss(torch.squeeze(v_t), torch.squeeze(R_t))
-            )
-        else:
-            A_t = R_t
-            value_losses.append(torch.FloatTensor(0).data)
-        # accumulate policy gradient
-        policy_grads.append(-prob_t * A_t)
-    policy_gradient = torch.stack(policy_grads).sum()
-    value_loss = torch.stack(value_losses).sum()
+    returns = _as_tensor(returns)
+    probs = _as_tensor(probs).view(returns.size())
+    values = _as_tensor(values).view(returns.size())
+    if use_V:
+        A = returns - values.detach()
+        value_loss = smooth_l1_loss(values, returns, reduction='none')
+        value_loss = value_loss.sum(dim=-1)
+    else:
+        A = returns
+        value_loss = torch.zeros(returns.size()[:-1])
+    # accumulate policy gradient
+    policy_gradient = (-probs * A).sum(dim=-1)
     return policy_gradient, value_loss
+
+
+def _as_tensor(x):
+    """stack a list of (scalar) tensors, or convert an array to a tensor"""
+    if isinstance(x, (list, tuple)) and len(x) > 0 and torch.is_tensor(x[0]):
+        return torch.stack([torch.squeeze(x_t) for x_t in x], dim=-1)
+    return torch.as_tensor(x).type(torch.FloatTensor)
@@ -0,0 +1,257 @@
+"""a TorchScript export of LCALSTM, for inference
+notes:
+- `LCALSTMStep` is one step of LCALSTM.forward (the lstm cell, the EM
+retrieval w/ the LCA competition, the encoding, and the actor / critic
+heads) as a pure function of tensors, the episodic memories are an input and
+an output, so the scripted module can be run w/o python objects, e.g.
+
+    step = torch.jit.load(fpath)
+    memory = torch.zeros(1, 0, step.n_hidden)
+    pi_a_t, v_t, h_t, c_t, memory, _ = step(
+        x_t, h_t, c_t, memory, retrieval_on, encoding_on, False, 1.)
+
+- `ScriptedLCALSTM` wraps the scripted module w/ the agent api used by
+`exp_tz.run_tz_eval` (flags, EM, cache), so a loaded export can replace the
+agent in the evaluation scripts, see `utils.io.load_scripted_ckpt`
+- the export is for inference only, the weights are frozen
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from copy import deepcopy
+from typing import Dict
+from torch.distributions import Categorical
+from models.EM import EM
+from models.LCALSTM import N_VSIG, N_SSIG, FusedWeightCache, \
+    fused_linear_weights, make_cache, sample_random_vector
+
+
+class LCALSTMStep(nn.Module):
+    """one step of LCALSTM.forward, w/ the memories as a tensor
+
+    Parameters
+    ----------
+    agent : LCALSTM
+        the agent to export, its weights are copied
+
+    """
+
+    def __init__(self, agent):
+        super(LCALSTMStep, self).__init__()
+        assert agent.em.top_k is None, 'the top k retrieval is not exported'
+        self.n_hidden = agent.rnn_hidden_dim
+        self.size = agent.em.size
+        self.kernel = agent.em.kernel
+        self.cmpt = float(agent.cmpt)
+        self.n_vsig, self.n_ssig = N_VSIG, N_SSIG
+        # [i2h, h2h] as one layer
+        with torch.no_grad():
+            w_rnn, b_rnn = fused_linear_weights(
+                [agent.i2h, agent.h2h], FusedWeightCache())
+        self.register_buffer('w_rnn', w_rnn.clone())
+        self.register_buffer('b_rnn', b_rnn.clone())
+        self.ih = deepcopy(agent.ih)
+        self.actor = deepcopy(agent.actor)
+        self.critic = deepcopy(agent.critic)
+        self.hpc = deepcopy(agent.hpc)
+
+    def forward(
+            self, x_t: torch.Tensor, h_prev: torch.Tensor,
+            c_prev: torch.Tensor, memory: torch.Tensor, retrieval_on: bool,
+            encoding_on: bool, get_cache: bool, beta: float
+    ):
+        """
+        Parameters
+        ----------
+        x_t : torch.tensor, n x input_dim
+            the input, for n lanes
+        h_prev, c_prev : torch.tensor, n x n_hidden
+            the previous state
+        memory : torch.tensor, n x #memories x n_hidden
+            the episodic memories of each lane, from the oldest to the newest
+        retrieval_on, encoding_on : bool
+            the EM flags
+        get_cache : bool
+            whether to return the signals of LCALSTM's cache
+        beta : float
+            the softmax temperature
+
+        Returns
+        -------
+        tensors, dict
+            pi_a_t (n x a_dim), value_t (n x 1), h_t, cm_t (n x n_hidden),
+            the memories after encoding, and the cache signals (f, i, o,
+            inps, m, dec_act), empty if not get_cache
+
+        """
+        n_hidden, n_vsig = self.n_hidden, self.n_vsig
+        preact = F.linear(torch.cat([x_t, h_prev], dim=1), self.w_rnn,
+                          self.b_rnn)
+        # get all gate values
+        gates = preact[:, :n_vsig * n_hidden].sigmoid()
+        c_t_new = preact[:, n_vsig * n_hidden + self.n_ssig:].tanh()
+        f_t = gates[:, :n_hidden]
+        o_t = gates[:, n_hidden:2 * n_hidden]
+        i_t = gates[:, -n_hidden:]
+        c_t = torch.mul(c_prev, f_t) + torch.mul(i_t, c_t_new)
+        # recall, the input strength is computed if needed by the cache
+        m_t = torch.zeros_like(c_t)
+        inps_t = torch.zeros(c_t.size(0), self.n_ssig)
+        if retrieval_on or get_cache:
+            h_t = torch.mul(o_t, c_t.tanh())
+            dec_act_t = F.relu(self.ih(h_t))
+            inps_t = torch.sigmoid(self.hpc(torch.cat([c_t, dec_act_t], 1)))
+            if retrieval_on and memory.size(1) > 0:
+                m_t = self._recall(c_t, memory, inps_t)
+        cm_t = c_t + m_t
+        # encode, keep the last `size` memories
+        if encoding_on:
+            memory = torch.cat([memory, cm_t.unsqueeze(1)], dim=1)
+            memory = memory[:, max(memory.size(1) - self.size, 0):]
+        # make final dec
+        h_t = torch.mul(o_t, cm_t.tanh())
+        dec_act_t = F.relu(self.ih(h_t))
+        pi_a_t = F.softmax(self.actor(dec_act_t) / beta, dim=-1)
+        if bool(torch.any(torch.isnan(pi_a_t))):
+            raise ValueError('Softmax produced nan')
+        value_t = self.critic(dec_act_t)
+        cache: Dict[str, torch.Tensor] = {}
+        if get_cache:
+            cache = {
+                'f': f_t, 'i': i_t, 'o': o_t, 'inps': inps_t, 'm': m_t,
+                'dec_act': dec_act_t,
+            }
+        return pi_a_t, value_t, h_t, cm_t, memory, cache
+
+    def _recall(self, c_t, memory, w_input):
+        """EM._get_memory, for each lane"""
+        q = c_t.unsqueeze(1)
+        if self.kernel == 'cosine':
+            similarities = F.cosine_similarity(q, memory, dim=-1)
+        elif self.kernel == 'l1':
+            similarities = - F.pairwise_distance(q, memory, p=1.)
+        else:
+            similarities = - F.pairwise_distance(q, memory, p=2.)
+        w = self._lca(similarities, w_input)
+        return torch.bmm(w.unsqueeze(1), memory).squeeze(1)
+
+    def _lca(
+            self, stimulus: torch.Tensor, w_input: torch.Tensor,
+            n_cycles: int = 10, dt_t: float = .6
+    ):
+        """`fused_lca` w/ leak = 0, ltrl_inhib = cmpt, and the defaults"""
+        decay = 1 + self.cmpt * dt_t
+        inhib = self.cmpt * dt_t
+        drift = w_input * stimulus * dt_t
+        V = torch.clamp(drift, min=0., max=1.)
+        for _ in range(n_cycles - 1):
+            V_cur = decay * V - inhib * V.sum(dim=-1, keepdim=True) + drift
+            V = torch.clamp(V_cur, min=0., max=1.)
+        return V
+
+
+def export_agent(agent, fpath=None):
+    """script one step of the agent, see `LCALSTMStep`
+
+    Parameters
+    ----------
+    agent : LCALSTM
+        the agent
+    fpath : str
+        if not None, save the scripted module to fpath
+
+    Returns
+    -------
+    torch.jit.ScriptModule
+        the scripted step
+
+    """
+    step = torch.jit.script(LCALSTMStep(agent).eval())
+    if fpath is not None:
+        torch.jit.save(step, fpath)
+    return step
+
+
+class ScriptedLCALSTM():
+    """a scripted LCALSTM step w/ the agent api used by `exp_tz.run_tz_eval`,
+    i.e. a single lane w/ an EM; the memories are passed to the scripted step
+    as a tensor, which is rebuilt only when the EM changed
+
+    Parameters
+    ----------
+    step : torch.jit.ScriptModule
+        the output of `export_agent`, or its `torch.jit.load`
+
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.rnn_hidden_dim = step.n_hidden
+        self.ih, self.actor = step.ih, step.actor
+        self.em = EM(step.size, step.n_hidden, step.kernel)
+        self._memory, self._memory_version = None, -1
+        self.set_cache_level('memory')
+
+    def get_init_states(self, scale=.1, device='cpu', batch_size=1):
+        h_0_ = sample_random_vector(self.rnn_hidden_dim, scale, batch_size)
+        c_0_ = sample_random_vector(self.rnn_hidden_dim, scale, batch_size)
+        return (h_0_, c_0_)
+
+    def forward(self, x_t, hc_prev, beta=1):
+        """see LCALSTM.forward"""
+        (h_prev, c_prev) = hc_prev
+        n = h_prev.size(1)
+        assert n == 1, 'only one lane is supported'
+        pi_a_t, value_t, h_t, cm_t, memory, cache = self.step(
+            x_t.view(n, -1), h_prev.view(n, -1), c_prev.view(n, -1),
+            self._get_memory(), not self.em.retrieval_off,
+            not self.em.encoding_off, self.cache_level != 'off', float(beta)
+        )
+        if not self.em.encoding_off:
+            self._set_memory(memory)
+        pi_a_t = torch.squeeze(pi_a_t)
+        h_t, cm_t = h_t.view(1, n, -1), cm_t.view(1, n, -1)
+        if self.cache_level == 'off':
+            return pi_a_t, value_t, (h_t, cm_t), None
+        cache = make_cache(
+            self.cache_level, self.em,
+            [cache['f'], cache['i'], cache['o']], [cache['inps'], 0, 0],
+            [h_t, cache['m'], cm_t, cache['dec_act']]
+        )
+        return pi_a_t, value_t, (h_t, cm_t), cache
+
+    def _get_memory(self):
+        """the memories as a 1 x #memories x dim tensor"""
+        if self._memory_version != self.em.version:
+            vals = self.em.vals
+            self._memory = torch.stack(vals).unsqueeze(0) if len(vals) > 0 \
+                else torch.zeros(1, 0, self.em.dim)
+            self._memory_version = self.em.version
+        return self._memory
+
+    def _set_memory(self, memory):
+        self.em.vals = list(memory[0])
+        self._memory, self._memory_version = memory, self.em.version
+
+    def pick_action(self, action_distribution):
+        m = Categorical(action_distribution)
+        a_t = m.sample()
+        return a_t, m.log_prob(a_t)
+
+    def set_cache_level(self, cache_level):
+        self.cache_level = cache_level
+
+    def flush_episodic_memory(self):
+        self.em.flush()
+
+    def encoding_off(self):
+        self.em.encoding_off = True
+
+    def retrieval_off(self):
+        self.em.retrieval_off = True
+
+    def encoding_on(self):
+        self.em.encoding_off = False
+
+    def retrieval_on(self):
+        self.em.retrieval_off = False
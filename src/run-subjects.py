@@ -0,0 +1,76 @@
+"""train several subjects concurrently on one machine, w/o a scheduler
+- each subject is a train-sl.py process, the remaining args are passed to
+train-sl.py, e.g.
+python run-subjects.py --subj_ids 0 15 --n_workers 15 --n_threads 4 \
+    --exp_name vary-training-penalty --penalty 4 --n_epoch 1000 ...
+- results are written to the usual build_log_path layout under --log_root
+- interrupted subjects are resumed from their latest checkpoint, subjects
+that finished (see the .done files in --out_dir) are skipped; the .done and
+.log files are keyed on the subject and a hash of the train-sl.py args, so a
+run w/ other args is not skipped
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '--subj_ids', default=[0, 15], type=int, nargs=2,
+    help='the range of subject ids, [start, stop)')
+parser.add_argument('--n_workers', default=4, type=int)
+parser.add_argument('--n_threads', default=1, type=int)
+parser.add_argument('--out_dir', default='run_log/', type=str)
+parser.add_argument('--script', default='train-sl.py', type=str)
+args, train_args = parser.parse_known_args()
+print(args)
+# the key of the train-sl.py args, for the file names of each subject
+train_args_key = hashlib.sha1(
+    json.dumps([args.script] + train_args).encode()).hexdigest()[:10]
+print(f'train args key: {train_args_key}')
+
+# the stdout of each subject, and the "done" markers
+os.makedirs(args.out_dir, exist_ok=True)
+# limit the number of threads of each process, to avoid oversubscription
+env = dict(os.environ)
+for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+    env[var] = str(args.n_threads)
+
+
+def run_subject(subj_id):
+    fname = f'subj-{subj_id}_{train_args_key}'
+    done_fpath = os.path.join(args.out_dir, fname + '.done')
+    if os.path.exists(done_fpath):
+        print(f'subj {subj_id}: done, skipped')
+        return 0
+    cmd = [
+        sys.executable, '-u', args.script, '--subj_id', str(subj_id),
+        '--n_threads', str(args.n_threads), '--resume', '1',
+    ] + train_args
+    log_fpath = os.path.join(args.out_dir, fname + '.log')
+    time0 = time.time()
+    print(f'subj {subj_id}: started, log: {log_fpath}')
+    with open(log_fpath, 'a') as log_file:
+        returncode = subprocess.call(
+            cmd, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    runtime = time.time() - time0
+    print(f'subj {subj_id}: exit code {returncode} | t: %.2fs' % runtime)
+    if returncode == 0:
+        open(done_fpath, 'w').close()
+    return returncode
+
+
+# each worker thread waits for one train-sl.py process at a time
+subj_ids = range(*args.subj_ids)
+with ThreadPoolExecutor(max_workers=args.n_workers) as executor:
+    returncodes = list(executor.map(run_subject, subj_ids))
+
+failed = [s for s, rc in zip(subj_ids, returncodes) if rc != 0]
+print(f'{len(subj_ids) - len(failed)}/{len(subj_ids)} subjects finished')
+if len(failed) > 0:
+    print(f'failed: {failed}, rerun to resume them')
+    sys.exit(1)
@@ -0,0 +1,128 @@
+"""generate the event sequences for the upcoming epochs in the background
+notes:
+- the data for epoch k is sampled with its own seed, derived from (seed, k),
+so the data only depends on the seed, not on the number of workers
+- the sampler uses the global numpy rng, so workers are processes, not threads
+"""
+import numpy as np
+import multiprocessing as mp
+from utils.utils_u import to_pth
+
+
+class Prefetcher():
+    """A producer/consumer pipeline for SequenceLearning: n_workers processes
+    sample the (X, Y) of the next epochs, while the current epoch is being
+    processed; the queue of each worker holds at most queue_size epochs
+
+    Parameters
+    ----------
+    task : SequenceLearning
+        the task to sample from
+    n_examples : int
+        the number of event sequences per epoch
+    n_epochs : int
+        the total number of epochs, the data of epochs start_epoch, ...,
+        n_epochs - 1 is generated
+    seed : int
+        the seed for the data of all epochs
+    n_workers : int
+        the number of worker processes, if 0, sample in the main process,
+        when the data is requested
+    queue_size : int
+        the max number of epochs prefetched by each worker
+    start_epoch : int
+        the first epoch, e.g. when resuming a run, s.t. the data of each
+        epoch is the same as in an uninterrupted run
+
+    """
+
+    def __init__(
+            self, task, n_examples, n_epochs, seed,
+            n_workers=1, queue_size=2, start_epoch=0,
+    ):
+        self.task = task
+        self.n_examples = n_examples
+        self.n_epochs = n_epochs
+        self.seed = seed
+        self.n_workers = n_workers
+        self.queue_size = queue_size
+        self.start_epoch = start_epoch
+        self.epoch_id = start_epoch
+        self._queues, self._workers = [], []
+        if n_workers > 0:
+            self._start()
+
+    def _start(self):
+        # fork if possible, spawn would rerun the (unguarded) training script
+        if 'fork' in mp.get_all_start_methods():
+            ctx = mp.get_context('fork')
+        else:
+            ctx = mp.get_context()
+        for worker_id in range(self.n_workers):
+            queue = ctx.Queue(maxsize=self.queue_size)
+            worker = ctx.Process(
+                target=_produce, daemon=True,
+                args=(queue, self.task, self.n_examples, self.seed,
+                      range(self.start_epoch + worker_id, self.n_epochs,
+                            self.n_workers))
+            )
+            worker.start()
+            self._queues.append(queue)
+            self._workers.append(worker)
+
+    def get(self, to_torch=True):
+        """get the data for the next epoch
+
+        Returns
+        -------
+        list, list
+            X, Y, as returned by task.sample
+
+        """
+        assert self.epoch_id < self.n_epochs, 'out of epochs'
+        if self.n_workers > 0:
+            # epochs are assigned to the workers in a round robin manner
+            worker_id = (self.epoch_id - self.start_epoch) % self.n_workers
+            queue = self._queues[worker_id]
+            epoch_id, X, Y = queue.get()
+            assert epoch_id == self.epoch_id
+        else:
+            X, Y = sample_epoch(
+                self.task, self.n_examples, self.seed, self.epoch_id)
+        self.epoch_id += 1
+        if to_torch:
+            X = [to_pth(X_i) for X_i in X]
+            Y = [to_pth(Y_i) for Y_i in Y]
+        return X, Y
+
+    def close(self):
+        for worker in self._workers:
+            worker.terminate()
+            worker.join()
+        self._queues, self._workers = [], []
+
+    def __iter__(self):
+        while self.epoch_id < self.n_epochs:
+            yield self.get()
+
+    def __del__(self):
+        self.close()
+
+
+def sample_epoch(task, n_examples, seed, epoch_id):
+    """sample the data for the epoch_id-th epoch, w/ a seed derived from
+    (seed, epoch_id); the global numpy rng state is restored after sampling
+    """
+    rng_state = np.random.get_state()
+    entropy = np.random.SeedSequence([seed, epoch_id]).generate_state(1)
+    np.random.seed(entropy[0])
+    X, Y = task.sample(n_examples, to_torch=False)
+    np.random.set_state(rng_state)
+    return X, Y
+
+
+def _produce(queue, task, n_examples, seed, epoch_ids):
+    for epoch_id in epoch_ids:
+        X, Y = sample_epoch(task, n_examples, seed, epoch_id)
+        # block if the queue is full
+        queue.put((epoch_id, X, Y))
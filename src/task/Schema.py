@@ -59,6 +59,43 @@ class Schema():
         """
         return self._sample_key_val()
 
+    def sample_batch(self, n):
+        """sample n event sequences at once, equivalent to calling `sample` n
+        times, but all time points of all events are sampled at once
+
+        Parameters
+        ----------
+        n : int
+            the number of event sequences
+
+        Returns
+        -------
+        2d np array, 2d np array; n x T, n x T
+            sequence of key / parameter values over time, for each event
+
+        """
+        T = self.n_param
+        # construct keys
+        if self.key_rep_type == 'node':
+            key_branch_id = np.random.randint(self.n_branch, size=(n, T))
+            time_shifts = np.arange(T) * self.n_branch
+            key = key_branch_id + time_shifts
+        elif self.key_rep_type == 'time':
+            key = np.tile(np.arange(T), (n, 1))
+        else:
+            raise ValueError(f'unrecog representation type {self.key_rep_type}')
+        # sample values by inverse cdf, the t-th row of the transition matrix
+        # is the distribution of the value at time t
+        cdf = np.cumsum(self.transition, axis=1)
+        u = np.random.uniform(size=(n, T, 1))
+        val = np.sum(u > cdf, axis=-1)
+        # in case the cdf doesn't sum to 1 due to rounding
+        val = np.minimum(val, self.n_branch - 1)
+        # type conversion
+        val = val.astype(np.int16)
+        key = key.astype(np.int16)
+        return key, val
+
     def _sample_key_val(self):
         """sample a sequence of key-value pairs, which can be used to
         instantiate an event sequence
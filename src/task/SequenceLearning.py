@@ -2,7 +2,6 @@ import numpy as np
 from collections import deque
 from utils.utils_u import to_pth
 from task.utils_t import get_event_ends
-from analysis.task import compute_event_similarity
 from task.StimSampler import StimSampler
 # import pdb
 # pdb.set_trace()
@@ -31,6 +30,7 @@ class SequenceLearning():
             similarity_max=None,
             similarity_min=None,
             similarity_cap_lag=2,
+            min_acceptance_rate=.05,
             permute_queries=False,
             permute_observations=True,
             key_rep_type='time',
@@ -83,40 +83,16 @@ class SequenceLearning():
             self.similarity_min = 0
         else:
             self.similarity_min = similarity_min
+        # if the similarity constraint rejects too many candidates, repair the
+        # rejected candidates instead, see `_sample_constrained`
+        self.min_acceptance_rate = min_acceptance_rate
+        self.sampling_stats = None
 
     def sample(
             self, n_samples,
             interleave=False, to_torch=True, return_misc=False
     ):
-        # prealloc, agnostic about sequence length
-        X = [None] * n_samples
-        Y = [None] * n_samples
-        misc = [None] * n_samples
-        # track the last k events
-        prev_events = deque(maxlen=self.similarity_cap_lag)
-
-        # generate samples
-        i = 0
-        while i < n_samples:
-            sample_i, misc_i = self.stim_sampler.sample(
-                n_parts=self.n_parts,
-                p_rm_ob_enc=self.p_rm_ob_enc,
-                p_rm_ob_rcl=self.p_rm_ob_rcl,
-                permute_queries=self.permute_queries,
-                permute_observations=self.permute_observations,
-            )
-            # compute similarity(event_i vs. event_j) for j in prev-k-events
-            _, Y_i_int = misc_i
-            prev_sims = np.array([compute_event_similarity(Y_j_int, Y_i_int)
-                                  for Y_j_int in prev_events])
-            if np.any(prev_sims > self.similarity_max) or np.any(prev_sims < self.similarity_min):
-                continue
-            else:
-                # collect data
-                prev_events.append(Y_i_int)
-                misc[i] = misc_i
-                X[i], Y[i] = _to_xy(sample_i)
-                i += 1
+        X, Y, misc = self._sample_constrained(n_samples)
 
         if interleave:
             X, Y = interleave_stories(X, Y, self.n_parts)
@@ -130,6 +106,188 @@ class SequenceLearning():
             return X, Y, misc
         return X, Y
 
+    def _sample_constrained(self, n_samples):
+        """sample n event sequences s.t. the similarity between each event and
+        its previous k (= similarity_cap_lag) events is within
+        [similarity_min, similarity_max]
+
+        candidates are sampled in bulk and tested against the previous events
+        all at once; candidates are considered in order, a rejected candidate
+        is never revisited, so this is the same as sequential rejection
+        sampling. if the acceptance rate drops below min_acceptance_rate, the
+        rejected candidates are repaired (only the offending time points are
+        resampled) instead of discarded
+
+        the sampling statistics are stored in self.sampling_stats
+
+        Parameters
+        ----------
+        n_samples : int
+            the number of event sequences
+
+        Returns
+        -------
+        list, list, list
+            X, Y, misc, one item for each event sequence
+
+        """
+        X, Y, misc = [], [], []
+        # the last k events
+        prev_events = deque(maxlen=self.similarity_cap_lag)
+        n_drawn, n_accepted = 0, 0
+        while len(X) < n_samples:
+            # draw more candidates if the acceptance rate is low
+            n_todo = n_samples - len(X)
+            acc_rate = 1 if n_drawn == 0 else max(n_accepted, 1) / n_drawn
+            n_pool = min(int(np.ceil(n_todo / acc_rate)), 64 * n_todo)
+            X_, Y_, misc_ = self._sample_candidates(n_pool)
+            vals = np.array([misc_i[1] for misc_i in misc_])
+            # the similarity between the last k events and all candidates
+            prev_sims = deque(
+                [np.mean(vals == e, axis=1) for e in prev_events],
+                maxlen=self.similarity_cap_lag
+            )
+            repair = n_drawn > 0 and acc_rate < self.min_acceptance_rate
+            i = 0
+            while i < n_pool and len(X) < n_samples:
+                # find the next candidate that satisfies the constraint
+                ok = self._within_similarity_bounds(prev_sims, n_pool)
+                next_i = np.flatnonzero(ok[i:])
+                if len(next_i) > 0 and not (repair and next_i[0] > 0):
+                    n_drawn += int(next_i[0]) + 1
+                    n_accepted += 1
+                    i += next_i[0]
+                    X_i, Y_i, misc_i = X_[i], Y_[i], misc_[i]
+                elif repair:
+                    # resample the offending time points of the i-th candidate
+                    n_drawn += 1
+                    misc_i = self._repair_candidate(misc_[i], prev_events)
+                    if misc_i is None:
+                        i += 1
+                        continue
+                    X_i, Y_i = self._build_candidate(misc_i, len(X_[i]))
+                else:
+                    n_drawn += n_pool - i
+                    break
+                # collect data
+                X.append(X_i)
+                Y.append(Y_i)
+                misc.append(misc_i)
+                prev_events.append(misc_i[1])
+                prev_sims.append(np.mean(vals == misc_i[1], axis=1))
+                i += 1
+        self.sampling_stats = {
+            'n_drawn': n_drawn, 'n_accepted': n_accepted,
+            'n_repaired': n_samples - n_accepted,
+            'acceptance_rate': n_accepted / n_drawn,
+        }
+        return X, Y, misc
+
+    def _within_similarity_bounds(self, sims, n):
+        """given the similarity between n candidates and the previous events,
+        a list of 1d arrays (one per previous event), return a bool mask
+        """
+        if len(sims) == 0:
+            return np.ones(n, dtype=bool)
+        sims = np.array(sims)
+        return np.all(
+            (sims <= self.similarity_max) & (sims >= self.similarity_min),
+            axis=0
+        )
+
+    def _repair_candidate(self, misc_i, prev_events, max_iter=None):
+        """resample the time points of a candidate event that violate the
+        similarity constraint w.r.t the previous events, one at a time
+        - if it is too similar to an event, a shared value is resampled (w.r.t
+        the transition probs, excluding the current value)
+        - if it is too dissimilar to an event, copy a value from that event
+
+        Returns
+        -------
+        list or None
+            [keys, vals] of the repaired event, None if failed to repair
+
+        """
+        keys, vals = misc_i
+        vals = np.copy(vals)
+        if len(prev_events) == 0:
+            return [keys, vals]
+        if max_iter is None:
+            max_iter = self.n_param * 4
+        transition = self.stim_sampler.schema.transition
+        prev = np.array(prev_events)
+        for _ in range(max_iter):
+            match = prev == vals
+            sims = np.mean(match, axis=1)
+            too_high = sims > self.similarity_max
+            too_low = sims < self.similarity_min
+            if np.any(too_high):
+                t = np.random.choice(
+                    np.flatnonzero(np.any(match[too_high], axis=0)))
+                p_t = np.copy(transition[t])
+                p_t[vals[t]] = 0
+                if np.sum(p_t) == 0:
+                    return None
+                vals[t] = np.random.choice(self.n_branch, p=p_t / np.sum(p_t))
+            elif np.any(too_low):
+                j = np.random.choice(np.flatnonzero(too_low))
+                t = np.random.choice(np.flatnonzero(~match[j]))
+                vals[t] = prev[j, t]
+            else:
+                return [keys, vals]
+        return None
+
+    def _build_candidate(self, misc_i, T_total):
+        """generate x, y for a pre-defined event (keys, vals)"""
+        _, pad_len, _, _ = self.get_time_param(T_total)
+        keys, vals = misc_i
+        sample_, _ = self.stim_sampler.sample_batch(
+            1,
+            n_parts=self.n_parts,
+            p_rm_ob_enc=self.p_rm_ob_enc,
+            p_rm_ob_rcl=self.p_rm_ob_rcl,
+            permute_queries=self.permute_queries,
+            permute_observations=self.permute_observations,
+            pad_len=pad_len,
+            keys_vals=[keys[None], vals[None]],
+        )
+        X_, Y_ = _to_xy_batch(sample_)
+        return X_[0], Y_[0]
+
+    def _sample_candidates(self, n):
+        """sample n event sequences in batch, w/o the similarity constraint,
+        events with the same padding length are sampled together
+
+        Parameters
+        ----------
+        n : int
+            the number of event sequences
+
+        Returns
+        -------
+        list, list, list
+            X, Y, misc, one item for each event sequence
+
+        """
+        X, Y, misc = [None] * n, [None] * n, [None] * n
+        pad_lens = self.stim_sampler.sample_pad_len(size=n)
+        for pad_len in np.unique(pad_lens):
+            ids = np.where(pad_lens == pad_len)[0]
+            sample_, misc_ = self.stim_sampler.sample_batch(
+                len(ids),
+                n_parts=self.n_parts,
+                p_rm_ob_enc=self.p_rm_ob_enc,
+                p_rm_ob_rcl=self.p_rm_ob_rcl,
+                permute_queries=self.permute_queries,
+                permute_observations=self.permute_observations,
+                pad_len=pad_len,
+            )
+            X_, Y_ = _to_xy_batch(sample_)
+            keys, vals = misc_
+            for j, i in enumerate(ids):
+                X[i], Y[i], misc[i] = X_[j], Y_[j], [keys[j], vals[j]]
+        return X, Y, misc
+
     def get_time_param(self, T_total):
         """compute time related parameters
         since it might be unique for each example
@@ -174,7 +332,7 @@ class SequenceLearning():
             the mask
 
         """
-        return np.array([t % T_part >= pad_len for t in range(T_total)], dtype=dtype)
+        return (np.arange(T_total) % T_part >= pad_len).astype(dtype)
 
 
 def _to_xy(sample_):
@@ -192,6 +350,22 @@ def _to_xy(sample_):
     return x, y
 
 
+def _to_xy_batch(sample_):
+    """the batched version of `_to_xy`, keys and vals are n x nP x T x dim
+    returns x, n x (nP x T) x x_dim, and y, n x (nP x T) x y_dim
+    """
+    # unpack data
+    observations, queries = sample_
+    [o_keys_vec, o_vals_vec, _] = observations
+    [q_keys_vec, _, _] = queries
+    # form x and y
+    n, n_parts, T, _ = np.shape(o_keys_vec)
+    x = np.concatenate([o_keys_vec, o_vals_vec, q_keys_vec], axis=-1)
+    x = np.reshape(x, (n, n_parts * T, -1))
+    y = np.reshape(queries[1], (n, n_parts * T, -1))
+    return x, y
+
+
 def _split_xy(X_, Y_, n_parts):
     X_split_ = np.array_split(X_, n_parts, axis=0)
     Y_split_ = np.array_split(Y_, n_parts, axis=0)
@@ -137,6 +137,116 @@ class StimSampler():
         sample_ = [o_sample_, q_sample_]
         return sample_, misc
 
+    def sample_batch(
+            self, n,
+            n_parts=2, p_rm_ob_enc=0, p_rm_ob_rcl=0,
+            permute_observations=True, permute_queries=False, pad_len=None,
+            keys_vals=None,
+    ):
+        """sample n multi-part "movies" at once, the batched version of
+        `sample`, all events in the batch have the same padding length
+
+        Parameters
+        ----------
+        n : int
+            the number of event sequences
+        pad_len : int
+            the padding length for all events, if None, then sample one
+            padding length for the batch, see `sample_pad_len`
+        keys_vals : list
+            [keys, vals], pre-defined integer representation (n x T), if
+            None, then sample them from the schema
+        others :
+            see `sample`
+
+        Returns
+        -------
+        list, list
+            [observations, queries], each is [keys, vals, ctxs], where keys
+            and vals are 4d arrays, n x nP x T x dim, ctxs is T x c_dim;
+            [keys, vals], the integer representation, n x T
+
+        """
+        # sample the state-param associtations
+        if keys_vals is None:
+            keys, vals = self.schema.sample_batch(n)
+        else:
+            keys, vals = keys_vals
+        # translate to vector representation, n x T x dim
+        keys_vec_ = self.schema.key_rep[keys]
+        vals_vec_ = self.schema.val_rep[vals]
+        ctxs_vec_ = self.schema.ctx_rep
+        # sample for the observation phase, n x nP x T x dim
+        o_keys_vec, o_vals_vec = self._batch_permutations(
+            keys_vec_, vals_vec_, n_parts, permute_observations)
+        q_keys_vec, q_vals_vec = self._batch_permutations(
+            keys_vec_, vals_vec_, n_parts, permute_queries)
+        # corrupt input during encoding
+        p_rms = [p_rm_ob_enc] * (n_parts - 1) + [p_rm_ob_rcl]
+        for ip in range(n_parts):
+            rows_to0 = _sample_rows_to0(
+                n, self.n_param, p_rms[ip], n_rm_fixed=self.n_rm_fixed)
+            o_vals_vec[:, ip][rows_to0] = 0
+            if self.rm_kv:
+                o_keys_vec[:, ip][rows_to0] = 0
+        # whether to repeat query
+        if self.repeat_query:
+            q_keys_vec = np.tile(
+                get_botvinick_query(self.n_param), (n, n_parts, 1, 1))
+        # pad all events, if there is a delay
+        if pad_len is None:
+            pad_len = self.sample_pad_len()
+        o_sample_ = _zero_pad_batch(
+            [o_keys_vec, o_vals_vec, ctxs_vec_], pad_len, side='bot')
+        q_sample_ = _zero_pad_batch(
+            [q_keys_vec, q_vals_vec, ctxs_vec_], pad_len, side='top')
+        # pack sample
+        sample_ = [o_sample_, q_sample_]
+        misc = [keys, vals]
+        return sample_, misc
+
+    def _batch_permutations(self, keys_vec_raw, vals_vec_raw, n_parts, permute):
+        """the batched version of `_sample_permutations_sup`
+        given n x T x dim arrays, return n x nP x T x dim arrays
+        """
+        n, T, _ = np.shape(keys_vec_raw)
+        if permute:
+            # a unique permutation for each movie part of each event
+            perm_op = np.argsort(np.random.uniform(size=(n, n_parts, T)), -1)
+        else:
+            perm_op = np.tile(np.arange(T), (n, n_parts, 1))
+        event_ids = np.arange(n)[:, np.newaxis, np.newaxis]
+        return keys_vec_raw[event_ids, perm_op], vals_vec_raw[event_ids, perm_op]
+
+    def sample_pad_len(self, size=None):
+        """sample the padding length(s)
+
+        Parameters
+        ----------
+        size : int
+            if None, return a padding length, else return `size` of them
+
+        Returns
+        -------
+        int or 1d np array
+            the padding length(s)
+
+        """
+        if self.pad_len == 0 or self.max_pad_len == 0:
+            pad_len = np.zeros(size, dtype=int) if size is not None else 0
+        # uniformly sample a padding length
+        elif self.pad_len == 'random':
+            # high is exclusive so need to add 1
+            pad_len = np.random.randint(
+                low=0, high=self.max_pad_len + 1, size=size)
+        # fixed padding length
+        elif self.pad_len > 0:
+            pad_len = np.full(size, self.pad_len) \
+                if size is not None else self.pad_len
+        else:
+            raise ValueError(f'Invalid delay length: {self.pad_len}')
+        return pad_len
+
     def _sample_permutations_sup(
         self, keys_vec_raw, vals_vec_raw, n_parts, permute
     ):
@@ -230,16 +340,7 @@ class StimSampler():
         """
         if self.pad_len == 0 or self.max_pad_len == 0:
             return o_sample_, q_sample_
-        # uniformly sample a padding length
-        if self.pad_len == 'random':
-            # high is exclusive so need to add 1
-            pad_len = np.random.randint(low=0, high=self.max_pad_len + 1)
-        # fixed padding length
-        elif self.pad_len > 0:
-            pad_len = self.pad_len
-        else:
-            raise ValueError(f'Invalid delay length: {self.pad_len}')
-
+        pad_len = self.sample_pad_len()
         # padd the data
         o_sample_ = _zero_pad_kvc(o_sample_, pad_len, side='bot')
         q_sample_ = _zero_pad_kvc(q_sample_, pad_len, side='top')
@@ -282,6 +383,56 @@ def _zero_out_random_rows(matrices, p_rm, n_rm_fixed=True):
     return matrices
 
 
+def _sample_rows_to0(n, n_rows, p_rm, n_rm_fixed=True):
+    """the batched version of the row selection in `_zero_out_random_rows`
+
+    Parameters
+    ----------
+    n : int
+        the number of matrices
+    n_rows : int
+        the number of rows of each matrix
+    p_rm : float
+        probability for set a row of zero
+
+    Returns
+    -------
+    2d np array, n x n_rows
+        rows_to0[i, t] is True iff the t-th row of the i-th matrix is zeroed
+
+    """
+    assert 0 <= p_rm <= 1
+    # select # row(s) to zero out, for each matrix
+    if n_rm_fixed:
+        n_rows_to0 = np.full(n, np.ceil(p_rm * n_rows))
+    else:
+        # in this case, p_rm == E[rows_to_remove]
+        max_rows_to_remove = p_rm * n_rows
+        n_rows_to0 = np.round(
+            np.random.uniform(high=max_rows_to_remove, size=n))
+    # the rank of each row in a random order, select the top ranked rows
+    row_ranks = np.argsort(np.argsort(
+        np.random.uniform(size=(n, n_rows)), axis=-1), axis=-1)
+    return row_ranks < n_rows_to0[:, np.newaxis]
+
+
+def _zero_pad_batch(kvc: list, pad_len: int, side: str):
+    """the batched version of `_zero_pad_kvc`, pad the time axis of
+    keys/vals (n x nP x T x dim) and ctxs (T x c_dim)
+    """
+    keys_vec, vals_vec, ctxs_vec = kvc
+    if pad_len == 0:
+        return [keys_vec, vals_vec, ctxs_vec]
+    if side not in ['top', 'bot']:
+        raise ValueError('Unrecognizable padding side')
+    pad_width = (pad_len, 0) if side == 'top' else (0, pad_len)
+    keys_vec = np.pad(keys_vec, [(0, 0), (0, 0), pad_width, (0, 0)])
+    vals_vec = np.pad(vals_vec, [(0, 0), (0, 0), pad_width, (0, 0)])
+    # context is assumed to be in sync with the queries, see `_zero_pad_kvc`
+    ctxs_vec = np.pad(ctxs_vec, [(pad_len, 0), (0, 0)])
+    return [keys_vec, vals_vec, ctxs_vec]
+
+
 def _zero_pad_kvc(kvc: list, pad_len: int, side: str):
     """delay the prediction demand by shifting the query value to later time
     points
@@ -9,12 +9,13 @@ import seaborn as sns
 from models import LCALSTM_after as Agent
 from task import SequenceLearning
 from exp_tz import run_tz
-from analysis import compute_behav_metrics, compute_acc, compute_dk
+from analysis import compute_behav_metrics, compute_acc, compute_dk, \
+    test_data_to_columns
 from vis import plot_pred_acc_full
 from utils.params import P
 from utils.constants import TZ_COND_DICT
 from utils.io import build_log_path, save_ckpt, save_all_params,  \
-    pickle_save_dict, get_test_data_dir, get_test_data_fname
+    save_columnar, get_test_data_dir, get_test_data_fname, get_columnar_path
 
 plt.switch_backend('agg')
 sns.set(style='white', palette='colorblind', context='talk')
@@ -280,6 +281,7 @@ for fix_penalty in np.arange(0, penalty + 1, 2):
     [results, metrics, XY] = run_tz(
         agent, optimizer, task, p, n_examples_test,
         supervised=False, learning=False, get_data=True,
+        record_cache=True,
         fix_cond=fix_cond, fix_penalty=fix_penalty,
         slience_recall_time=slience_recall_time, scramble=scramble
     )
@@ -291,4 +293,5 @@ for fix_penalty in np.arange(0, penalty + 1, 2):
         n_examples_test, fix_cond, scramble)
     test_data_dict = {'results': results, 'metrics': metrics, 'XY': XY}
     fpath = os.path.join(test_data_dir, test_data_fname)
-    pickle_save_dict(test_data_dict, fpath)
+    save_columnar(
+        get_columnar_path(fpath), *test_data_to_columns(test_data_dict, p))
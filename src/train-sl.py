@@ -8,13 +8,18 @@ import seaborn as sns
 
 from models import LCALSTM as Agent
 from task import SequenceLearning
-from exp_tz import run_tz
-from analysis import compute_behav_metrics, compute_acc, compute_dk
+from task.Prefetcher import Prefetcher
+from exp_tz import run_tz, run_tz_batched
+from analysis import compute_behav_metrics, compute_acc, compute_dk, \
+    test_data_to_columns
 from vis import plot_pred_acc_full
 from utils.params import P
+from utils.profiler import Profiler, NULL_PROFILER, FIELDS as PROFILE_FIELDS
 from utils.constants import TZ_COND_DICT
-from utils.io import build_log_path, save_ckpt, save_all_params,  \
-    pickle_save_dict, get_test_data_dir, get_test_data_fname
+from utils.io import build_log_path, save_ckpt, load_ckpt, save_all_params,  \
+    save_columnar, get_test_data_dir, get_test_data_fname, \
+    get_latest_ckpt_epoch, get_columnar_path, save_train_state, \
+    load_train_state
 
 plt.switch_backend('agg')
 sns.set(style='white', palette='colorblind', context='talk')
@@ -50,6 +55,11 @@ parser.add_argument('--n_event_remember', default=2, type=int)
 parser.add_argument('--sup_epoch', default=1, type=int)
 parser.add_argument('--n_epoch', default=2, type=int)
 parser.add_argument('--n_examples', default=256, type=int)
+parser.add_argument('--batch_size', default=1, type=int)
+parser.add_argument('--n_prefetch_workers', default=0, type=int)
+parser.add_argument('--n_threads', default=0, type=int)
+parser.add_argument('--profile', default=0, type=int)
+parser.add_argument('--resume', default=0, type=int)
 parser.add_argument('--log_root', default='../log/', type=str)
 args = parser.parse_args()
 print(args)
@@ -83,6 +93,11 @@ cmpt = args.cmpt
 eta = args.eta
 n_event_remember = args.n_event_remember
 n_examples = args.n_examples
+batch_size = args.batch_size
+n_prefetch_workers = args.n_prefetch_workers
+n_threads = args.n_threads
+profile = bool(args.profile)
+resume = bool(args.resume)
 n_epoch = args.n_epoch
 supervised_epoch = args.sup_epoch
 log_root = args.log_root
@@ -92,6 +107,9 @@ log_root = args.log_root
 seed_val = subj_id + 320
 np.random.seed(seed_val)
 torch.manual_seed(seed_val)
+# limit the number of threads, e.g. when several subjects share a machine
+if n_threads > 0:
+    torch.set_num_threads(n_threads)
 
 p = P(
     exp_name=exp_name, subj_id=subj_id,
@@ -139,9 +157,21 @@ scheduler_rl = torch.optim.lr_scheduler.ReduceLROnPlateau(
 
 # create logging dirs
 log_path, log_subpath = build_log_path(subj_id, p, log_root=log_root)
-# save experiment params initial weights
-save_all_params(log_subpath['data'], p)
-save_ckpt(0, log_subpath['ckpts'], agent, optimizer_sup)
+# resume from the latest checkpoint, if any; the ckpt of the final epoch is
+# ignored, s.t. the results of the last epoch are available for the plots
+epoch_id = 0
+epoch_load = get_latest_ckpt_epoch(
+    log_subpath['ckpts'], max_epoch=n_epoch - 1) if resume else None
+if epoch_load is not None and epoch_load > 0:
+    # the ckpt of epoch k holds the optimizer used in the k-1th epoch
+    optimizer = optimizer_sup if epoch_load - 1 < supervised_epoch \
+        else optimizer_rl
+    load_ckpt(epoch_load, log_subpath['ckpts'], agent, optimizer)
+    epoch_id = epoch_load
+else:
+    # save experiment params initial weights
+    save_all_params(log_subpath['data'], p)
+    save_ckpt(0, log_subpath['ckpts'], agent, optimizer_sup)
 
 
 '''task definition'''
@@ -155,10 +185,59 @@ Log_acc = np.zeros((n_epoch, task.n_parts))
 Log_mis = np.zeros((n_epoch, task.n_parts))
 Log_dk = np.zeros((n_epoch, task.n_parts))
 Log_cond = np.zeros((n_epoch, n_examples))
-
-epoch_id = 0
+# the time of each phase and the em counters, see utils.profiler
+Log_profile = {name: np.zeros(n_epoch,) for name in PROFILE_FIELDS}
+profiler = Profiler() if profile else NULL_PROFILER
+# all logs by name, they are saved w/ the ckpts, see get_train_state
+Logs = {
+    'loss_critic': Log_loss_critic, 'loss_actor': Log_loss_actor,
+    'loss_sup': Log_loss_sup, 'return': Log_return, 'pi_ent': Log_pi_ent,
+    'acc': Log_acc, 'mis': Log_mis, 'dk': Log_dk, 'cond': Log_cond,
+    **{'profile_' + name: log for name, log in Log_profile.items()},
+}
+
+
+def get_train_state():
+    """the state of the run that is not in the ckpt, s.t. a resumed run
+    continues as if it wasn't interrupted
+    """
+    return {
+        'logs': Logs,
+        'scheduler_sup': scheduler_sup.state_dict(),
+        'scheduler_rl': scheduler_rl.state_dict(),
+        'np_rng': np.random.get_state(),
+        'torch_rng': torch.get_rng_state(),
+        'em_vals': agent.em.get_vals(),
+    }
+
+
+# restore the logs, the lr schedulers, the rngs and the EM of the resumed run
+if epoch_id > 0:
+    train_state = load_train_state(epoch_id, log_subpath['ckpts'])
+    if train_state is None:
+        print(f'no training state for epoch {epoch_id}, the logs, the lr '
+              f'schedulers and the rngs start fresh')
+    else:
+        for name, log in Logs.items():
+            log[:epoch_id] = train_state['logs'][name][:epoch_id]
+        scheduler_sup.load_state_dict(train_state['scheduler_sup'])
+        scheduler_rl.load_state_dict(train_state['scheduler_rl'])
+        np.random.set_state(train_state['np_rng'])
+        torch.set_rng_state(train_state['torch_rng'])
+        agent.em.vals = train_state['em_vals']
+
+# sample the data for the upcoming epochs in the background
+if n_prefetch_workers > 0:
+    prefetcher = Prefetcher(
+        task, n_examples, n_epoch, seed_val,
+        n_workers=n_prefetch_workers, start_epoch=epoch_id
+    )
 for epoch_id in np.arange(epoch_id, n_epoch):
     time0 = time.time()
+    if profile:
+        profiler.reset()
+    with profiler.phase('sample'):
+        data = prefetcher.get() if n_prefetch_workers > 0 else None
     # training objective
     supervised = epoch_id < supervised_epoch
     if supervised:
@@ -166,10 +245,21 @@ for epoch_id in np.arange(epoch_id, n_epoch):
     else:
         optimizer = optimizer_rl
 
-    [results, metrics] = run_tz(
-        agent, optimizer, task, p, n_examples, fix_cond=None, learning=True,
-        get_cache=False, supervised=supervised, noRL=noRL,
-    )
+    if batch_size > 1:
+        [results, metrics] = run_tz_batched(
+            agent, optimizer, task, p, n_examples, fix_cond=None,
+            get_cache=False, supervised=supervised, noRL=noRL,
+            batch_size=batch_size, data=data, profiler=profiler,
+        )
+    else:
+        [results, metrics] = run_tz(
+            agent, optimizer, task, p, n_examples, fix_cond=None,
+            learning=True, get_cache=False, supervised=supervised, noRL=noRL,
+            data=data, profiler=profiler,
+        )
+    if profile:
+        for name, val in profiler.summary().items():
+            Log_profile[name][epoch_id] = val
 
     [dist_a, targ_a, _, Log_cond[epoch_id]] = results
     [Log_loss_sup[epoch_id], Log_loss_actor[epoch_id], Log_loss_critic[epoch_id],
@@ -189,6 +279,8 @@ for epoch_id in np.arange(epoch_id, n_epoch):
         Log_loss_actor[epoch_id], Log_loss_critic[epoch_id],
         Log_loss_sup[epoch_id], runtime)
     print(msg)
+    if profile:
+        print('    | ' + profiler.format())
 
     # update lr scheduler
     if supervised:
@@ -200,7 +292,13 @@ for epoch_id in np.arange(epoch_id, n_epoch):
     # save weights
     if np.mod(epoch_id + 1, log_freq) == 0:
         save_ckpt(epoch_id + 1, log_subpath['ckpts'], agent, optimizer)
+        save_train_state(
+            epoch_id + 1, log_subpath['ckpts'], get_train_state())
 
+if n_prefetch_workers > 0:
+    prefetcher.close()
+if profile:
+    np.savez(os.path.join(log_subpath['data'], 'profile.npz'), **Log_profile)
 
 '''plot learning curves'''
 f, axes = plt.subplots(3, 2, figsize=(10, 9), sharex=True)
@@ -290,6 +388,7 @@ for fix_penalty in np.arange(0, penalty + 1, 2):
     [results, metrics, XY] = run_tz(
         agent, optimizer, task, p, n_examples_test,
         supervised=False, learning=False, get_data=True,
+        record_cache=True,
         fix_cond=fix_cond, fix_penalty=fix_penalty,
         slience_recall_time=slience_recall_time, scramble=scramble,
     )
@@ -301,4 +400,5 @@ for fix_penalty in np.arange(0, penalty + 1, 2):
         n_examples_test, fix_cond, scramble)
     test_data_dict = {'results': results, 'metrics': metrics, 'XY': XY}
     fpath = os.path.join(test_data_dir, test_data_fname)
-    pickle_save_dict(test_data_dict, fpath)
+    save_columnar(
+        get_columnar_path(fpath), *test_data_to_columns(test_data_dict, p))
@@ -4,7 +4,14 @@ ALL_SUBDIRS = ['ckpts', 'data', 'figs']
 
 # file name templates
 CKPT_TEMPLATE = 'ckpt_ep-%d.pt'
+# the TorchScript export of a ckpt, see models.scripted
+SCRIPTED_TEMPLATE = 'scripted_ep-%d.pt'
+# the state of a training run that is not in the ckpt, see utils.io
+TRAIN_STATE_TEMPLATE = 'train-state_ep-%d.pkl'
 CACHE_FNAME = 'testing_info.pkl'
+# the columnar test data, a dir of .npy files, see utils.io.save_columnar
+COLUMNAR_EXT = '.cols'
+COLUMNAR_META_FNAME = 'meta.json'
 
 ENV_JSON_FNAME = 'params_env.json'
 NET_JSON_FNAME = 'params_net.json'
@@ -1,11 +1,15 @@
 import os
+import re
 import torch
 import json
 import pickle
+import hashlib
+import numpy as np
 
 from copy import deepcopy
 from utils.utils_u import vprint
-from utils.constants import CKPT_TEMPLATE, ALL_SUBDIRS, NET_JSON_FNAME
+from utils.constants import CKPT_TEMPLATE, ALL_SUBDIRS, NET_JSON_FNAME, \
+    COLUMNAR_EXT, COLUMNAR_META_FNAME, SCRIPTED_TEMPLATE, TRAIN_STATE_TEMPLATE
 
 """helper func, ckpt io
 """
@@ -100,6 +104,79 @@ def load_ckpt(
     return None, None
 
 
+def save_train_state(
+    cur_epoch, log_path, train_state,
+    train_state_template=TRAIN_STATE_TEMPLATE
+):
+    """save the state of a training run that is not in the ckpt (e.g. the
+    logs, the lr schedulers, the rng states), next to the ckpt of cur_epoch,
+    s.t. the run can be resumed from that ckpt, see `load_train_state`
+    """
+    fpath = os.path.join(log_path, train_state_template % cur_epoch)
+    pickle_save_dict(train_state, fpath)
+
+
+def load_train_state(
+    epoch_load, log_path,
+    train_state_template=TRAIN_STATE_TEMPLATE
+):
+    """load the state saved by `save_train_state`, None if there is none,
+    e.g. for a ckpt saved w/o it
+    """
+    fpath = os.path.join(log_path, train_state_template % epoch_load)
+    if not os.path.exists(fpath):
+        return None
+    return pickle_load_dict(fpath)
+
+
+def load_scripted_ckpt(
+    epoch_load, log_path, agent,
+    ckpt_template=CKPT_TEMPLATE, scripted_template=SCRIPTED_TEMPLATE
+):
+    """load the TorchScript export of a ckpt, for inference
+    - the export is made from `agent` (w/ the ckpt loaded, see `load_ckpt`)
+    and saved next to the ckpt, if it doesn't exist or is older than the ckpt
+
+    Returns
+    -------
+    models.scripted.ScriptedLCALSTM
+        the scripted agent, see `exp_tz.run_tz_eval`
+
+    """
+    from models.scripted import export_agent, ScriptedLCALSTM
+    ckpt_fpath = os.path.join(log_path, ckpt_template % epoch_load)
+    scripted_fpath = os.path.join(log_path, scripted_template % epoch_load)
+    stale = not os.path.exists(scripted_fpath) or (
+        os.path.exists(ckpt_fpath) and
+        os.path.getmtime(scripted_fpath) < os.path.getmtime(ckpt_fpath)
+    )
+    if stale:
+        # write, then rename, s.t. concurrent loaders never see a partial file
+        tmp_fpath = f'{scripted_fpath}.{os.getpid()}'
+        export_agent(agent, tmp_fpath)
+        os.replace(tmp_fpath, scripted_fpath)
+    return ScriptedLCALSTM(torch.jit.load(scripted_fpath))
+
+
+def get_latest_ckpt_epoch(
+    log_path, max_epoch=None,
+    ckpt_template=CKPT_TEMPLATE
+):
+    """get the epoch of the latest checkpoint in log_path (up to max_epoch),
+    None if there is no checkpoint"""
+    if not os.path.exists(log_path):
+        return None
+    ckpt_regex = re.escape(ckpt_template).replace('%d', r'(\d+)')
+    epochs = [
+        int(m.group(1)) for m in
+        [re.fullmatch(ckpt_regex, fname) for fname in os.listdir(log_path)]
+        if m is not None
+    ]
+    if max_epoch is not None:
+        epochs = [epoch for epoch in epochs if epoch <= max_epoch]
+    return max(epochs) if len(epochs) > 0 else None
+
+
 def save_all_params(datapath, params, args=None):
     msg = f'''Write experiment params and metadata to...
     {datapath}
@@ -187,6 +264,121 @@ def pickle_load_dict(fpath):
     return pickle.load(open(fpath, "rb"))
 
 
+def get_columnar_path(fpath):
+    """the columnar counterpart of a (pickle) data file path"""
+    return os.path.splitext(fpath)[0] + COLUMNAR_EXT
+
+
+def test_data_exists(fpath):
+    """whether the data exists, in either the pickle or the columnar format"""
+    return os.path.exists(get_columnar_path(fpath)) or os.path.exists(fpath)
+
+
+def save_columnar(dirpath, columns, meta=None):
+    """save a set of arrays as a directory of .npy files, one for each array,
+    so that each array can be loaded (or memory-mapped) separately
+
+    Parameters
+    ----------
+    dirpath : str
+        the dir path
+    columns : dict
+        name -> array
+    meta : dict
+        json serializable metadata
+
+    """
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath, exist_ok=True)
+    # the meta file is written last, it marks the data as complete
+    meta_fpath = os.path.join(dirpath, COLUMNAR_META_FNAME)
+    if os.path.exists(meta_fpath):
+        os.remove(meta_fpath)
+    for name, column in columns.items():
+        np.save(os.path.join(dirpath, name + '.npy'), np.asarray(column))
+    meta = {} if meta is None else meta
+    meta['columns'] = list(columns.keys())
+    with open(meta_fpath, 'w') as f:
+        json.dump(meta, f)
+
+
+def load_columnar(dirpath, names=None, mmap_mode='r'):
+    """load the arrays saved by `save_columnar`
+
+    Parameters
+    ----------
+    dirpath : str
+        the dir path
+    names : list
+        the arrays to load, if None, load all arrays
+    mmap_mode : str
+        see np.load, if None, read the arrays into memory
+
+    Returns
+    -------
+    dict, dict
+        name -> array, for all names; the metadata
+
+    """
+    with open(os.path.join(dirpath, COLUMNAR_META_FNAME), 'r') as f:
+        meta = json.load(f)
+    if names is None:
+        names = meta['columns']
+    columns = {
+        name: np.load(os.path.join(dirpath, name + '.npy'), mmap_mode=mmap_mode)
+        for name in names
+    }
+    return columns, meta
+
+
+def load_columnar_meta(dirpath):
+    """load the metadata saved by `save_columnar`, None if there is no
+    (complete) data in dirpath
+    """
+    meta_fpath = os.path.join(dirpath, COLUMNAR_META_FNAME)
+    if not os.path.exists(meta_fpath):
+        return None
+    with open(meta_fpath, 'r') as f:
+        return json.load(f)
+
+
+def hash_file(fpath, chunk_size=2 ** 20):
+    """the sha1 hex digest of the content of a file"""
+    sha1 = hashlib.sha1()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_test_config_key(ckpt_fpath, test_config):
+    """a key for the test data generated by a checkpoint under a test config,
+    s.t. the data can be reused iff the weights and the config are the same
+
+    Parameters
+    ----------
+    ckpt_fpath : str
+        the checkpoint file
+    test_config : dict
+        all params that affect the test data, json serializable (or str-able)
+
+    Returns
+    -------
+    str
+        the key
+
+    """
+    config_str = json.dumps(test_config, sort_keys=True, default=str)
+    key_str = hash_file(ckpt_fpath) + config_str
+    return hashlib.sha1(key_str.encode()).hexdigest()
+
+
+def test_data_cached(fpath, config_key):
+    """whether the columnar data at fpath was generated w/ config_key"""
+    meta = load_columnar_meta(get_columnar_path(fpath))
+    return meta is not None and meta.get('config_key') == config_key
+
+
 def pickle_save_df(input_df, save_path):
     """Save panda dataframe.
 
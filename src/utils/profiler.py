@@ -0,0 +1,184 @@
+"""opt-in timing and counting of the phases of run_tz
+notes:
+- the phases are timed w/ `with profiler.phase(name):`, the em retrieval and
+encoding are timed by wrapping the em methods during the forward pass, see
+`Profiler.watch_em`, so they are sub-phases of 'forward'
+- the default is `NULL_PROFILER`, whose methods do nothing, s.t. a run that
+is not profiled pays for a few no-op calls per time step
+- torch ops are asynchronous on gpu, the phase times are only exact on cpu
+"""
+import time
+import torch
+import numpy as np
+from contextlib import nullcontext
+
+# the phases of run_tz, 'em_retrieval' and 'em_encoding' are part of 'forward'
+PHASES = [
+    'sample', 'forward', 'em_retrieval', 'em_encoding', 'action', 'loss',
+    'backward', 'step', 'logging',
+]
+# the counters
+# - n_steps: the number of time steps, summed over the examples
+# - n_retrievals / n_encodings: the number of memories retrieved / saved
+# - em_occupancy: the mean #memories searched per retrieval
+# - bytes_cached: the size of the returned cache
+COUNTERS = [
+    'n_examples', 'n_steps', 'n_retrievals', 'n_encodings', 'em_occupancy',
+    'bytes_cached',
+]
+# the keys of `Profiler.summary`
+FIELDS = ['time_' + phase for phase in PHASES] + ['time_total'] + COUNTERS
+
+
+class _Phase():
+    """the context manager that adds its runtime to `times[name]`"""
+
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self.time0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.times[self.name] += time.perf_counter() - self.time0
+
+
+class Profiler():
+    """times and counts the phases of an epoch, e.g.
+
+        profiler = Profiler()
+        run_tz(..., profiler=profiler)
+        profiler.summary()
+
+    the totals accumulate over calls until `reset`
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.times = dict.fromkeys(PHASES, 0.)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self._n_stored = 0
+        self._phases = {name: _Phase(self.times, name) for name in PHASES}
+        self._time0 = time.perf_counter()
+
+    def phase(self, name):
+        return self._phases[name]
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def count_cache(self, log_cache):
+        self.counts['bytes_cached'] += get_nbytes(log_cache)
+
+    def watch_em(self, em):
+        """a reusable context, in which the retrievals and encodings of em (an
+        EM or an EMBatch) are timed and counted, by shadowing its methods
+        """
+        return _WatchEM(self, em)
+
+    def summary(self):
+        """the total time (sec) of each phase and the counters, since the
+        last reset, see FIELDS
+        """
+        out = {'time_' + phase: self.times[phase] for phase in PHASES}
+        out['time_total'] = time.perf_counter() - self._time0
+        out.update(self.counts)
+        n_retrievals = max(self.counts['n_retrievals'], 1)
+        out['em_occupancy'] = self._n_stored / n_retrievals
+        return out
+
+    def format(self):
+        """a one line summary, the share of time of each phase"""
+        summary = self.summary()
+        time_total = max(summary['time_total'], 1e-12)
+        msg = ' '.join([
+            '%s: %.0f%%' % (phase, 100 * self.times[phase] / time_total)
+            for phase in PHASES
+        ])
+        msg += ' | rcl: %d, enc: %d, occ: %.1f, cache: %.1fMB' % (
+            summary['n_retrievals'], summary['n_encodings'],
+            summary['em_occupancy'], summary['bytes_cached'] / 2 ** 20)
+        return msg
+
+
+class _NullProfiler():
+    """the profiler of an unprofiled run, it does nothing"""
+
+    def phase(self, name):
+        return _NULL_CONTEXT
+
+    def count(self, name, n=1):
+        pass
+
+    def count_cache(self, log_cache):
+        pass
+
+    def watch_em(self, em):
+        return _NULL_CONTEXT
+
+
+_NULL_CONTEXT = nullcontext()
+NULL_PROFILER = _NullProfiler()
+
+
+class _WatchEM():
+    """the context in which the retrievals and encodings of em are timed and
+    counted, the wrappers are made once, s.t. entering is cheap
+    """
+
+    def __init__(self, profiler, em):
+        self.em = em
+        get_memory, save_memory = em.get_memory, em.save_memory
+
+        def timed_get_memory(input_pattern, *args, **kwargs):
+            n_stored = [
+                len(em_b) for em_b in _get_lanes(em, len(input_pattern))
+                if not em_b.retrieval_off and len(em_b) > 0
+            ]
+            profiler.counts['n_retrievals'] += len(n_stored)
+            profiler._n_stored += sum(n_stored)
+            with profiler.phase('em_retrieval'):
+                return get_memory(input_pattern, *args, **kwargs)
+
+        def timed_save_memory(val):
+            profiler.counts['n_encodings'] += sum([
+                not em_b.encoding_off for em_b in _get_lanes(em, len(val))])
+            with profiler.phase('em_encoding'):
+                return save_memory(val)
+        self.methods = timed_get_memory, timed_save_memory
+
+    def __enter__(self):
+        # instance attributes shadow the methods
+        self.em.get_memory, self.em.save_memory = self.methods
+
+    def __exit__(self, *exc):
+        del self.em.get_memory, self.em.save_memory
+
+
+def _get_lanes(em, n):
+    """the EMs used by a call w/ n input rows"""
+    if hasattr(em, 'lanes'):
+        return em.lanes[:n]
+    return [em]
+
+
+def get_nbytes(obj, seen=None):
+    """the total size of the tensors and arrays in a (nested) cache, each
+    object is counted once, e.g. the memory snapshots shared by time steps
+    """
+    seen = set() if seen is None else seen
+    if obj is None or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if torch.is_tensor(obj):
+        return obj.element_size() * obj.nelement()
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (list, tuple)):
+        return sum([get_nbytes(x, seen) for x in obj])
+    if hasattr(obj, '__dict__'):
+        return get_nbytes(list(vars(obj).values()), seen)
+    return 0
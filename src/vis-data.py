@@ -14,11 +14,11 @@ from task import SequenceLearning
 from utils.utils_u import to_np
 from utils.params import P
 from utils.constants import TZ_COND_DICT
-from utils.io import build_log_path, get_test_data_dir, \
-    pickle_load_dict, get_test_data_fname, pickle_save_dict, load_env_metadata
+from utils.io import build_log_path, get_test_data_dir, test_data_exists, \
+    get_test_data_fname, pickle_save_dict, load_env_metadata
 from analysis import compute_acc, compute_dk, compute_stats, remove_none, \
     compute_cell_memory_similarity, create_sim_dict, compute_mistake, \
-    batch_compute_true_dk, process_cache, get_trial_cond_ids, \
+    batch_compute_true_dk, load_test_data, get_trial_cond_ids, \
     compute_n_trials_to_skip, compute_cell_memory_similarity_stats, \
     sep_by_qsource, get_qsource, trim_data, compute_roc, get_hist_info
 from analysis.task import get_oq_keys
@@ -184,7 +184,7 @@ for penalty_train in penaltys_train:
                     test_data_subdir, f'enc_size_test-{enc_size_test}')
             fpath = os.path.join(test_data_dir, test_data_fname)
             # skip if no data
-            if not os.path.exists(fpath):
+            if not test_data_exists(fpath):
                 print('DNE')
                 continue
 
@@ -193,9 +193,10 @@ for penalty_train in penaltys_train:
             if not os.path.exists(fig_dir):
                 os.makedirs(fig_dir)
 
-            test_data_dict = pickle_load_dict(fpath)
-            [dist_a_, Y_, log_cache_, log_cond_] = test_data_dict['results']
-            [X_raw, Y_raw] = test_data_dict['XY']
+            test_signals = [
+                'dist_a', 'targ_a', 'cond', 'X', 'C', 'CM', 'DA', 'inpt', 'V']
+            test_data = load_test_data(fpath, p, signals=test_signals)
+            log_cond_ = test_data['cond']
 
             '''precompute some constants'''
 
@@ -213,15 +214,13 @@ for penalty_train in penaltys_train:
             n_trials = n_examples_test - n_examples_skip
             trial_id = np.arange(n_trials)
 
-            data_to_trim = [dist_a_, Y_, log_cond_, log_cache_, X_raw]
-            [dist_a, Y, log_cond, log_cache, X_raw] = trim_data(
+            data_to_trim = [test_data[name] for name in test_signals]
+            [dist_a, Y, log_cond, X_raw, C, CM, DA, inpt, V] = trim_data(
                 n_examples_skip, data_to_trim)
             X_raw = np.array(X_raw)
 
             # process the data
             cond_ids = get_trial_cond_ids(log_cond)
-            [C, H, M, CM, DA, V], [inpt] = process_cache(
-                log_cache, T_total, p)
             # compute ground truth / objective uncertainty, delay phase removed
             true_dk_wm, true_dk_em = batch_compute_true_dk(X_raw, task)
             q_source = get_qsource(true_dk_em, true_dk_wm, cond_ids, p)
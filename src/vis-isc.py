@@ -3,18 +3,18 @@ import dabest
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from scipy.stats import pearsonr
 from task import SequenceLearning
 from utils.params import P
 from utils.constants import TZ_COND_DICT
-from utils.io import build_log_path, pickle_load_dict, \
+from utils.io import build_log_path, \
     get_test_data_dir, get_test_data_fname
 from analysis import compute_stats, \
     compute_cell_memory_similarity, create_sim_dict, batch_compute_true_dk, \
-    process_cache, get_trial_cond_ids, trim_data, make_df
+    load_test_data, get_trial_cond_ids, trim_data, make_df
+from analysis.isc import compute_pairwise_sisc, compute_pairwise_tisc, \
+    compute_pairwise_sw_tisc, pearsonr_rows, get_subj_pairs
 from brainiak.funcalign.srm import SRM
 from matplotlib.ticker import FormatStrFormatter
-from itertools import combinations
 from scipy.special import comb
 
 sns.set(style='white', palette='colorblind', context='poster')
@@ -103,12 +103,11 @@ for subj_id in subj_ids:
         test_data_fname = get_test_data_fname(n_examples_test, fix_cond)
         fpath = os.path.join(test_data_dir, test_data_fname)
 
-        test_data_dict = pickle_load_dict(fpath)
-        results = test_data_dict['results']
-        XY = test_data_dict['XY']
-
-        [dist_a_, Y_, log_cache_, log_cond_] = results
-        [X_raw, Y_raw] = XY
+        test_signals = [
+            'dist_a', 'targ_a', 'cond', 'X', 'C', 'CM', 'DA', 'inpt', 'V']
+        test_data = load_test_data(fpath, p, signals=test_signals)
+        [dist_a_, Y_, log_cond_, X_raw, C_, CM_, DA_, inpt_, V_] = [
+            test_data[name] for name in test_signals]
 
         # compute ground truth / objective uncertainty (delay phase removed)
         true_dk_wm_, true_dk_em_ = batch_compute_true_dk(X_raw, task)
@@ -128,15 +127,13 @@ for subj_id in subj_ids:
         n_examples_skip = n_event_remember
         n_examples = n_examples_test - n_examples_skip
         data_to_trim = [
-            dist_a_, Y_, log_cond_, log_cache_, true_dk_wm_, true_dk_em_
+            dist_a_, Y_, log_cond_, true_dk_wm_, true_dk_em_,
+            C_, CM_, DA_, inpt_, V_
         ]
-        [dist_a, Y, log_cond, log_cache, true_dk_wm, true_dk_em] = trim_data(
-            n_examples_skip, data_to_trim)
+        [dist_a, Y, log_cond, true_dk_wm, true_dk_em, C, CM, DA, inpt, V] = \
+            trim_data(n_examples_skip, data_to_trim)
         # process the data
         cond_ids = get_trial_cond_ids(log_cond)
-        activity_, ctrl_param_ = process_cache(log_cache, T_total, p)
-        [C, H, M, CM, DA, V] = activity_
-        [inpt] = ctrl_param_
         comp_val = .8
         leak_val = 0
         comp = np.full(np.shape(inpt), comp_val)
@@ -234,50 +231,6 @@ for i, cond in enumerate(all_conds):
 
 
 '''Inter-subject pattern correlation, RM vs. cond'''
-
-
-def compute_bs_bc_trsm(data_te_srm_rm_i, data_te_srm_xm_i, return_mean=True):
-    _, m_, n_ = np.shape(data_te_srm_rm_i)
-    bs_bc_trsm = []
-    # loop over subject i-j combinations
-    for (i_s, j_s) in combinations(range(n_subjs), 2):
-        bs_bc_trsm.append(
-            np.corrcoef(
-                data_te_srm_rm_i[i_s].T,
-                data_te_srm_xm_i[j_s].T
-            )[:n_, n_:]
-        )
-    if return_mean:
-        return np.mean(bs_bc_trsm, axis=0)
-    return bs_bc_trsm
-
-
-def compute_bs_bc_isc(
-    data_te_srm_rm_i, data_te_srm_xm_i,
-    win_size=5, return_mean=True,
-):
-    '''
-    compute average isc acorss all subject pairs
-    for the same trial, for two condition
-    '''
-    isc_mu = []
-    for (i_s, j_s) in combinations(range(n_subjs), 2):
-        isc_mu_ij = []
-        # compute sliding window averages
-        for t in np.arange(T_part, T_total - win_size):
-            isc_mu_ij.append(
-                np.mean(np.diag(np.corrcoef(
-                    data_te_srm_rm_i[i_s][:, t: t + win_size],
-                    data_te_srm_xm_i[j_s][:, t: t + win_size]
-                )[dim_srm:, :dim_srm]))
-            )
-        isc_mu_ij = np.array(isc_mu_ij)
-        isc_mu.append(isc_mu_ij)
-    if return_mean:
-        return np.mean(isc_mu, axis=0)
-    return isc_mu
-
-
 win_size = 5
 bs_bc_sisc = {rcn: {cn: [] for cn in all_conds} for rcn in all_conds}
 bs_bc_tisc = {rcn: {cn: [] for cn in all_conds} for rcn in all_conds}
@@ -285,40 +238,22 @@ bs_bc_sw_tisc = {rcn: {cn: [] for cn in all_conds} for rcn in all_conds}
 
 for i_rc, ref_cond in enumerate(all_conds):
     for i_c, cond in enumerate(all_conds):
-        # pick a trial
         if i_c >= i_rc:
-            for i in range(n_examples_te):
-                # for this trial ...
-                data_te_srm_rm_i = X_test_srm[ref_cond][i]
-                data_te_srm_xm_i = X_test_srm[cond][i]
-
-                # compute inter-subject inter-condition pattern corr
-                bs_bc_trsm_c_i = compute_bs_bc_trsm(
-                    data_te_srm_rm_i, data_te_srm_xm_i,
-                    return_mean=False
-                )
-                # only extract the diag entries (t to t)
-                bs_bc_sisc[ref_cond][cond].append(
-                    [np.diag(sisc_mat_ij) for sisc_mat_ij in bs_bc_trsm_c_i]
-                )
-
-                # compute isc
-                bs_bc_tisc_c_i = compute_bs_bc_trsm(
-                    np.transpose(data_te_srm_rm_i, axes=(0, 2, 1)),
-                    np.transpose(data_te_srm_xm_i, axes=(0, 2, 1)),
-                    return_mean=False
-                )
-                bs_bc_tisc[ref_cond][cond].append(
-                    [np.diag(tisc_mat_ij) for tisc_mat_ij in bs_bc_tisc_c_i]
-                )
-
-                # sw-isc
-                bs_bc_sw_tisc[ref_cond][cond].append(
-                    compute_bs_bc_isc(
-                        data_te_srm_rm_i, data_te_srm_xm_i, win_size,
-                        return_mean=False
-                    )
-                )
+            # for all trials, n_examples_te x n_subjs x dim_srm x T_total
+            data_te_srm_rm = X_test_srm[ref_cond]
+            data_te_srm_xm = X_test_srm[cond]
+            # compute inter-subject inter-condition pattern corr (t to t),
+            # for all subject pairs, n_examples_te x n_pairs x T_total
+            bs_bc_sisc[ref_cond][cond] = compute_pairwise_sisc(
+                data_te_srm_rm, data_te_srm_xm)
+            # compute isc, n_examples_te x n_pairs x dim_srm
+            bs_bc_tisc[ref_cond][cond] = compute_pairwise_tisc(
+                data_te_srm_rm, data_te_srm_xm)
+            # sw-isc, over part 2
+            bs_bc_sw_tisc[ref_cond][cond] = compute_pairwise_sw_tisc(
+                data_te_srm_rm, data_te_srm_xm, win_size,
+                t_start=T_part, t_stop=T_total
+            )
 
 
 '''plot spatial pattern isc '''
@@ -464,43 +399,30 @@ r_se_tisc = {cond: None for cond in has_memory_conds}
 
 for cond in has_memory_conds:
 
-    rmdm_sisc = np.zeros((n_subj_pairs, n_examples_te, T_part))
-    rmdm_tisc = np.zeros((n_subj_pairs, n_examples_te, T_part - win_size))
-
-    for i in range(n_examples_te):
-        # for this trial ...
-        data_te_srm_rm_i = X_test_srm['RM'][i]
-        data_te_srm_dm_i = X_test_srm[cond][i]
-        # compute inter-subject inter-condition pattern corr
-        rmdm_sisc_i = compute_bs_bc_trsm(
-            data_te_srm_rm_i, data_te_srm_dm_i, return_mean=False
-        )
-        rmdm_sisc_i_diag = np.array([np.diag(mat) for mat in rmdm_sisc_i])
-        rmdm_sisc[:, i, :] = rmdm_sisc_i_diag[:, T_part:]
-
-        # isc
-        rmdm_tisc[:, i, :] = compute_bs_bc_isc(
-            data_te_srm_rm_i, data_te_srm_dm_i, win_size, return_mean=False
-        )
+    # n_pairs x n_examples_te x T_part
+    rmdm_sisc = np.swapaxes(compute_pairwise_sisc(
+        X_test_srm['RM'], X_test_srm[cond]), 0, 1)[:, :, T_part:]
+    # n_pairs x n_examples_te x (T_part - win_size)
+    rmdm_tisc = np.swapaxes(compute_pairwise_sw_tisc(
+        X_test_srm['RM'], X_test_srm[cond], win_size,
+        t_start=T_part, t_stop=T_total
+    ), 0, 1)
 
     tma_dm_p2_test = tma[cond][:, T_part:, n_examples_tr:]
-    recall = np.zeros((n_subj_pairs, n_examples_te, T_part))
-    for i_comb, (i_s, j_s) in enumerate(combinations(range(n_subjs), 2)):
-        recall_ij = tma_dm_p2_test[i_s] + tma_dm_p2_test[j_s] / 2
-        recall[i_comb] = recall_ij.T
+    i_subjs, j_subjs = get_subj_pairs(n_subjs)
+    recall_ij = tma_dm_p2_test[i_subjs] + tma_dm_p2_test[j_subjs] / 2
+    recall = np.swapaxes(recall_ij, 1, 2)
 
     for t in range(n_tps):
         sisc_change_t = rmdm_sisc[:, :, t + 1] - rmdm_sisc[:, :, t]
-        for i_comb in range(n_subj_pairs):
-            r_val_sisc[cond][i_comb, t], p_val_sisc[cond][i_comb, t] = pearsonr(
-                recall[i_comb, :, t], sisc_change_t[i_comb])
+        r_val_sisc[cond][:, t], p_val_sisc[cond][:, t] = pearsonr_rows(
+            recall[:, :, t], sisc_change_t)
 
     for t in range(n_tps - win_size):
         tisc_change_t = rmdm_tisc[:, :, t + 1] - rmdm_tisc[:, :, t]
         recall_win_t = np.mean(recall[:, :, t:t + win_size], axis=-1)
-        for i_comb in range(n_subj_pairs):
-            r_val_tisc[cond][i_comb, t], p_val_tisc[cond][i_comb, t] = pearsonr(
-                recall_win_t[i_comb], tisc_change_t[i_comb])
+        r_val_tisc[cond][:, t], p_val_tisc[cond][:, t] = pearsonr_rows(
+            recall_win_t, tisc_change_t)
 
     r_mu_sisc[cond], r_se_sisc[cond] = compute_stats(r_val_sisc[cond])
     r_mu_tisc[cond], r_se_tisc[cond] = compute_stats(r_val_tisc[cond])